@@ -0,0 +1,129 @@
+import heapq
+import math
+import os
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SUMMARY_TOP_N = int(os.getenv('SUMMARY_TOP_N', '10'))
+SUMMARY_GV_BINS = int(os.getenv('SUMMARY_GV_BINS', '10'))
+
+TOP_FIELDS = ('id', 'signature', 'description', 'energetic_value', 'gv', 'level', 'potencyType', 'potency')
+
+
+def _field_values(rate_analysis, field: str) -> list:
+    """Values of one field, from a list of row dicts or a columnar block (share_codec.read_columnar)"""
+    if isinstance(rate_analysis, dict):
+        values = rate_analysis["values"].get(field)
+        return values if values is not None else [None] * rate_analysis["count"]
+    return [row.get(field) for row in rate_analysis]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def _numeric_column(values: list):
+    """Values as float64, None/non-numbers become NaN (a list of floats without numpy)"""
+    if np is None:
+        return [float(v) if _is_number(v) else math.nan for v in values]
+    return np.fromiter(
+        (v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in values),
+        dtype=np.float64,
+        count=len(values)
+    )
+
+
+def _numbers(values) -> list:
+    """The non-NaN values of a _numeric_column()"""
+    if np is None:
+        return [v for v in values if not math.isnan(v)]
+    return values[~np.isnan(values)]
+
+
+def _value_counts(values: list) -> dict:
+    labels = [str(v) if v is not None else 'none' for v in values]
+    if np is None:
+        return dict(sorted(Counter(labels).items()))
+    values = np.array(labels, dtype=object)
+    if values.size == 0:
+        return {}
+    labels, counts = np.unique(values, return_counts=True)
+    return {str(label): int(count) for label, count in zip(labels, counts)}
+
+
+def _stats(values) -> dict:
+    values = _numbers(values)
+    if len(values) == 0:
+        return {"count": 0, "min": None, "max": None, "mean": None}
+    if np is None:
+        return {"count": len(values), "min": min(values), "max": max(values), "mean": math.fsum(values) / len(values)}
+    return {
+        "count": int(values.size),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "mean": float(values.mean())
+    }
+
+
+def _top_indices(energetic, n: int) -> list:
+    """Indices of the n largest energetic values, rows without a value sort last"""
+    if np is None:
+        return heapq.nsmallest(n, range(len(energetic)), key=lambda i: -energetic[i] if _is_number(energetic[i]) else math.inf)
+    ranked = np.where(np.isnan(energetic), -np.inf, energetic)
+    idx = np.argpartition(-ranked, n - 1)[:n]
+    return idx[np.argsort(-ranked[idx], kind='stable')].tolist()
+
+
+def _histogram(values, bins: int) -> dict:
+    """Same bins as numpy.histogram(values, bins): equal width over [min, max], the last one closed"""
+    if len(values) == 0:
+        return {"edges": [], "counts": []}
+    if np is not None:
+        counts, edges = np.histogram(values, bins=bins)
+        return {"edges": edges.tolist(), "counts": counts.tolist()}
+    low, high = min(values), max(values)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return {"edges": [low + i * width for i in range(bins)] + [high], "counts": counts}
+
+
+def summarize_rate_analysis(rate_analysis, top_n: int = None, gv_bins: int = None) -> dict:
+    """
+    Summary of one analysis' rate_analysis rows (as built for the share payload, rows or columnar block):
+    top-N rows by energetic_value, gv histogram, value stats and level/potency counts.
+    """
+    top_n = top_n or SUMMARY_TOP_N
+    gv_bins = gv_bins or SUMMARY_GV_BINS
+    count = rate_analysis["count"] if isinstance(rate_analysis, dict) else len(rate_analysis)
+    energetic = _numeric_column(_field_values(rate_analysis, 'energetic_value'))
+    gv = _numeric_column(_field_values(rate_analysis, 'gv'))
+
+    # Top-N by energetic_value
+    top = []
+    if count:
+        idx = _top_indices(energetic, min(top_n, count))
+        if isinstance(rate_analysis, dict):
+            top_columns = {field: _field_values(rate_analysis, field) for field in TOP_FIELDS}
+            top = [{field: top_columns[field][i] for field in TOP_FIELDS} for i in idx]
+        else:
+            top = [{field: rate_analysis[i].get(field) for field in TOP_FIELDS} for i in idx]
+
+    gv_histogram = _histogram(_numbers(gv), gv_bins)
+
+    return {
+        "count": count,
+        "top": top,
+        "energetic_value": _stats(energetic),
+        "gv": _stats(gv),
+        "gv_histogram": gv_histogram,
+        "level_counts": _value_counts(_field_values(rate_analysis, 'level')),
+        "potency_type_counts": _value_counts(_field_values(rate_analysis, 'potencyType'))
+    }
@@ -0,0 +1,87 @@
+"""
+Compare the old share payload encoding (convert_datetimes() copy + stdlib json)
+with fastjson (orjson when installed) on a synthetic large session.
+
+    python benchmarks/bench_json.py [analyses] [rates_per_analysis]
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# Load fastjson.py on its own, importing the plugin package would need the host app
+_spec = importlib.util.spec_from_file_location(
+    'fastjson', os.path.join(os.path.dirname(__file__), '..', 'fastjson.py')
+)
+fastjson = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(fastjson)
+
+
+def convert_datetimes(obj):
+    # The recursive copy the share route used before fastjson
+    if isinstance(obj, dict):
+        return {k: convert_datetimes(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_datetimes(i) for i in obj]
+    elif isinstance(obj, datetime):
+        return obj.isoformat()
+    else:
+        return obj
+
+
+def build_payload(analyses: int, rates: int) -> dict:
+    now = datetime.now()
+    return {
+        "status": "success",
+        "data": {
+            "session_id": 1,
+            "key": "bench",
+            "analyses": {
+                "session": {"id": 1, "created": now},
+                "case": {"id": 1, "created": now, "last_change": now},
+                "analyses": [
+                    {
+                        "analysis": {"id": a, "created": now, "target_gv": 1000},
+                        "catalog": {"id": 1, "name": "catalog"},
+                        "rates": [
+                            {"id": r, "signature": f"rate {r}", "description": None, "catalog_id": 1}
+                            for r in range(rates)
+                        ],
+                        "rate_analysis": [
+                            {
+                                "id": r, "signature": f"rate {r}", "description": None, "catalog_id": 1,
+                                "analysis_id": a, "energetic_value": r % 1000, "gv": r % 2000, "level": r % 9,
+                                "potencyType": "C", "potency": 30, "note": None
+                            }
+                            for r in range(rates)
+                        ]
+                    }
+                    for a in range(analyses)
+                ]
+            }
+        }
+    }
+
+
+def timed(fn, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    analyses = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rates = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    payload = build_payload(analyses, rates)
+    old = timed(lambda: json.dumps(convert_datetimes(payload)).encode('utf-8'))
+    new = timed(lambda: fastjson.dumps(payload))
+    size = len(fastjson.dumps(payload))
+    print(f"{analyses} analyses x {rates} rates, {size / 1e6:.1f} MB")
+    print(f"convert_datetimes + json.dumps: {old * 1000:8.1f} ms")
+    print(f"fastjson.dumps ({'orjson' if fastjson.orjson else 'stdlib'}): {new * 1000:8.1f} ms  ({old / new:.1f}x)")
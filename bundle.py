@@ -0,0 +1,345 @@
+"""
+Session bundles: a single file holding a whole session (case, session, analyses,
+catalogs, rates, rate_analysis) for moving it between machines without the server.
+
+Layout (all integers little endian):
+    MAGIC
+    frame*          zlib-compressed JSON array of rows of one section
+    index           zlib-compressed JSON {"version", "meta", "frames": [{"section", "offset", "length", "rows"}]}
+    footer          index offset (u64), index length (u64), MAGIC
+
+Frames are written as soon as their rows are read, so a bundle can be streamed to
+the client while it is being built; the index at the end lets a reader jump to any
+section without decompressing the others.
+"""
+import mmap
+import sqlite3
+import struct
+import zlib
+
+from .fastjson import dumps, loads
+
+MAGIC = b'AOSBNDL1'
+FOOTER = struct.Struct('<QQ8s')
+FRAME_ROWS = 5000
+BUNDLE_VERSION = 1
+
+# Order matters: parents before children, so ids can be remapped on import
+SECTIONS = ('case', 'session', 'catalog', 'rate', 'analysis', 'rate_analysis')
+
+# Candidate table names in aetherone.db, first existing one wins
+TABLE_CANDIDATES = {
+    'case': ('cases', 'case'),
+    'session': ('sessions', 'session'),
+    'catalog': ('catalog', 'catalogs'),
+    'rate': ('rates', 'rate'),
+    'analysis': ('analysis', 'analyses'),
+    'rate_analysis': ('rate_analysis', 'rateAnalysis', 'rate_analyses'),
+}
+
+# Foreign key attributes per section: (attribute spellings, referenced section)
+FOREIGN_KEYS = {
+    'session': [(('caseID', 'case_id', 'caseId'), 'case')],
+    'rate': [(('catalogID', 'catalog_id', 'catalogId'), 'catalog')],
+    'analysis': [(('sessionID', 'session_id', 'sessionId'), 'session'),
+                 (('catalogId', 'catalog_id', 'catalogID'), 'catalog')],
+    'rate_analysis': [(('analysis_id', 'analysisID', 'analysisId'), 'analysis'),
+                      (('catalog_id', 'catalogID', 'catalogId'), 'catalog')],
+}
+
+# DAO attribute names that differ from the column names
+ATTRIBUTE_ALIASES = {
+    'potency_type': 'potencyType',
+}
+
+# Parents a row may lose on import when the bundle does not hold them (a catalog that was
+# missing on export); any other foreign key without a row in the bundle is an error
+OPTIONAL_PARENTS = ('catalog',)
+
+
+class BundleError(Exception):
+    pass
+
+
+def _normalize(name: str) -> str:
+    """Spelling-independent column/attribute name: caseID, case_id and caseId are the same"""
+    return name.replace('_', '').lower()
+
+
+def object_row(obj) -> dict:
+    """DAO object (or dict) as a plain dict of its attributes"""
+    if isinstance(obj, dict):
+        return dict(obj)
+    return {k: v for k, v in vars(obj).items() if not k.startswith('_')}
+
+
+def iter_bundle(sections, meta: dict = None, frame_rows: int = FRAME_ROWS):
+    """
+    Yield the bytes of a bundle built from `sections`, an iterable of (section, rows iterable).
+    Rows are read lazily and flushed as compressed frames of up to frame_rows rows.
+    """
+    offset = 0
+    frames = []
+
+    def frame(section, rows):
+        nonlocal offset
+        data = zlib.compress(dumps(rows), 6)
+        frames.append({"section": section, "offset": offset, "length": len(data), "rows": len(rows)})
+        offset += len(data)
+        return data
+
+    yield MAGIC
+    offset += len(MAGIC)
+    for section, rows in sections:
+        batch = []
+        for row in rows:
+            batch.append(object_row(row))
+            if len(batch) >= frame_rows:
+                yield frame(section, batch)
+                batch = []
+        if batch:
+            yield frame(section, batch)
+
+    index = zlib.compress(dumps({"version": BUNDLE_VERSION, "meta": meta or {}, "frames": frames}), 6)
+    yield index
+    yield FOOTER.pack(offset, len(index), MAGIC)
+
+
+def _iter_children(db, name: str, parent_id):
+    """
+    Rows of db.list_<name>(parent_id). A DAO with iter_<name>() and fields() (SnapshotDAO) is read
+    in fetchmany() batches instead of as one list, so big rate lists are never held at once.
+    """
+    iterate = getattr(db, f'iter_{name}', None)
+    if iterate is None:
+        yield from getattr(db, f'list_{name}')(parent_id) or []
+        return
+    fields = db.fields(CHILD_SECTIONS[name])
+    for batch in iterate(parent_id, fields):
+        for values in batch:
+            yield dict(zip(fields, values))
+
+
+# DAO list/iter method suffix -> section of its rows
+CHILD_SECTIONS = {'rates_from_catalog': 'rate', 'rates_for_analysis': 'rate_analysis'}
+
+
+def session_sections(db, session_id: int):
+    """(section, rows) pairs of one session read through the AetherOnePy case DAO (or a SnapshotDAO)"""
+    session = db.get_session(session_id)
+    if not session:
+        raise BundleError(f"Session {session_id} not found")
+    case = db.get_case(session.caseID)
+    if not case:
+        raise BundleError(f"Case {session.caseID} of session {session_id} not found")
+    analyses = db.list_analysis(session.id) or []
+    catalog_ids = sorted({a.catalogId for a in analyses if getattr(a, 'catalogId', None) is not None})
+    catalogs = [c for c in (db.get_catalog(catalog_id) for catalog_id in catalog_ids) if c]
+    yield 'case', [case]
+    yield 'session', [session]
+    yield 'catalog', catalogs
+    for catalog in catalogs:
+        yield 'rate', _iter_children(db, 'rates_from_catalog', catalog.id)
+    yield 'analysis', analyses
+    for analysis in analyses:
+        yield 'rate_analysis', _iter_children(db, 'rates_for_analysis', analysis.id)
+
+
+class BundleReader:
+    """Reads a bundle file through mmap; frames are decompressed straight from the mapping"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise BundleError("Bundle file is empty")
+        size = len(self._map)
+        if size < len(MAGIC) + FOOTER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise BundleError("Not a session bundle")
+        index_offset, index_length, magic = FOOTER.unpack_from(self._map, size - FOOTER.size)
+        self._data_end = size - FOOTER.size
+        if magic != MAGIC or index_offset < len(MAGIC) or index_offset + index_length > self._data_end:
+            self.close()
+            raise BundleError("Bundle is truncated or corrupt")
+        try:
+            self.index = self._decode(index_offset, index_length, "index")
+            if not isinstance(self.index, dict):
+                raise BundleError("Bundle index is corrupt")
+            if self.index.get("version") != BUNDLE_VERSION:
+                raise BundleError(f"Unsupported bundle version {self.index.get('version')}")
+            frames = self.index.get("frames")
+            if not isinstance(frames, list):
+                raise BundleError("Bundle index has no frame list")
+            for frame in frames:
+                self._check_frame(frame, index_offset)
+        except BundleError:
+            self.close()
+            raise
+        self.meta = self.index.get("meta") or {}
+
+    def _check_frame(self, frame, data_end: int):
+        """A frame entry of the index must point inside the data between the magic and the index"""
+        if not isinstance(frame, dict) or not isinstance(frame.get("section"), str):
+            raise BundleError("Invalid frame entry in the bundle index")
+        offset, length = frame.get("offset"), frame.get("length")
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in (offset, length)) \
+                or offset < len(MAGIC) or length < 0 or offset + length > data_end:
+            raise BundleError(f"Frame of '{frame['section']}' lies outside the bundle data")
+
+    def _decode(self, offset: int, length: int, what: str):
+        """Decompress and parse length bytes at offset of the mapping; corrupt data is a BundleError"""
+        view = memoryview(self._map)
+        try:
+            return loads(zlib.decompress(view[offset:offset + length]))
+        except (zlib.error, ValueError) as e:
+            raise BundleError(f"Bundle {what} is corrupt: {e}")
+        finally:
+            view.release()
+
+    def rows(self, section: str):
+        """Yield the rows of one section, one frame at a time"""
+        for frame in self.index["frames"]:
+            if frame["section"] != section:
+                continue
+            rows = self._decode(frame["offset"], frame["length"], f"frame of '{section}'")
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise BundleError(f"Bundle frame of '{section}' does not hold rows")
+            yield from rows
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _resolve_table(conn, section: str):
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for name in TABLE_CANDIDATES[section]:
+        if name in existing:
+            return name
+    raise BundleError(f"No table for '{section}' in the target database")
+
+
+def _columns(conn, table: str) -> dict:
+    """lower-case column name -> column name"""
+    return {row[1].lower(): row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _column_lookup(columns: dict) -> dict:
+    """_normalize()d name -> column name, to match row keys of any spelling"""
+    return {_normalize(column): column for column in columns.values()}
+
+
+def import_bundle(path: str, db_path: str) -> dict:
+    """
+    Import a bundle into aetherone.db in one transaction. All rows get new ids (max(id) + n),
+    foreign keys are rewritten accordingly, catalogs that already exist by name are reused.
+    Returns counts per section and the new session id.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with BundleReader(path) as reader:
+            conn.execute('BEGIN IMMEDIATE')
+            id_maps = {}
+            counts = {}
+            reused_catalogs = set()
+            for section in SECTIONS:
+                table = _resolve_table(conn, section)
+                columns = _columns(conn, table)
+                by_name = _column_lookup(columns)
+                next_id = (conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{table}"').fetchone()[0]) + 1
+                id_map = id_maps.setdefault(section, {})
+                existing_catalogs = {}
+                if section == 'catalog' and 'name' in columns:
+                    existing_catalogs = {
+                        name: cid for cid, name in conn.execute(f'SELECT id, "{columns["name"]}" FROM "{table}"')
+                    }
+                # Rows grouped by the columns they have, so a column missing from some rows
+                # gets its default instead of the layout of whichever row came first
+                batches = {}
+                inserted = 0
+                for row in reader.rows(section):
+                    old_id = row.get('id')
+                    if section == 'catalog' and row.get('name') in existing_catalogs:
+                        id_map[old_id] = existing_catalogs[row.get('name')]
+                        reused_catalogs.add(old_id)
+                        continue
+                    if section == 'rate' and _foreign_key(section, row, 'catalog') in reused_catalogs:
+                        # The existing catalog already has its rates
+                        continue
+                    row = _remap(section, row, id_maps)
+                    row['id'] = next_id
+                    id_map[old_id] = next_id
+                    next_id += 1
+                    values = {}
+                    for key, value in row.items():
+                        column = by_name.get(_normalize(ATTRIBUTE_ALIASES.get(key, key)))
+                        if column is not None:
+                            values[column] = value
+                    batches.setdefault(tuple(values), []).append(tuple(values.values()))
+                    inserted += 1
+                for insert_columns, batch in batches.items():
+                    column_sql = ', '.join(f'"{c}"' for c in insert_columns)
+                    placeholders = ', '.join('?' for _ in insert_columns)
+                    conn.executemany(f'INSERT INTO "{table}" ({column_sql}) VALUES ({placeholders})', batch)
+                counts[section] = inserted
+            conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+    sessions = id_maps.get('session', {})
+    return {
+        "counts": counts,
+        "session_id": next(iter(sessions.values()), None),
+        "source_session_id": next(iter(sessions.keys()), None)
+    }
+
+
+def _foreign_key_names(section: str, parent: str) -> set:
+    names = set()
+    for spellings, referenced in FOREIGN_KEYS.get(section, []):
+        if referenced == parent:
+            names.update(_normalize(name) for name in spellings)
+    return names
+
+
+def _foreign_key(section: str, row: dict, parent: str):
+    """Value of the foreign key of `row` pointing at `parent`, whatever its spelling"""
+    names = _foreign_key_names(section, parent)
+    for key, value in row.items():
+        if _normalize(key) in names:
+            return value
+    return None
+
+
+def _remap(section: str, row: dict, id_maps: dict) -> dict:
+    """
+    Copy of row with its foreign keys pointing at the new ids. A reference to a row the bundle
+    does not hold is a BundleError, or None for OPTIONAL_PARENTS.
+    """
+    row = dict(row)
+    for _, parent in FOREIGN_KEYS.get(section, []):
+        names = _foreign_key_names(section, parent)
+        for key, value in row.items():
+            if value is None or _normalize(key) not in names:
+                continue
+            new_id = id_maps.get(parent, {}).get(value)
+            if new_id is None:
+                if parent not in OPTIONAL_PARENTS:
+                    raise BundleError(f"{section} row {row.get('id')} references {parent} {value}, which is not in the bundle")
+                print(f"[DEBUG] {section} row {row.get('id')}: {parent} {value} is not in the bundle, reference dropped")
+            row[key] = new_id
+    return row
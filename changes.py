@@ -0,0 +1,198 @@
+"""
+Change detection over aetherone.db for cache invalidation.
+
+A background thread reads `PRAGMA data_version` of its own read-only connection every
+CHANGE_POLL_SECONDS; the value only moves when another connection (the host app) commits, so
+an idle database costs one pragma per interval. After a commit the small tables (cases,
+sessions, analysis) are compared by row count and highest id, and the large rate tables by
+their highest id only; the rows past the old highest id are read to give the sessions and
+analyses that changed. No table is read in full. Deleted rows invalidate everything, and
+edits inside existing rows are not seen.
+"""
+import os
+import sqlite3
+import threading
+
+from .snapshot import SnapshotDAO, SnapshotError
+
+# Small sections watched by row count and highest id, with the parent their new rows are read with,
+# and rate sections watched by highest id only (counting them would walk the whole table)
+COUNTED_SECTIONS = {'case': None, 'session': 'case', 'analysis': 'session'}
+WATERMARK_SECTIONS = (('rate_analysis', 'analysis'), ('rate', 'catalog'))
+# Parent ids per IN (...) query, below SQLite's default limit of host parameters
+IN_BATCH = 500
+
+
+class Changes:
+    """Sessions and analyses changed by one commit (or several between two polls)"""
+
+    def __init__(self, sessions=None, analyses=None, everything: bool = False):
+        self.sessions = set(sessions or ())
+        self.analyses = set(analyses or ())
+        # Rows were removed in a way that cannot be attributed, drop everything
+        self.everything = everything
+
+    def __bool__(self):
+        return self.everything or bool(self.sessions or self.analyses)
+
+    def affects_session(self, session_id) -> bool:
+        return self.everything or str(session_id) in {str(s) for s in self.sessions}
+
+    def as_dict(self) -> dict:
+        return {"sessions": sorted(self.sessions), "analyses": sorted(self.analyses), "all": self.everything}
+
+
+class ChangeTracker:
+    """
+    Watches aetherone.db through a SnapshotReader and calls every registered listener(changes)
+    with the Changes of each commit. CHANGE_TRACKING=0 turns it off.
+    """
+
+    def __init__(self, reader, interval: float = None, enabled: bool = None):
+        self.reader = reader
+        self.interval = interval or float(os.getenv('CHANGE_POLL_SECONDS', '2'))
+        self.enabled = enabled if enabled is not None else os.getenv('CHANGE_TRACKING', '1') != '0'
+        self.polls = 0
+        self.scans = 0
+        self._listeners = []
+        self._conn = None
+        self._dao = None
+        self._version = None
+        self._state = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def register(self, listener):
+        """listener(changes: Changes) is called from the tracker thread; starts the thread on first use"""
+        self._listeners.append(listener)
+        self.start()
+
+    def start(self):
+        if not self.enabled or self.reader is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='aetherone-changes', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except (sqlite3.Error, SnapshotError) as e:
+                # aetherone.db missing or locked for now: reconnect and rescan next time
+                print(f"[DEBUG] Change tracking of aetherone.db paused: {e}")
+                self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = self._dao = self._version = self._state = None
+
+    def poll(self) -> Changes:
+        """Check once; returns the Changes found (also passed to the listeners), None when nothing changed"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self.reader._connect()
+                self._dao = SnapshotDAO(self._conn, self.reader._resolve_tables(self._conn))
+            self.polls += 1
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._version:
+                return None
+            self._version = version
+            self.scans += 1
+            self._conn.execute('BEGIN')
+            try:
+                state = self._scan()
+                changes = self._diff(self._state, state) if self._state is not None else None
+            finally:
+                self._conn.rollback()
+            self._state = state
+        if changes:
+            for listener in self._listeners:
+                try:
+                    listener(changes)
+                except Exception as e:
+                    print(f"[DEBUG] Change listener failed: {e}")
+        return changes or None
+
+    def _scan(self) -> dict:
+        """(row count, highest id) of the small tables and the highest id of the rate tables"""
+        state = {}
+        for section in COUNTED_SECTIONS:
+            table = self._dao._table(section)
+            count, top = self._conn.execute(f'SELECT COUNT(*), MAX(id) FROM "{table}"').fetchone()
+            state[section] = (count, top or 0)
+        for section, _ in WATERMARK_SECTIONS:
+            top = self._conn.execute(f'SELECT MAX(id) FROM "{self._dao._table(section)}"').fetchone()[0]
+            state[section] = (None, top or 0)
+        return state
+
+    def _added(self, section: str, parent: str, after: int) -> list:
+        """(id, parent id) of the rows past a highest id"""
+        column = f'"{self._dao._foreign_column(section, parent)}"' if parent else 'NULL'
+        return [tuple(row) for row in self._conn.execute(
+            f'SELECT id, {column} FROM "{self._dao._table(section)}" WHERE id > ?', (after,)
+        )]
+
+    def _analyses_of(self, parent: str, ids) -> list:
+        """(analysis id, session id) of the given analyses (parent None) or of the analyses on the given catalogs"""
+        column = self._dao._foreign_column('analysis', parent) if parent else 'id'
+        session_column = self._dao._foreign_column('analysis', 'session')
+        ids = sorted(ids)
+        rows = []
+        for start in range(0, len(ids), IN_BATCH):
+            chunk = ids[start:start + IN_BATCH]
+            rows.extend(tuple(row) for row in self._conn.execute(
+                f'SELECT id, "{session_column}" FROM "{self._dao._table("analysis")}" '
+                f'WHERE "{column}" IN ({", ".join("?" * len(chunk))})', chunk
+            ))
+        return rows
+
+    def _diff(self, old: dict, new: dict) -> Changes:
+        sessions, analyses = set(), set()
+        for section, parent in COUNTED_SECTIONS.items():
+            (count_before, before), (count_after, after) = old[section], new[section]
+            if (count_before, before) == (count_after, after):
+                continue
+            added = self._added(section, parent, before) if after > before else []
+            if after < before or count_after - count_before != len(added):
+                # Rows were deleted, which sessions they belonged to is gone
+                return Changes(everything=True)
+            if section == 'session':
+                sessions |= {row[0] for row in added}
+            elif section == 'analysis':
+                analyses |= {row[0] for row in added}
+                sessions |= {row[1] for row in added}
+
+        for section, parent in WATERMARK_SECTIONS:
+            (_, before), (_, after) = old[section], new[section]
+            if after < before:
+                # The newest rows were deleted, which parents they had is gone
+                return Changes(everything=True)
+            if after == before:
+                continue
+            parent_ids = {row[1] for row in self._added(section, parent, before)}
+            parent_ids.discard(None)
+            if parent_ids:
+                # New rate_analysis rows: their analyses; new rates of a catalog: every analysis on it
+                rows = self._analyses_of(None if parent == 'analysis' else parent, parent_ids)
+                analyses |= {row[0] for row in rows} | (parent_ids if parent == 'analysis' else set())
+                sessions |= {row[1] for row in rows}
+        sessions.discard(None)
+        analyses.discard(None)
+        return Changes(sessions, analyses)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "interval": self.interval,
+            "polls": self.polls,
+            "scans": self.scans,
+            "listeners": len(self._listeners)
+        }
@@ -0,0 +1,33 @@
+import hashlib
+import uuid
+
+from flask import current_app, request
+
+# Part of every ETag, so validators built from counters never match across restarts
+EPOCH = uuid.uuid4().hex
+
+
+def make_etag(*parts) -> str:
+    """ETag from validator parts; bytes (e.g. an upstream body) are hashed as they are"""
+    digest = hashlib.blake2b(EPOCH.encode('ascii'), digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def conditional_response(etag: str, build):
+    """
+    304 Not Modified when the request's If-None-Match already has `etag`; otherwise the
+    response of build() (called only then), tagged with the ETag when it is a 200.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -1,105 +1,534 @@
+import json
+import os
+import re
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List
 
+# UPDATE/INSERT ... RETURNING needs SQLite 3.35
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _migration_1_baseline(cursor):
+    """Tables as they were created before schema versioning, plus the default server"""
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            token TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create analysis_keys table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key_id INTEGER NOT NULL,
+            key TEXT UNIQUE NOT NULL,
+            session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            metadata TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Create servers table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            selected INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Last good body of every upstream GET, served while the server is offline
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upstream_cache (
+            url TEXT PRIMARY KEY,
+            status_code INTEGER NOT NULL,
+            content_type TEXT,
+            body BLOB,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Writes made while the server was offline, replayed in id order on recovery
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pending_writes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            method TEXT NOT NULL,
+            url TEXT NOT NULL,
+            payload TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Per-analysis summaries computed when a session is shared
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL,
+            session_id INTEGER NOT NULL,
+            analysis_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (key, analysis_id)
+        )
+    ''')
+
+    url_to_insert = "https://aetheronepysocial.emolio.nl"
+    description = "AetherOnePy Social Server"
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO servers (url, description, selected)
+        VALUES (?, ?, ?)
+    ''', (url_to_insert, description, 1))
+
+
+def _migration_2_analysis_key_analysis_id(cursor):
+    """analysis_keys.analysis_id, queried by get_analysis_keys_by_analysis and deactivate_analysis_keys"""
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(analysis_keys)')}
+    if 'analysis_id' not in columns:
+        cursor.execute('ALTER TABLE analysis_keys ADD COLUMN analysis_id INTEGER')
+
+
+ANALYSIS_KEY_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_analysis_keys_user_session ON analysis_keys (user_id, session_id)',
+    'CREATE INDEX IF NOT EXISTS idx_analysis_keys_analysis ON analysis_keys (analysis_id)',
+)
+
+
+def _migration_3_analysis_key_indexes(cursor):
+    for step in _migration_3_analysis_key_indexes.steps:
+        step(cursor)
+
+
+# Run as separate transactions when the migration is applied online (see apply_deferred_migration)
+_migration_3_analysis_key_indexes.steps = tuple(
+    (lambda cursor, sql=sql: cursor.execute(sql)) for sql in ANALYSIS_KEY_INDEXES
+)
+
+
+def _migration_4_share_log(cursor):
+    """share_log: shares per idempotency key; pending_writes.headers: headers replayed with a queued write"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS share_log (
+            idempotency_key TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            session_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            source_fingerprint TEXT,
+            status TEXT NOT NULL,
+            external_reference,
+            pending_write_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_share_log_key_session ON share_log (key, session_id)
+    ''')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(pending_writes)')}
+    if 'headers' not in columns:
+        cursor.execute('ALTER TABLE pending_writes ADD COLUMN headers TEXT')
+
+
+def _fts5_available(cursor) -> bool:
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)")
+        cursor.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _migration_5_search_index(cursor):
+    """
+    search_documents: the text of every analysis key and locally shared session, indexed by the
+    FTS5 table search_index (when SQLite has FTS5). Triggers keep key documents and the index current.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            session_id INTEGER NOT NULL,
+            intention TEXT,
+            description TEXT,
+            case_name TEXT,
+            signatures TEXT,
+            notes TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, key, session_id)
+        )
+    ''')
+    if _fts5_available(cursor):
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                key, intention, description, case_name, signatures, notes,
+                content='search_documents', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        columns = 'key, intention, description, case_name, signatures, notes'
+        new_values = ', '.join(f'new.{c.strip()}' for c in columns.split(','))
+        old_values = ', '.join(f'old.{c.strip()}' for c in columns.split(','))
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+                INSERT INTO search_index (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+                INSERT INTO search_index (search_index, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+                INSERT INTO search_index (search_index, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO search_index (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+    else:
+        print("[DEBUG] SQLite has no FTS5, /search falls back to LIKE queries")
+
+    # Key documents follow analysis_keys, whichever method changes them
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS analysis_keys_search_ai AFTER INSERT ON analysis_keys BEGIN
+            INSERT OR IGNORE INTO search_documents (kind, key, session_id, notes)
+            VALUES ('key', new.key, new.session_id, new.metadata);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS analysis_keys_search_au AFTER UPDATE OF key, session_id, metadata ON analysis_keys
+        BEGIN
+            UPDATE search_documents SET key = new.key, session_id = new.session_id, notes = new.metadata,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE kind = 'key' AND key = old.key;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS analysis_keys_search_ad AFTER DELETE ON analysis_keys BEGIN
+            DELETE FROM search_documents WHERE kind = 'key' AND key = old.key;
+        END
+    ''')
+
+    # Existing keys, and earlier shares as far as their summaries (top hits) tell
+    cursor.execute('''
+        INSERT OR IGNORE INTO search_documents (kind, key, session_id, notes)
+        SELECT 'key', key, session_id, metadata FROM analysis_keys
+    ''')
+    shares = {}
+    for key, session_id, summary in cursor.execute(
+            'SELECT key, session_id, summary FROM analysis_summaries ORDER BY id').fetchall():
+        try:
+            top = json.loads(summary).get('top') or []
+        except (ValueError, AttributeError):
+            continue
+        signatures, notes = shares.setdefault((key, session_id), ({}, {}))
+        for row in top:
+            if row.get('signature'):
+                signatures[str(row['signature'])] = None
+            if row.get('description'):
+                notes[str(row['description'])] = None
+    cursor.executemany('''
+        INSERT OR IGNORE INTO search_documents (kind, key, session_id, signatures, notes)
+        VALUES ('share', ?, ?, ?, ?)
+    ''', [(key, session_id, ' '.join(signatures), ' '.join(notes))
+          for (key, session_id), (signatures, notes) in shares.items()])
+
+
+def fts_query(text: str, max_terms: int = 16) -> str:
+    """
+    FTS5 MATCH expression for free text typed by a user: every word must occur, as a prefix.
+    Words are quoted, so FTS5 operators and punctuation in the input cannot break the query.
+    """
+    terms = re.findall(r'\w+', text or '')[:max_terms]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+# (version, migration, online). Applied in order, each in its own transaction together with
+# PRAGMA user_version. When an existing database is upgraded, online migrations (index builds)
+# are only recorded in schema_deferred_migrations and run in a background thread after startup,
+# on their own connection, so the plugin does not wait for them. They must be idempotent and
+# nothing may depend on them but speed: later migrations are applied before them. An online
+# migration with `steps` runs each step (one index build) in its own short transaction.
+MIGRATIONS = [
+    (1, _migration_1_baseline, False),
+    (2, _migration_2_analysis_key_analysis_id, False),
+    (3, _migration_3_analysis_key_indexes, True),
+    (4, _migration_4_share_log, False),
+    (5, _migration_5_search_index, False),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _has_tables(conn) -> bool:
+    """False for a new, empty database; older installs have tables but user_version 0"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' LIMIT 1"
+    ).fetchone() is not None
+
+
+def _defer_migration(version: int):
+    def defer(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_deferred_migrations (version INTEGER PRIMARY KEY)
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO schema_deferred_migrations (version) VALUES (?)', (version,))
+    defer.__name__ = f'defer_migration_{version}'
+    return defer
+
+
+def deferred_migrations(conn) -> list:
+    """Online migrations that were recorded during an upgrade but have not run yet"""
+    try:
+        versions = {row[0] for row in conn.execute('SELECT version FROM schema_deferred_migrations')}
+    except sqlite3.OperationalError:
+        return []
+    return [m for m in MIGRATIONS if m[0] in versions]
+
+
+def apply_deferred_migration(conn, version: int, migration) -> bool:
+    """
+    Run a deferred online migration unless another connection already did; True when it ran.
+    Each of the migration's steps is its own transaction, so other writers wait for one index
+    build at a time instead of the whole migration. The record goes with the last step.
+    """
+    steps = getattr(migration, 'steps', None) or (migration,)
+    for number, step in enumerate(steps, 1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM schema_deferred_migrations WHERE version = ?', (version,)).fetchone() is None:
+                conn.rollback()
+                return False
+            step(conn.cursor())
+            if number == len(steps):
+                conn.execute('DELETE FROM schema_deferred_migrations WHERE version = ?', (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"[DEBUG] SocialDatabase deferred migration {version} applied ({migration.__name__})")
+    return True
+
+
+def apply_migration(conn, version: int, migration) -> bool:
+    """Apply one migration unless another connection already did; returns True when applied"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if schema_version(conn) >= version:
+            conn.rollback()
+            return False
+        migration(conn.cursor())
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"[DEBUG] SocialDatabase schema migrated to version {version} ({migration.__name__})")
+    return True
+
+
+# How long writers of the shared connection wait for a lock of another connection, normally and
+# while an online migration builds indexes (one build may take longer than the normal wait)
+BUSY_TIMEOUT = float(os.getenv('SOCIAL_DB_BUSY_TIMEOUT', '5'))
+MIGRATION_BUSY_TIMEOUT = float(os.getenv('SOCIAL_DB_MIGRATION_BUSY_TIMEOUT', '30'))
+
+
 class SocialDatabase:
     def __init__(self, db_path: str):
         print(f"[DEBUG] Initializing SocialDatabase at {db_path}")
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self._write_lock = threading.RLock()
+        self._tx_depth = 0
+        self._pending_status = {}
+        self._tx_pending_status = {}
+        self._status_timer = None
+        self.migration_thread = None
+        # Change counters per table, for ETags
+        self._table_versions = {}
+        # Change listeners (event stream) and the events of the open transaction
+        self._listeners = []
+        self._tx_events = []
+        self.coalesce_delay = float(os.getenv('SOCIAL_DB_COALESCE_MS', '250')) / 1000
         self.create_tables()
 
-    def create_tables(self):
-        print("[DEBUG] Creating tables in SocialDatabase if not exist")
-        cursor = self.conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                server_user_id INTEGER NOT NULL,
-                username TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                token TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work: the mutators called inside the block share one commit, everything
+        is rolled back when the block raises. Nested blocks join the outermost one.
+        Every mutator runs in one, and the block holds the write lock until it commits, so
+        writes of other threads wait instead of landing in (or being rolled back with) it.
+        Queued status changes (queue_analysis_key_status) are part of the unit of work too: a
+        rollback restores the queue as it was when the block started.
+        """
+        with self._write_lock:
+            if self._tx_depth == 0:
+                self._tx_pending_status = dict(self._pending_status)
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self.conn.rollback()
+                    self._tx_events = []
+                    self._pending_status = self._tx_pending_status
+                    if self._pending_status:
+                        self._start_status_timer()
+                raise
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self.conn.commit()
+                events, self._tx_events = self._tx_events, []
+                for event, data in events:
+                    self._notify(event, data)
 
-        # Create analysis_keys table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analysis_keys (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key_id INTEGER NOT NULL,
-                key TEXT UNIQUE NOT NULL,
-                session_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                status TEXT DEFAULT 'active',
-                metadata TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
+    @contextmanager
+    def _reading(self):
+        """
+        Cursor for a read of the shared connection, under the write lock: a read never sees the
+        uncommitted writes of another thread's transaction (a thread's own stay visible to it).
+        """
+        with self._write_lock:
+            yield self.conn.cursor()
 
-        # Create servers table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS servers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                selected INTEGER DEFAULT 0
-            )
-        ''')
+    def add_listener(self, listener):
+        """Call listener(event, data) after every committed change of analysis keys"""
+        self._listeners.append(listener)
 
-        url_to_insert = "https://aetheronepysocial.emolio.nl"
-        description = "AetherOnePy Social Server"
+    def _notify(self, event: str, data: dict):
+        for listener in self._listeners:
+            try:
+                listener(event, data)
+            except Exception as e:
+                print(f"[DEBUG] Change listener failed for {event}: {e}")
 
-        cursor.execute('''
-            INSERT OR IGNORE INTO servers (url, description, selected)
-            VALUES (?, ?, ?)
-        ''', (url_to_insert, description, 1))
+    def _emit(self, event: str, data: dict):
+        """Announce a change once it is committed; dropped when the open transaction rolls back"""
+        if not self._listeners:
+            return
+        with self._write_lock:
+            if self._tx_depth:
+                self._tx_events.append((event, data))
+                return
+        self._notify(event, data)
+
+    def _touch(self, *tables):
+        """Count a change of tables, for cheap validators (see table_version)"""
+        for table in tables:
+            self._table_versions[table] = self._table_versions.get(table, 0) + 1
+
+    def table_version(self, *tables) -> tuple:
+        """
+        Cheap version of tables: PRAGMA data_version (changes made through other connections)
+        plus this connection's change counters of the tables
+        """
+        with self._reading() as cursor:
+            data_version = cursor.execute('PRAGMA data_version').fetchone()[0]
+        return (data_version,) + tuple(self._table_versions.get(table, 0) for table in tables)
+
+    def create_tables(self):
+        """
+        Bring the schema up to SCHEMA_VERSION. Blocking migrations are applied here, online ones
+        of an upgrade are deferred to a background thread (also those left over from an earlier start).
+        """
+        version = schema_version(self.conn)
+        if version < SCHEMA_VERSION:
+            # A new database has nothing to index, only upgrades defer online migrations
+            upgrade = _has_tables(self.conn) and self.db_path != ':memory:'
+            for target, migration, online in MIGRATIONS:
+                if target <= version:
+                    continue
+                apply_migration(self.conn, target, _defer_migration(target) if online and upgrade else migration)
+        deferred = deferred_migrations(self.conn)
+        if deferred:
+            self.migration_thread = threading.Thread(
+                target=self._apply_online_migrations, args=(deferred,), daemon=True
+            )
+            self.migration_thread.start()
+
+    def _apply_online_migrations(self, migrations):
+        conn = sqlite3.connect(self.db_path, timeout=MIGRATION_BUSY_TIMEOUT)
+        # Writers of the plugin wait out an index build instead of failing with "database is locked"
+        self._set_busy_timeout(MIGRATION_BUSY_TIMEOUT)
+        try:
+            for target, migration, _ in migrations:
+                apply_deferred_migration(conn, target, migration)
+        except Exception as e:
+            print(f"[DEBUG] Online migration failed, will retry on next start: {e}")
+        finally:
+            conn.close()
+            self._set_busy_timeout(BUSY_TIMEOUT)
 
-        self.conn.commit()
+    def _set_busy_timeout(self, seconds: float):
+        with self._write_lock:
+            try:
+                self.conn.execute(f'PRAGMA busy_timeout = {int(seconds * 1000)}')
+            except sqlite3.ProgrammingError:
+                pass  # closed meanwhile
 
     def save_user(self, username: str, email: str, token: str, server_user_id: int) -> int:
         cursor = self.conn.cursor()
         print(f"[DEBUG] Saving user: {username}, {email}, {token}, {server_user_id}")
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (username, email, token, server_user_id)
-            VALUES (?, ?, ?, ?)
-        ''', (username, email, token, server_user_id))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                INSERT OR REPLACE INTO users (username, email, token, server_user_id)
+                VALUES (?, ?, ?, ?)
+            ''', (username, email, token, server_user_id))
+            self._touch('users')
         print(f"[DEBUG] User saved: {cursor.lastrowid}")
         return cursor.lastrowid
 
     def update_user_token(self, email: str, token: str) -> bool:
         cursor = self.conn.cursor()
         print(f"[DEBUG] Updating user token: {email}, {token}")
-        cursor.execute('''
-            UPDATE users SET token = ? WHERE email = ?
-        ''', (token, email))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE users SET token = ? WHERE email = ?
+            ''', (token, email))
+            self._touch('users')
         return cursor.rowcount > 0
 
     def get_user_by_email(self, email: str) -> dict:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
     
     def get_only_user(self) -> dict: # only one user allowed in the users table, because there is not need for multiple users
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users ORDER BY id DESC LIMIT 1')
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM users ORDER BY id DESC LIMIT 1')
+            row = cursor.fetchone()
+            return dict(row) if row else None
 
     def get_user_token(self, email: str) -> str:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT token FROM users WHERE email = ?', (email,))
-        row = cursor.fetchone()
-        return row['token'] if row else None
+        with self._reading() as cursor:
+            cursor.execute('SELECT token FROM users WHERE email = ?', (email,))
+            row = cursor.fetchone()
+            return row['token'] if row else None
 
     # Analysis Keys CRUD operations
     def create_analysis_key(self, key_id: int, key: str, session_id: int, user_id: int, 
@@ -107,170 +536,518 @@ class SocialDatabase:
         """Create a new analysis key"""
         cursor = self.conn.cursor()
         print(f"key_id: {key_id}, key: {key}, session_id: {session_id}, user_id: {user_id}, expires_at: {expires_at}, metadata: {metadata}")
-        cursor.execute('''
-            INSERT INTO analysis_keys (key_id, key, session_id, user_id, expires_at, metadata)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (key_id, key, session_id, user_id, expires_at, metadata))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                INSERT INTO analysis_keys (key_id, key, session_id, user_id, expires_at, metadata)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key_id, key, session_id, user_id, expires_at, metadata))
+            self._touch('analysis_keys')
+        if self._listeners:
+            self._emit('key.created', self._analysis_key_row(cursor.lastrowid))
         return cursor.lastrowid
 
+    def create_analysis_key_row(self, key_id: int, key: str, session_id: int, user_id: int,
+                                expires_at: datetime = None, metadata: str = None) -> dict:
+        """Create a new analysis key and return the stored row"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            self._touch('analysis_keys')
+            if RETURNING_SUPPORTED:
+                cursor.execute('''
+                    INSERT INTO analysis_keys (key_id, key, session_id, user_id, expires_at, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    RETURNING *
+                ''', (key_id, key, session_id, user_id, expires_at, metadata))
+                rows = cursor.fetchall()
+            else:
+                cursor.execute('''
+                    INSERT INTO analysis_keys (key_id, key, session_id, user_id, expires_at, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key_id, key, session_id, user_id, expires_at, metadata))
+                cursor.execute('SELECT * FROM analysis_keys WHERE id = ?', (cursor.lastrowid,))
+                rows = cursor.fetchall()
+            if rows:
+                self._emit('key.created', dict(rows[0]))
+        return dict(rows[0]) if rows else None
+
+    def create_analysis_keys(self, keys: List[dict]) -> int:
+        """Insert many analysis keys (dicts with key_id, key, session_id, user_id, metadata) in one transaction"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            self._touch('analysis_keys')
+            cursor.executemany('''
+                INSERT OR IGNORE INTO analysis_keys (key_id, key, session_id, user_id, expires_at, metadata)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(k['key_id'], k['key'], k['session_id'], k['user_id'], k.get('expires_at'), k.get('metadata'))
+                  for k in keys])
+            if cursor.rowcount > 0:
+                self._emit('keys.changed', {"reason": "created", "count": cursor.rowcount})
+        return cursor.rowcount
+
+    def get_analysis_keys_by_sessions(self, user_id: int, session_ids: List[int]) -> List[dict]:
+        """Keys of a user for any of the given sessions, in one query"""
+        self._flush_pending_status()
+        with self._reading() as cursor:
+            session_ids = list(session_ids)
+            rows = []
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(session_ids), 500):
+                chunk = session_ids[start:start + 500]
+                placeholders = ', '.join('?' for _ in chunk)
+                cursor.execute(f'''
+                    SELECT * FROM analysis_keys
+                    WHERE user_id = ? AND session_id IN ({placeholders})
+                ''', [user_id] + chunk)
+                rows.extend(dict(row) for row in cursor.fetchall())
+            return rows
+
     def get_analysis_key(self, key: str) -> dict:
         """Get analysis key by key string"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM analysis_keys WHERE key = ?
-        ''', (key,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        self._flush_pending_status()
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM analysis_keys WHERE key = ?
+            ''', (key,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
     
+    def _analysis_key_row(self, row_id: int) -> dict:
+        row = self.conn.execute('SELECT * FROM analysis_keys WHERE id = ?', (row_id,)).fetchone()
+        return dict(row) if row else {"id": row_id}
+
     def get_analysis_key_id(self, key_id: int) -> dict:
         """Get analysis key by key string"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM analysis_keys WHERE key_id = ?
-        ''', (key_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        self._flush_pending_status()
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM analysis_keys WHERE key_id = ?
+            ''', (key_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
 
     def get_analysis_keys_by_user(self, user_id: int) -> List[dict]:
         """Get all analysis keys for a user"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM analysis_keys 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        self._flush_pending_status()
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM analysis_keys 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC
+            ''', (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_analysis_keys_by_analysis(self, analysis_id: int) -> List[dict]:
         """Get all keys for a specific analysis"""
+        self._flush_pending_status()
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM analysis_keys 
+                WHERE analysis_id = ? 
+                ORDER BY created_at DESC
+            ''', (analysis_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def update_analysis_key(self, key: str, status: str = None, metadata: str = None) -> dict:
+        """Update status and/or metadata in one statement; returns the updated row, None if the key does not exist"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM analysis_keys 
-            WHERE analysis_id = ? 
-            ORDER BY created_at DESC
-        ''', (analysis_id,))
-        return [dict(row) for row in cursor.fetchall()]
+        with self.transaction():
+            self._touch('analysis_keys')
+            if status is not None:
+                self._pending_status.pop(key, None)
+            if RETURNING_SUPPORTED:
+                cursor.execute('''
+                    UPDATE analysis_keys
+                    SET status = COALESCE(?, status), metadata = COALESCE(?, metadata)
+                    WHERE key = ?
+                    RETURNING *
+                ''', (status, metadata, key))
+                rows = cursor.fetchall()
+            else:
+                cursor.execute('''
+                    UPDATE analysis_keys
+                    SET status = COALESCE(?, status), metadata = COALESCE(?, metadata)
+                    WHERE key = ?
+                ''', (status, metadata, key))
+                rows = []
+                if cursor.rowcount > 0:
+                    cursor.execute('SELECT * FROM analysis_keys WHERE key = ?', (key,))
+                    rows = cursor.fetchall()
+            if rows:
+                self._emit('key.updated', dict(rows[0]))
+        return dict(rows[0]) if rows else None
+
+    def queue_analysis_key_status(self, key: str, status: str):
+        """
+        Coalesced status update: changes are written together in one transaction after
+        coalesce_delay seconds (SOCIAL_DB_COALESCE_MS), repeated changes of a key keep only the last.
+        Reads of analysis_keys flush them first.
+        """
+        with self._write_lock:
+            self._pending_status[key] = status
+            self._start_status_timer()
+
+    def _start_status_timer(self):
+        if self._status_timer is None:
+            self._status_timer = threading.Timer(self.coalesce_delay, self._flush_status_timer)
+            self._status_timer.daemon = True
+            self._status_timer.start()
+
+    def flush_analysis_key_status(self) -> int:
+        """Write all queued status changes now; returns the number of keys written"""
+        with self._write_lock:
+            if self._status_timer is not None:
+                self._status_timer.cancel()
+                self._status_timer = None
+            pending, self._pending_status = self._pending_status, {}
+            if not pending:
+                return 0
+            cursor = self.conn.cursor()
+            with self.transaction():
+                self._touch('analysis_keys')
+                cursor.executemany('''
+                    UPDATE analysis_keys SET status = ? WHERE key = ?
+                ''', [(status, key) for key, status in pending.items()])
+                for key, status in pending.items():
+                    self._emit('key.updated', {"key": key, "status": status})
+            return len(pending)
+
+    def _flush_status_timer(self):
+        try:
+            self.flush_analysis_key_status()
+        except Exception as e:
+            print(f"[DEBUG] Flushing queued key status changes failed: {e}")
+
+    def _flush_pending_status(self):
+        if self._pending_status:
+            self.flush_analysis_key_status()
 
     def update_analysis_key_status(self, key: str, status: str) -> bool:
         """Update analysis key status"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE analysis_keys 
-            SET status = ? 
-            WHERE key = ?
-        ''', (status, key))
-        self.conn.commit()
+        with self.transaction():
+            # A queued change of the key must not overwrite this one when it is flushed later
+            self._pending_status.pop(key, None)
+            cursor.execute('''
+                UPDATE analysis_keys 
+                SET status = ? 
+                WHERE key = ?
+            ''', (status, key))
+            self._touch('analysis_keys')
+        if cursor.rowcount > 0:
+            self._emit('key.updated', {"key": key, "status": status})
         return cursor.rowcount > 0
 
     def update_analysis_key_metadata(self, key: str, metadata: str) -> bool:
         """Update analysis key metadata"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE analysis_keys 
-            SET metadata = ? 
-            WHERE key = ?
-        ''', (metadata, key))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE analysis_keys 
+                SET metadata = ? 
+                WHERE key = ?
+            ''', (metadata, key))
+            self._touch('analysis_keys')
+        if cursor.rowcount > 0:
+            self._emit('key.updated', {"key": key, "metadata": metadata})
         return cursor.rowcount > 0
 
     def delete_analysis_key(self, key: str) -> bool:
         """Delete an analysis key"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            DELETE FROM analysis_keys 
-            WHERE key = ?
-        ''', (key,))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                DELETE FROM analysis_keys 
+                WHERE key = ?
+            ''', (key,))
+            self._touch('analysis_keys')
+        if cursor.rowcount > 0:
+            self._emit('key.deleted', {"key": key})
         return cursor.rowcount > 0
 
     def cleanup_expired_keys(self) -> int:
         """Remove expired analysis keys"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            DELETE FROM analysis_keys 
-            WHERE expires_at IS NOT NULL 
-            AND expires_at < CURRENT_TIMESTAMP
-        ''')
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                DELETE FROM analysis_keys 
+                WHERE expires_at IS NOT NULL 
+                AND expires_at < CURRENT_TIMESTAMP
+            ''')
+            self._touch('analysis_keys')
+        if cursor.rowcount > 0:
+            self._emit('keys.changed', {"reason": "expired", "count": cursor.rowcount})
         return cursor.rowcount
 
     def deactivate_analysis_keys(self, analysis_id: int) -> int:
         """Deactivate all keys for an analysis"""
         cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE analysis_keys 
-            SET status = 'inactive' 
-            WHERE analysis_id = ?
-        ''', (analysis_id,))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE analysis_keys 
+                SET status = 'inactive' 
+                WHERE analysis_id = ?
+            ''', (analysis_id,))
+            self._touch('analysis_keys')
+        if cursor.rowcount > 0:
+            self._emit('keys.changed', {"reason": "deactivated", "analysis_id": analysis_id, "count": cursor.rowcount})
         return cursor.rowcount
 
     def close(self):
+        self._flush_pending_status()
         self.conn.close()
 
     def upsert_user_token(self, username: str, email: str, token: str, server_user_id: int = None) -> bool:
         cursor = self.conn.cursor()
-        # Always keep only one user: delete all others
-        cursor.execute('DELETE FROM users WHERE email != ?', (email,))
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        row = cursor.fetchone()
-        if row:
-            # User exists, update all fields
-            update_fields = 'username = ?, email = ?, token = ?'
-            params = [username, email, token]
-            if server_user_id is not None:
-                update_fields += ', server_user_id = ?'
-                params.append(server_user_id)
-            cursor.execute(f'UPDATE users SET {update_fields} WHERE id = ?', params + [row['id']])
-        else:
-            # No user exists, insert new
-            cursor.execute('''
-                INSERT INTO users (username, email, token{server_id}) VALUES (?, ?, ?{server_id_val})
-            '''.format(
-                server_id=', server_user_id' if server_user_id is not None else '',
-                server_id_val=', ?' if server_user_id is not None else ''
-            ), ([username, email, token] + ([server_user_id] if server_user_id is not None else [])))
-        self.conn.commit()
+        with self.transaction():
+            # Always keep only one user: delete all others
+            cursor.execute('DELETE FROM users WHERE email != ?', (email,))
+            cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
+            row = cursor.fetchone()
+            if row:
+                # User exists, update all fields
+                update_fields = 'username = ?, email = ?, token = ?'
+                params = [username, email, token]
+                if server_user_id is not None:
+                    update_fields += ', server_user_id = ?'
+                    params.append(server_user_id)
+                cursor.execute(f'UPDATE users SET {update_fields} WHERE id = ?', params + [row['id']])
+            else:
+                # No user exists, insert new
+                cursor.execute('''
+                    INSERT INTO users (username, email, token{server_id}) VALUES (?, ?, ?{server_id_val})
+                '''.format(
+                    server_id=', server_user_id' if server_user_id is not None else '',
+                    server_id_val=', ?' if server_user_id is not None else ''
+                ), ([username, email, token] + ([server_user_id] if server_user_id is not None else [])))
+            self._touch('users')
         return True
 
     def add_server(self, url: str, description: str = None, selected: bool = False) -> int:
         cursor = self.conn.cursor()
-        if selected:
-            # Unselect all other servers
-            cursor.execute('UPDATE servers SET selected = 0')
-        cursor.execute('''
-            INSERT INTO servers (url, description, selected) VALUES (?, ?, ?)
-        ''', (url, description, int(selected)))
-        self.conn.commit()
+        with self.transaction():
+            if selected:
+                # Unselect all other servers
+                cursor.execute('UPDATE servers SET selected = 0')
+            cursor.execute('''
+                INSERT INTO servers (url, description, selected) VALUES (?, ?, ?)
+            ''', (url, description, int(selected)))
+            self._touch('servers')
         return cursor.lastrowid
 
     def set_selected_server(self, server_id: int):
         cursor = self.conn.cursor()
-        cursor.execute('UPDATE servers SET selected = 0')
-        cursor.execute('UPDATE servers SET selected = 1 WHERE id = ?', (server_id,))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('UPDATE servers SET selected = 0')
+            cursor.execute('UPDATE servers SET selected = 1 WHERE id = ?', (server_id,))
+            self._touch('servers')
 
     def get_servers(self) -> list:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM servers ORDER BY created_at DESC')
-        return [dict(row) for row in cursor.fetchall()]
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM servers ORDER BY created_at DESC')
+            return [dict(row) for row in cursor.fetchall()]
 
     def get_server_by_id(self, server_id: int) -> dict:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM servers WHERE id = ?', (server_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM servers WHERE id = ?', (server_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
 
     def delete_server(self, server_id: int) -> bool:
         cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM servers WHERE id = ?', (server_id,))
-        self.conn.commit()
+        with self.transaction():
+            cursor.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+            self._touch('servers')
         return cursor.rowcount > 0
 
+    # Upstream cache and offline write queue
+    def save_cached_response(self, url: str, status_code: int, content_type: str, body: bytes):
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                INSERT OR REPLACE INTO upstream_cache (url, status_code, content_type, body, fetched_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (url, status_code, content_type, body))
+            self._touch('upstream_cache')
+
+    def get_cached_response(self, url: str) -> dict:
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM upstream_cache WHERE url = ?', (url,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def enqueue_pending_write(self, kind: str, method: str, url: str, payload: str = None, headers: str = None) -> int:
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                INSERT INTO pending_writes (kind, method, url, payload, headers) VALUES (?, ?, ?, ?, ?)
+            ''', (kind, method, url, payload, headers))
+            self._touch('pending_writes')
+        return cursor.lastrowid
+
+    def pending_write_exists(self, write_id: int) -> bool:
+        with self._reading() as cursor:
+            cursor.execute('SELECT 1 FROM pending_writes WHERE id = ?', (write_id,))
+            return cursor.fetchone() is not None
+
+    def get_pending_writes(self) -> List[dict]:
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM pending_writes ORDER BY id')
+            return [dict(row) for row in cursor.fetchall()]
+
+    def count_pending_writes(self) -> int:
+        with self._reading() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM pending_writes')
+            return cursor.fetchone()[0]
+
+    def mark_pending_write_failed(self, write_id: int, error: str):
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE pending_writes SET attempts = attempts + 1, last_error = ? WHERE id = ?
+            ''', (error, write_id))
+            self._touch('pending_writes')
+
+    def delete_pending_write(self, write_id: int) -> bool:
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('DELETE FROM pending_writes WHERE id = ?', (write_id,))
+            self._touch('pending_writes')
+        return cursor.rowcount > 0
+
+    # Analysis summaries
+    def save_analysis_summaries(self, key: str, session_id: int, summaries: List[tuple]) -> int:
+        """summaries: list of (analysis_id, summary json string)"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.executemany('''
+                INSERT OR REPLACE INTO analysis_summaries (key, session_id, analysis_id, summary)
+                VALUES (?, ?, ?, ?)
+            ''', [(key, session_id, analysis_id, summary) for analysis_id, summary in summaries])
+            self._touch('analysis_summaries')
+        return len(summaries)
+
+    def get_analysis_summaries_by_key(self, key: str) -> List[dict]:
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM analysis_summaries WHERE key = ? ORDER BY session_id, analysis_id
+            ''', (key,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    # Share log
+    def get_share(self, idempotency_key: str) -> dict:
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM share_log WHERE idempotency_key = ?', (idempotency_key,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def get_latest_share(self, key: str, session_id: int) -> dict:
+        """Most recent share of a session with a key"""
+        with self._reading() as cursor:
+            cursor.execute('''
+                SELECT * FROM share_log WHERE key = ? AND session_id = ?
+                ORDER BY updated_at DESC, rowid DESC LIMIT 1
+            ''', (key, session_id))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def record_share(self, idempotency_key: str, key: str, session_id: int, content_hash: str,
+                     status: str, source_fingerprint: str = None) -> None:
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                INSERT INTO share_log (idempotency_key, key, session_id, content_hash, source_fingerprint, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (idempotency_key) DO UPDATE SET
+                    status = excluded.status,
+                    source_fingerprint = COALESCE(excluded.source_fingerprint, source_fingerprint),
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (idempotency_key, key, session_id, content_hash, source_fingerprint, status))
+            self._touch('share_log')
+
+    def update_share_status(self, idempotency_key: str, status: str, external_reference=None,
+                            pending_write_id: int = None) -> bool:
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE share_log SET status = ?,
+                    external_reference = COALESCE(?, external_reference),
+                    pending_write_id = COALESCE(?, pending_write_id),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE idempotency_key = ?
+            ''', (status, external_reference, pending_write_id, idempotency_key))
+            self._touch('share_log')
+        return cursor.rowcount > 0
+
+    def complete_queued_shares(self, key: str, session_id: int, external_reference=None) -> int:
+        """Mark queued shares of a session as sent once their replay went through"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                UPDATE share_log SET status = 'sent',
+                    external_reference = COALESCE(?, external_reference),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE key = ? AND session_id = ? AND status = 'queued'
+            ''', (external_reference, key, session_id))
+            self._touch('share_log')
+        return cursor.rowcount
+
+    # Full-text search
+    def index_shared_session(self, key: str, session_id: int, intention: str = None, description: str = None,
+                             case_name: str = None, signatures: str = None, notes: str = None):
+        """Store the searchable text of a shared session (replaces the previous share of it with the key)"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                INSERT INTO search_documents (kind, key, session_id, intention, description, case_name, signatures, notes)
+                VALUES ('share', ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key, session_id) DO UPDATE SET
+                    intention = excluded.intention,
+                    description = excluded.description,
+                    case_name = excluded.case_name,
+                    signatures = excluded.signatures,
+                    notes = excluded.notes,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (key, session_id, intention, description, case_name, signatures, notes))
+            self._touch('search_documents')
+
+    def _has_search_index(self) -> bool:
+        with self._reading() as cursor:
+            row = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").fetchone()
+        return row is not None
+
+    def search(self, text: str, limit: int = 20, kind: str = None) -> List[dict]:
+        """
+        Keys and shared sessions matching every word of `text` (as prefixes), best first (bm25,
+        key and intention weigh most). Without FTS5 the documents are scanned with LIKE, newest first.
+        """
+        match = fts_query(text)
+        if not match:
+            return []
+        with self._reading() as cursor:
+            if self._has_search_index():
+                cursor.execute(f'''
+                    SELECT d.kind, d.key, d.session_id, d.intention, d.case_name, d.updated_at,
+                           bm25(search_index, 10.0, 5.0, 2.0, 3.0, 1.0, 1.0) AS rank,
+                           snippet(search_index, -1, '**', '**', '…', 12) AS snippet
+                    FROM search_index JOIN search_documents d ON d.id = search_index.rowid
+                    WHERE search_index MATCH ? {'AND d.kind = ?' if kind else ''}
+                    ORDER BY rank LIMIT ?
+                ''', [match] + ([kind] if kind else []) + [limit])
+            else:
+                terms = re.findall(r'\w+', text)[:16]
+                document = "COALESCE(key, '') || ' ' || COALESCE(intention, '') || ' ' || COALESCE(description, '') " \
+                           "|| ' ' || COALESCE(case_name, '') || ' ' || COALESCE(signatures, '') || ' ' || COALESCE(notes, '')"
+                conditions = [f"{document} LIKE ?" for _ in terms] + (['kind = ?'] if kind else [])
+                cursor.execute(f'''
+                    SELECT kind, key, session_id, intention, case_name, updated_at, NULL AS rank, NULL AS snippet
+                    FROM search_documents WHERE {' AND '.join(conditions)}
+                    ORDER BY updated_at DESC, id DESC LIMIT ?
+                ''', [f'%{term}%' for term in terms] + ([kind] if kind else []) + [limit])
+            return [dict(row) for row in cursor.fetchall()]
+
     def list_all_sessions(self):
         """Return all sessions across all cases."""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM sessions ORDER BY created DESC')
-        rows = cursor.fetchall()
-        return [self._row_to_session(row) for row in rows] 
\ No newline at end of file
+        with self._reading() as cursor:
+            cursor.execute('SELECT * FROM sessions ORDER BY created DESC')
+            rows = cursor.fetchall()
+            return [self._row_to_session(row) for row in rows] 
\ No newline at end of file
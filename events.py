@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from .fastjson import dumps
+
+SSE_MIMETYPE = 'text/event-stream'
+# Reconnect delay suggested to EventSource clients, in ms
+RETRY_MS = 3000
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class _Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.reset = False
+
+
+class EventBroker:
+    """
+    Fan-out of server-sent events (key changes, share progress) to the /events streams.
+    Each event is encoded once and handed to every subscriber's bounded queue; a subscriber that
+    falls EVENTS_QUEUE_SIZE events behind is disconnected. The last EVENTS_BACKLOG events are kept,
+    so an EventSource reconnecting with Last-Event-ID gets what it missed, or a `reset` event
+    (refetch everything) when the gap is older than the backlog or the plugin was restarted.
+    Every open stream holds a request thread, so at most EVENTS_MAX_SUBSCRIBERS are served, and a
+    stream without events for EVENTS_IDLE_TIMEOUT_SECONDS is closed (0 keeps it open).
+    """
+
+    def __init__(self, backlog: int = None, queue_size: int = None, heartbeat: float = None,
+                 max_subscribers: int = None, idle_timeout: float = None):
+        self.backlog = deque(maxlen=backlog or int(os.getenv('EVENTS_BACKLOG', '500')))
+        self.queue_size = queue_size or int(os.getenv('EVENTS_QUEUE_SIZE', '1000'))
+        self.heartbeat = heartbeat or float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+        self.max_subscribers = max_subscribers or int(os.getenv('EVENTS_MAX_SUBSCRIBERS', '4'))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(
+            os.getenv('EVENTS_IDLE_TIMEOUT_SECONDS', '300')
+        )
+        # Event ids of an earlier process never match this one
+        self.epoch = uuid.uuid4().hex[:8]
+        self._next_id = 1
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data: dict):
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            frame = b'id: %s-%d\nevent: %s\ndata: %s\n\n' % (
+                self.epoch.encode('ascii'), event_id, event.encode('utf-8'), dumps(data)
+            )
+            self.backlog.append((event_id, frame))
+            for subscriber in self._subscribers:
+                if subscriber.overflowed:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(frame)
+                except queue.Full:
+                    subscriber.overflowed = True
+
+    def _missed(self, last_event_id: str):
+        """Backlog frames after last_event_id, or None when they cannot all be replayed"""
+        epoch, _, number = last_event_id.rpartition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        last = int(number)
+        if self.backlog and last < self.backlog[0][0] - 1:
+            return None
+        if last >= self._next_id:
+            return None
+        return [frame for event_id, frame in self.backlog if event_id > last]
+
+    def subscribe(self, last_event_id: str = None) -> _Subscriber:
+        subscriber = _Subscriber(self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(f"Too many event streams open (EVENTS_MAX_SUBSCRIBERS={self.max_subscribers})")
+            if last_event_id:
+                missed = self._missed(last_event_id)
+                if missed is None or len(missed) > self.queue_size:
+                    subscriber.reset = True
+                else:
+                    for frame in missed:
+                        subscriber.queue.put_nowait(frame)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self, subscriber: _Subscriber):
+        """
+        SSE body for one subscriber: events as they are published, a comment line as heartbeat.
+        Ends after idle_timeout seconds without events, which frees the request thread of a client
+        that is gone without the heartbeat noticing; a live EventSource reconnects with Last-Event-ID.
+        """
+        try:
+            yield b'retry: %d\n\n' % RETRY_MS
+            if subscriber.reset:
+                yield b'event: reset\ndata: {}\n\n'
+            last_event = time.monotonic()
+            while True:
+                timeout = self.heartbeat
+                if self.idle_timeout:
+                    timeout = min(timeout, max(0, last_event + self.idle_timeout - time.monotonic()))
+                try:
+                    frame = subscriber.queue.get(timeout=0 if subscriber.overflowed else timeout)
+                except queue.Empty:
+                    if subscriber.overflowed:
+                        # The client reconnects with Last-Event-ID and gets the rest from the backlog
+                        return
+                    if self.idle_timeout and time.monotonic() - last_event >= self.idle_timeout:
+                        return
+                    # Keeps proxies from closing the connection and notices gone clients
+                    yield b': keepalive\n\n'
+                    continue
+                last_event = time.monotonic()
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "idle_timeout": self.idle_timeout,
+                "last_event_id": self._next_id - 1
+            }
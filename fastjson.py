@@ -0,0 +1,102 @@
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime
+
+from flask import current_app
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+# Placeholder for an already encoded JSON document in jsonify_raw()
+RAW_JSON = '@@aetherone-raw-json@@'
+
+
+def _payload_default(obj):
+    """Types the stdlib encoder does not know, as the social server expects them (ISO 8601 dates)"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if hasattr(obj, 'tolist'):  # numpy arrays and scalars
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _response_default(obj):
+    """Same as Flask's default JSON provider, so blueprint responses keep their format (HTTP dates)"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    return _payload_default(obj)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj) -> bytes:
+        """Encode an outbound payload; datetimes become ISO 8601 strings"""
+        return orjson.dumps(obj, default=_payload_default, option=_ORJSON_OPTIONS)
+
+    def dumps_response(obj) -> bytes:
+        """Encode a response body; keys sorted like Flask's default provider (sort_keys=True)"""
+        return orjson.dumps(
+            obj, default=_response_default,
+            option=_ORJSON_OPTIONS | orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+
+    loads = orjson.loads
+else:
+    def dumps(obj) -> bytes:
+        """Encode an outbound payload; datetimes become ISO 8601 strings"""
+        return json.dumps(obj, default=_payload_default).encode('utf-8')
+
+    def dumps_response(obj) -> bytes:
+        """Encode a response body; keys sorted like Flask's default provider (sort_keys=True)"""
+        return json.dumps(obj, default=_response_default, sort_keys=True).encode('utf-8')
+
+    loads = json.loads
+
+
+def jsonify(*args, **kwargs):
+    """Drop-in for flask.jsonify that encodes with orjson when it is installed"""
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    return current_app.response_class(dumps_response(data), mimetype=JSON_MIMETYPE)
+
+
+def _substitute(obj, value):
+    if isinstance(obj, dict):
+        return {k: _substitute(v, value) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_substitute(v, value) for v in obj]
+    return value if obj == RAW_JSON else obj
+
+
+def dumps_response_raw(obj, raw: bytes) -> bytes:
+    """
+    dumps_response() of obj with the RAW_JSON placeholder standing for raw, the bytes of a JSON
+    document (e.g. a server response body). The document is embedded without parsing it.
+    """
+    marker = dumps(RAW_JSON)
+    head, found, tail = dumps_response(obj).partition(marker)
+    if not found or marker in tail:
+        # The placeholder text also occurs in the data: take the slow way
+        return dumps_response(_substitute(obj, loads(raw)))
+    return head + raw + tail
+
+
+def jsonify_raw(obj, raw: bytes):
+    """jsonify() of obj with the RAW_JSON placeholder replaced by the JSON document raw"""
+    return current_app.response_class(dumps_response_raw(obj, raw), mimetype=JSON_MIMETYPE)
@@ -0,0 +1,24 @@
+// Server-Sent Events from /aetheronepysocialplugin/events (key changes, share progress).
+// handlers maps event names to callbacks receiving the parsed data; onOpen/onError track the connection.
+// The browser reconnects by itself and sends Last-Event-ID, missed events are replayed
+// or a 'reset' event asks for a full refetch.
+export function openEventStream(handlers, { onOpen, onError } = {}) {
+  if (typeof window.EventSource === 'undefined') {
+    return null
+  }
+  const source = new EventSource('/aetheronepysocialplugin/events')
+  for (const [name, handler] of Object.entries(handlers)) {
+    source.addEventListener(name, event => {
+      let data = {}
+      try {
+        data = JSON.parse(event.data)
+      } catch (e) {
+        console.warn('Invalid event data', name, event.data)
+      }
+      handler(data)
+    })
+  }
+  if (onOpen) source.addEventListener('open', onOpen)
+  if (onError) source.addEventListener('error', onError)
+  return source
+}
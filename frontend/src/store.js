@@ -0,0 +1,202 @@
+// Shared client-side cache of user, keys and sessions for all views.
+// Keys are indexed by key string (local and server side merged into one entry), sessions by id.
+// Loads are stale-while-revalidate: cached data is returned at once and refetched in the
+// background when older than STALE_MS; concurrent loads share one request.
+// Key changes arrive over the event stream and are applied in place; sessions are refetched
+// when the host app changed them.
+import { shallowReactive } from 'vue'
+import { openEventStream } from './events'
+
+const BASE = '/aetheronepysocialplugin'
+const STALE_MS = 30000
+
+// Lists are replaced, never mutated, and their entries are frozen: Vue tracks the
+// list itself instead of proxying tens of thousands of rows
+export const store = shallowReactive({
+  user: null,
+  keys: [],
+  sessions: [],
+  live: false
+})
+
+const keyIndex = new Map()
+const sessionIndex = new Map()
+const resources = {
+  user: { fetchedAt: 0, promise: null },
+  keys: { fetchedAt: 0, promise: null },
+  sessions: { fetchedAt: 0, promise: null }
+}
+const listeners = {}
+let eventSource = null
+let keysScheduled = false
+
+function publishKeys() {
+  // Several changes in one tick (event bursts) rebuild the list once
+  if (keysScheduled) return
+  keysScheduled = true
+  queueMicrotask(() => {
+    keysScheduled = false
+    store.keys = Array.from(keyIndex.values())
+  })
+}
+
+function setEntry(key, local, server, first = false) {
+  const entry = Object.freeze({ key, local, server })
+  if (first && !keyIndex.has(key)) {
+    const rest = Array.from(keyIndex.entries())
+    keyIndex.clear()
+    keyIndex.set(key, entry)
+    for (const [k, v] of rest) keyIndex.set(k, v)
+  } else {
+    keyIndex.set(key, entry)
+  }
+  publishKeys()
+}
+
+function load(name, loader, current, force) {
+  const resource = resources[name]
+  const revalidate = () => {
+    if (!resource.promise) {
+      resource.promise = loader()
+        .then(value => {
+          resource.fetchedAt = Date.now()
+          return value
+        })
+        .finally(() => { resource.promise = null })
+    }
+    return resource.promise
+  }
+  if (force || resource.fetchedAt === 0) {
+    return revalidate()
+  }
+  if (Date.now() - resource.fetchedAt > STALE_MS) {
+    revalidate().catch(() => {})
+  }
+  return Promise.resolve(current())
+}
+
+function fetchJson(url) {
+  return fetch(url).then(res => res.json())
+}
+
+export function loadUser({ force = false } = {}) {
+  return load('user', () => fetchJson(`${BASE}/user`).then(user => {
+    store.user = user
+    return user
+  }), () => store.user, force)
+}
+
+export function loadKeys({ force = false } = {}) {
+  return load('keys', () => loadUser()
+    .then(user => fetchJson(`${BASE}/key/${user.server_user_id}`))
+    .then(data => {
+      const local = (data.data && data.data.local) ? data.data.local : []
+      const server = (data.data && data.data.server) ? data.data.server : []
+      const serverByKey = new Map()
+      for (const s of server) {
+        if (s.key) serverByKey.set(s.key, s)
+      }
+      keyIndex.clear()
+      for (const l of local) {
+        if (!l.key) continue
+        keyIndex.set(l.key, Object.freeze({ key: l.key, local: l, server: serverByKey.get(l.key) }))
+      }
+      for (const [key, s] of serverByKey) {
+        if (!keyIndex.has(key)) keyIndex.set(key, Object.freeze({ key, local: undefined, server: s }))
+      }
+      store.keys = Array.from(keyIndex.values())
+      return store.keys
+    }), () => store.keys, force)
+}
+
+export function loadSessions({ force = false } = {}) {
+  return load('sessions', () => fetchJson(`${BASE}/sessions`).then(data => {
+    const sessions = (data.sessions || []).map(s => Object.freeze(s))
+    sessionIndex.clear()
+    for (const s of sessions) sessionIndex.set(s.id, s)
+    store.sessions = sessions
+    return sessions
+  }), () => store.sessions, force)
+}
+
+export function keyEntry(key) {
+  return keyIndex.get(key)
+}
+
+export function sessionById(id) {
+  return sessionIndex.get(id)
+}
+
+// Events carry the whole row (created, updated) or only the changed fields (status, metadata)
+export function upsertLocalKey(row) {
+  if (!row || !row.key) return
+  const entry = keyIndex.get(row.key)
+  if (entry) {
+    setEntry(row.key, { ...(entry.local || {}), ...row }, entry.server)
+  } else if (row.id) {
+    setEntry(row.key, row, undefined, true)
+  }
+}
+
+export function upsertServerKey(row) {
+  if (!row || !row.key) return
+  const entry = keyIndex.get(row.key)
+  setEntry(row.key, entry ? entry.local : undefined, row, !entry)
+}
+
+export function removeLocalKey(key) {
+  const entry = keyIndex.get(key)
+  if (!entry) return
+  if (entry.server) {
+    setEntry(key, undefined, entry.server)
+  } else {
+    keyIndex.delete(key)
+    publishKeys()
+  }
+}
+
+function emit(name, data) {
+  for (const handler of listeners[name] || []) handler(data)
+}
+
+// Subscribe a view to an event of the stream; returns the unsubscribe function
+export function onEvent(name, handler) {
+  connectEvents()
+  listeners[name] = listeners[name] || new Set()
+  listeners[name].add(handler)
+  return () => listeners[name].delete(handler)
+}
+
+// One event stream for the whole app, opened on first use
+export function connectEvents() {
+  if (eventSource) return
+  const refetch = () => {
+    if (resources.keys.fetchedAt) loadKeys({ force: true }).catch(() => {})
+  }
+  const refetchSessions = () => {
+    if (resources.sessions.fetchedAt) loadSessions({ force: true }).catch(() => {})
+  }
+  const handlers = {}
+  const apply = {
+    'key.created': upsertLocalKey,
+    'key.updated': upsertLocalKey,
+    'key.deleted': data => removeLocalKey(data.key),
+    'keys.changed': refetch,
+    'sessions.changed': refetchSessions,
+    'reset': data => {
+      refetch(data)
+      refetchSessions(data)
+    },
+    'share.progress': () => {}
+  }
+  for (const [name, handler] of Object.entries(apply)) {
+    handlers[name] = data => {
+      handler(data)
+      emit(name, data)
+    }
+  }
+  eventSource = openEventStream(handlers, {
+    onOpen: () => { store.live = true },
+    onError: () => { store.live = false }
+  })
+}
@@ -0,0 +1,77 @@
+import math
+import threading
+import time
+
+
+def parse_page_args(args, default_limit: int = 20, max_limit: int = 500):
+    """
+    Read page/limit/fields from request.args.
+    Returns (page, limit, fields) or None when the caller asked for neither paging nor projection.
+    Paging applies only when page or limit is given: with fields alone page and limit are None
+    and the whole list is returned, projected.
+    """
+    page = args.get('page', type=int)
+    limit = args.get('limit', type=int)
+    fields = args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if page is None and limit is None:
+        return (None, None, fields) if fields else None
+    page = max(page or 1, 1)
+    limit = min(max(limit or default_limit, 1), max_limit)
+    return page, limit, fields
+
+
+def project_items(items: list, fields: list) -> list:
+    """Keep only `fields` (plus id) of every dict in items"""
+    if not fields:
+        return items
+    keep = set(fields) | {'id'}
+    return [{k: v for k, v in item.items() if k in keep} if isinstance(item, dict) else item for item in items]
+
+
+def paginate_items(items: list, page: int, limit: int, fields: list = None):
+    """Slice one page out of items; returns (page items, pagination info), all items and None without a limit"""
+    if limit is None:
+        return project_items(items, fields), None
+    total = len(items)
+    start = (page - 1) * limit
+    return project_items(items[start:start + limit], fields), {
+        "page": page,
+        "limit": limit,
+        "total": total,
+        "pages": math.ceil(total / limit) if total else 0
+    }
+
+
+class ParsedResultCache:
+    """Small TTL cache of parsed upstream results, so paging does not refetch and reparse the whole list"""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[key] = (time.time(), value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
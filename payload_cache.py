@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ShareDataMissing(Exception):
+    """A part of the session a share needs (analyses, case, catalog, rates) does not exist"""
+    pass
+
+
+class SharePayloadCache:
+    """
+    Built share payloads (session data with columnar rate lists) per session, valid while the
+    session's fingerprint (snapshot.session_fingerprint) is unchanged, so a share only pays for the upload.
+    Holds at most SHARE_CACHE_MAX_MB (default 64, 0 disables the cache) of rows as counted by
+    MemoryBudget, least recently used out first. prewarm() builds entries in one background thread;
+    a share arriving while its session is being built waits for that build instead of repeating it.
+    """
+
+    def __init__(self, max_mb: float = None, wait_timeout: float = None):
+        self.max_mb = float(os.getenv('SHARE_CACHE_MAX_MB', '64')) if max_mb is None else max_mb
+        self.limit = int(self.max_mb * 1024 * 1024)
+        self.wait_timeout = wait_timeout or float(os.getenv('SHARE_CACHE_WAIT_SECONDS', '60'))
+        self.enabled = self.limit > 0
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._warming = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, key, fingerprint):
+        """Cached payload of key built at `fingerprint`, after waiting for a running prewarm of key"""
+        if not self.enabled or fingerprint is None:
+            return None
+        with self._lock:
+            pending = self._warming.get(key)
+        if pending is not None:
+            try:
+                pending.result(timeout=self.wait_timeout)
+            except Exception:
+                pass
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, key, fingerprint) -> bool:
+        """Like get() without waiting for a prewarm (used by the prewarm itself) or counting"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] == fingerprint
+
+    def set(self, key, fingerprint, value, size: int):
+        if not self.enabled or fingerprint is None or size > self.limit:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used -= old[2]
+            while self._entries and self.used + size > self.limit:
+                _, evicted = self._entries.popitem(last=False)
+                self.used -= evicted[2]
+            self._entries[key] = (fingerprint, value, size)
+            self.used += size
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.used = 0
+            else:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.used -= entry[2]
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key matches predicate(key), e.g. the sessions a ChangeTracker reported"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.used -= self._entries.pop(key)[2]
+
+    def prewarm(self, key, build) -> bool:
+        """
+        Run build() in the background; it returns (fingerprint, value, size) to cache, or None.
+        False when the cache is disabled or key is already being built.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if key in self._warming:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='share-prewarm')
+            future = self._executor.submit(self._prewarm, key, build)
+            self._warming[key] = future
+        return True
+
+    def _prewarm(self, key, build):
+        try:
+            built = build()
+            if built is not None:
+                self.set(key, *built)
+        except Exception as e:
+            print(f"[DEBUG] Pre-warming share payload {key} failed: {e}")
+        finally:
+            with self._lock:
+                self._warming.pop(key, None)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "used_mb": round(self.used / (1024 * 1024), 1),
+                "max_mb": self.max_mb,
+                "warming": len(self._warming),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,113 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+PROFILE_QUERY = '_profile'
+PROFILE_TOKEN_QUERY = '_profile_token'
+
+
+class RequestProfiler:
+    """
+    Opt-in cProfile of single blueprint requests, kept in a ring buffer of the last max_profiles.
+    Only active when PROFILING_ENABLED=1; a request opts in with the X-Profile: 1 header or ?_profile=1,
+    plus the PROFILING_TOKEN (X-Profile-Token header or ?_profile_token=) when one is configured.
+    When disabled no hooks are installed, so other requests pay nothing.
+    One request is profiled at a time, concurrent opt-ins are served unprofiled.
+    """
+
+    def __init__(self, enabled: bool = None, token: str = None, max_profiles: int = None, top_n: int = 40):
+        self.enabled = enabled if enabled is not None else os.getenv('PROFILING_ENABLED', '0') == '1'
+        self.token = token if token is not None else os.getenv('PROFILING_TOKEN') or None
+        self.profiles = deque(maxlen=max_profiles or int(os.getenv('PROFILING_MAX_PROFILES', '20')))
+        self.top_n = top_n
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def install(self, blueprint):
+        if not self.enabled:
+            return
+        print(f"[DEBUG] Request profiling enabled, keeping the last {self.profiles.maxlen} profiles")
+        blueprint.before_request(self._before_request)
+        blueprint.after_request(self._after_request)
+        blueprint.teardown_request(self._teardown_request)
+
+    def _requested(self) -> bool:
+        if request.headers.get(PROFILE_HEADER) != '1' and request.args.get(PROFILE_QUERY) != '1':
+            return False
+        if self.token:
+            given = request.headers.get(PROFILE_TOKEN_HEADER) or request.args.get(PROFILE_TOKEN_QUERY)
+            return given == self.token
+        return True
+
+    def _before_request(self):
+        if not self._requested() or not self._active.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (debugger, coverage) is active in this interpreter
+            print(f"[DEBUG] Could not start request profile: {e}")
+            self._active.release()
+            return
+        g.social_profile = (profile, time.perf_counter())
+
+    def _after_request(self, response):
+        started = g.get('social_profile')
+        if started is None:
+            return response
+        profile, start = started
+        profile.disable()
+        duration = time.perf_counter() - start
+        profile_id = self._store(profile, duration, response.status_code)
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def _teardown_request(self, error=None):
+        # Runs even when the view or an after_request hook raised, so the profiler is always freed
+        started = g.pop('social_profile', None)
+        if started is None:
+            return
+        started[0].disable()
+        self._active.release()
+
+    def _store(self, profile, duration: float, status_code: int) -> str:
+        stats = pstats.Stats(profile)
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(self.top_n)
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.profiles.append({
+                "id": profile_id,
+                "method": request.method,
+                "path": request.full_path.rstrip('?'),
+                "status_code": status_code,
+                "duration_ms": round(duration * 1000, 2),
+                "created": time.time(),
+                "text": text.getvalue(),
+                # Same format as cProfile's dump_stats(), loadable with pstats/snakeviz
+                "stats": marshal.dumps(stats.stats)
+            })
+        return profile_id
+
+    def list(self) -> list:
+        with self._lock:
+            return [{k: v for k, v in p.items() if k not in ('text', 'stats')} for p in reversed(self.profiles)]
+
+    def get(self, profile_id: str):
+        with self._lock:
+            for profile in self.profiles:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
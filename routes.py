@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, current_app, send_from_directory
+from flask import Blueprint, request, current_app, send_from_directory
 import requests
 from services.databaseService import get_case_dao
 from datetime import datetime
@@ -7,11 +7,32 @@ from rich import print as rprint
 from rich.pretty import pprint as rpprint
 from icecream import ic
 from .database import SocialDatabase
+from .upstream import UpstreamBusy, UpstreamClient, UpstreamOffline
+from .share_codec import (
+    IDEMPOTENCY_HEADER, MemoryBudget, PayloadMemoryExceeded, ShareFormatNegotiator, content_hash,
+    encode_share_payload, idempotency_key
+)
+from .pagination import ParsedResultCache, paginate_items, parse_page_args
+from .fastjson import RAW_JSON, jsonify, jsonify_raw, loads
+from .conditional import conditional_response, make_etag
+from .token_manager import TokenManager
+from .bundle import BundleError, import_bundle, iter_bundle, session_sections
+from .snapshot import SnapshotReader, session_fingerprint
+from .profiling import RequestProfiler
+from .events import SSE_MIMETYPE, EventBroker, TooManySubscribers
+from .payload_cache import SharePayloadCache, ShareDataMissing
+from .changes import ChangeTracker
+from .share_builder import ParallelShareBuilder, read_catalog_rates, read_rate_analysis
 import uuid
+import threading
+import time
 from dotenv import load_dotenv
 import os
 from flasgger import Swagger, swag_from
 import traceback
+import tempfile
+from contextlib import nullcontext
+from urllib.parse import urlencode
 
 # Load environment variables from .env file
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
@@ -19,6 +40,10 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
 db_path = os.path.join(PROJECT_ROOT, 'data', 'aetherone.db')
 db = get_case_dao(db_path)
+# Exports read through their own read-only snapshot connection instead of the shared DAO
+snapshot_reader = SnapshotReader(db_path) if os.getenv('EXPORT_SNAPSHOT', '1') != '0' else None
+# Bundles can be imported by file name only from this directory; unset, only uploads are accepted
+bundle_import_dir = os.path.realpath(os.getenv('BUNDLE_IMPORT_DIR')) if os.getenv('BUNDLE_IMPORT_DIR') else None
 
 def p(obj, title="Debug Object"):
     """
@@ -53,6 +78,8 @@ def p(obj, title="Debug Object"):
 def create_blueprint():
     print("[DEBUG] Creating AetherOnePySocial blueprint...")
     social_blueprint = Blueprint('social', __name__)
+    profiler = RequestProfiler()
+    profiler.install(social_blueprint)
     
     # Initialize databases
     social_db_path = os.path.join(os.path.dirname(__file__), 'social.db')
@@ -74,18 +101,75 @@ def create_blueprint():
     login_url = f"{API_BASE_URL}/api/auth/login"
     register_url = f"{API_BASE_URL}/api/auth/register"
     logout_url = f"{API_BASE_URL}/api/auth/logout" # needs to be made on serverside logout endpoint
+    refresh_url = f"{API_BASE_URL}/api/auth/refresh"
     key_url = f"{API_BASE_URL}/api/keys"
     analysis_url = f"{API_BASE_URL}/api/analysis/share"
     analysis_connected_key_url = f"{API_BASE_URL}/api/analysis/key"
     cleanup_data = f"{API_BASE_URL}/api/utils/clear-data"
 
+    def current_token():
+        user = social_db.get_only_user()
+        return user.get('token') if user else None
+
+    # All calls to the social server go through this client (timeout, circuit breaker, offline cache/queue)
+    upstream = UpstreamClient(API_BASE_URL, social_db, current_token)
+    token_manager = TokenManager(social_db, upstream.session, refresh_url, login_url, timeout=upstream.timeout)
+    upstream.set_auth(token_manager)
+    share_formats = ShareFormatNegotiator()
+    # Parsed /api/analysis/key results, paged locally when the server does not page itself
+    analysis_results_cache = ParsedResultCache(ttl=float(os.getenv('ANALYSIS_CACHE_TTL', '60')))
+    # Key changes (published by social_db after commit) and share progress for /events
+    events = EventBroker()
+    social_db.add_listener(events.publish)
+    # One share at a time per (key, session): a repeated click waits and then finds the first in share_log
+    share_locks = {}
+    share_locks_guard = threading.Lock()
+    # Built share payloads per (session, user), valid while the session's fingerprint is unchanged
+    share_cache = SharePayloadCache()
+    # Reads the rates and rate_analysis parts of a share in a worker pool (SHARE_BUILD_POOL)
+    share_builder = ParallelShareBuilder(snapshot_reader)
+    # Commits of the host app to aetherone.db, per session/analysis, for the caches and /events
+    aetherone_changes = ChangeTracker(snapshot_reader)
+
+    def on_aetherone_change(changes):
+        share_cache.invalidate_where(lambda cache_key: changes.affects_session(cache_key[0]))
+        events.publish('sessions.changed', changes.as_dict())
+
+    aetherone_changes.register(on_aetherone_change)
+
+    def is_json_response(resp):
+        return 'json' in (resp.headers.get('Content-Type') or '')
+
+    def passthrough_response(resp):
+        """Forward an upstream response as is: status, content type and body bytes"""
+        return current_app.response_class(
+            resp.content,
+            status=resp.status_code,
+            content_type=resp.headers.get('Content-Type', 'application/json')
+        )
+
+    def offline_response():
+        return jsonify({
+            "status": "offline",
+            "message": "Social server is currently unreachable, try again later.",
+            "upstream": upstream.status()
+        }), 503
+
+    def busy_response():
+        # The request waited UPSTREAM_QUEUE_TIMEOUT for a slot of the outbound limiter
+        return jsonify({
+            "status": "busy",
+            "message": "Too many requests to the social server in progress, try again shortly.",
+            "upstream": upstream.status()
+        }), 503, {"Retry-After": "5"}
+
     # Serve frontend static files
     FRONTEND_DIST_DIR = os.path.join(os.path.dirname(__file__), 'frontend', 'dist')
     FRONTEND_PUBLIC_DIR = os.path.join(os.path.dirname(__file__), 'frontend', 'public')
 
     # --- Auth helper functions ---
     def login_to_server(email, password, login_url):
-        response = requests.post(login_url, data={
+        response = upstream.post(login_url, data={
             "username": email,
             "password": password
         })
@@ -96,6 +180,7 @@ def create_blueprint():
             response.json().get("access_token"),
             response.json().get("user_id"),
         )
+        token_manager.remember_login(email, password, response.json())
         return response.json().get("access_token")
 
     def send_key_to_server(key_data, api_url, token):
@@ -104,7 +189,7 @@ def create_blueprint():
         print(f"[DEBUG]send_key_to_server headers: {headers}")
         print(f"[DEBUG]send_key_to_server payload: {key_data}")
         try:
-            response = requests.post(api_url, json=key_data, headers=headers)
+            response = upstream.post(api_url, json=key_data, headers=headers)
             print(f"[DEBUG]send_key_to_server response status: {response.status_code}")
             print(f"[DEBUG]send_key_to_server response body: {response.text}")
             response.raise_for_status()
@@ -114,6 +199,38 @@ def create_blueprint():
             print(f"[DEBUG]send_key_to_server exception: {e}")
             raise
 
+    # --- Replay of writes queued while the server was offline ---
+    def replay_key_create(payload, result):
+        if not result or not result.get('key_id'):
+            print(f"[DEBUG] Replayed key creation returned no key_id: {result}")
+            return
+        if social_db.get_analysis_key(result.get('key')):
+            return
+        social_db.create_analysis_key(
+            key_id=result.get('key_id'),
+            key=result.get('key'),
+            session_id=result.get('local_session_id'),
+            user_id=result.get('user_id'),
+            metadata=json.dumps({
+                "created_from": "offline_replay",
+                "timestamp": datetime.now().isoformat()
+            })
+        )
+
+    def replay_share(payload, result):
+        key = (payload or {}).get('data', {}).get('key')
+        if key:
+            # Replays come in bursts, write the status changes together
+            social_db.queue_analysis_key_status(key, 'used')
+            social_db.complete_queued_shares(
+                key, payload['data'].get('session_id'), result.get('id') if isinstance(result, dict) else None
+            )
+
+    upstream.register_replay_handler('key_create', replay_key_create)
+    upstream.register_replay_handler('share', replay_share)
+    # Writes queued before a restart go out once the server answers
+    upstream.schedule_replay()
+
     @social_blueprint.route('/key', methods=['POST'])
     def create_analysis_key():
         """
@@ -194,6 +311,13 @@ def create_blueprint():
                         "status": "error",
                         "message": "No key_id returned from external server"
                     }), 500
+            except UpstreamOffline:
+                write_id = upstream.queue_write('key_create', 'POST', key_url, key_data)
+                return jsonify({
+                    "status": "queued",
+                    "message": "Social server is offline, key creation queued and will be sent on recovery.",
+                    "pending_write_id": write_id
+                }), 202
             except Exception as e:
                 print(f"[DEBUG]create_analysis_key: Exception from send_key_to_server: {e}")
                 return jsonify({
@@ -204,14 +328,13 @@ def create_blueprint():
                 "created_from": "key_endpoint",
                 "timestamp": datetime.now().isoformat()
             })
-            social_db.create_analysis_key(
+            key_data_local = social_db.create_analysis_key_row(
                 key_id=key_id,
                 key=key,
                 session_id=session_id,
                 user_id=user_id,
                 metadata=metadata
             )
-            key_data_local = social_db.get_analysis_key(key)
             return jsonify({
                 "status": "success",
                 "server": result,
@@ -224,6 +347,160 @@ def create_blueprint():
                 "message": str(e)
             }), 500
 
+    def request_keys_from_server(server_user_id, session_ids, token):
+        """
+        Ask the server for keys for many sessions: one call to {key_url}/batch, or concurrent
+        single POSTs when the server has no batch endpoint.
+        Returns (server results, failures, writes queued because the server went offline).
+        """
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        batch_url = f"{key_url}/batch"
+        if upstream.supports('key_batch', batch_url) is not False:
+            resp = upstream.post(batch_url, json={
+                "user_id": server_user_id,
+                "local_session_ids": session_ids
+            }, headers=headers)
+            if resp.status_code in (404, 405):
+                print("[DEBUG] Server has no batch key endpoint, creating keys one by one")
+                upstream.record_support('key_batch', batch_url, False)
+            else:
+                resp.raise_for_status()
+                upstream.record_support('key_batch', batch_url, True)
+                body = resp.json()
+                keys = body.get('keys', []) if isinstance(body, dict) else body
+                results = [k for k in keys if k.get('key_id')]
+                returned = {k.get('local_session_id') for k in results}
+                failed = [{"local_session_id": sid, "error": "No key returned"} for sid in session_ids if sid not in returned]
+                return results, failed, []
+        pending = [
+            upstream.submit('POST', key_url, json={"user_id": server_user_id, "local_session_id": sid}, headers=headers)
+            for sid in session_ids
+        ]
+        results, failed, queued = [], [], []
+        for sid, resp in zip(session_ids, upstream.gather(pending)):
+            if isinstance(resp, UpstreamOffline):
+                queued.append(upstream.queue_write('key_create', 'POST', key_url, {
+                    "user_id": server_user_id,
+                    "local_session_id": sid
+                }))
+            elif isinstance(resp, Exception):
+                failed.append({"local_session_id": sid, "error": str(resp)})
+            elif not resp.ok:
+                failed.append({"local_session_id": sid, "error": f"HTTP {resp.status_code}: {resp.text}"})
+            else:
+                result = resp.json()
+                if result.get('key_id'):
+                    results.append(result)
+                else:
+                    failed.append({"local_session_id": sid, "error": "No key_id returned from external server"})
+        return results, failed, queued
+
+    @social_blueprint.route('/keys', methods=['POST'])
+    def create_analysis_keys_bulk():
+        """
+        Create analysis keys for many sessions in one call. Requires login.
+        Sessions that already have a key are returned under 'existing'.
+        ---
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              properties:
+                local_session_ids:
+                  type: array
+                  items:
+                    type: integer
+                  description: Local session IDs
+        responses:
+          200:
+            description: Keys created (status 'partial' when some failed)
+          202:
+            description: Server offline, key creation queued
+          400:
+            description: Missing or invalid local_session_ids
+          401:
+            description: Unauthorized
+        """
+        try:
+            data = request.get_json() or {}
+            user = social_db.get_only_user()
+            if not user or not user.get('token'):
+                return jsonify({
+                    "status": "error",
+                    "message": "No user or token found. Please login."
+                }), 401
+            server_user_id = user.get('server_user_id')
+            token = user.get('token')
+            session_ids = data.get('local_session_ids')
+            if not isinstance(session_ids, list) or not session_ids:
+                return jsonify({
+                    "status": "error",
+                    "message": "local_session_ids must be a non-empty list"
+                }), 400
+            try:
+                session_ids = list(dict.fromkeys(int(s) for s in session_ids))
+            except (TypeError, ValueError):
+                return jsonify({
+                    "status": "error",
+                    "message": "local_session_ids must be integers"
+                }), 400
+
+            existing = social_db.get_analysis_keys_by_sessions(server_user_id, session_ids)
+            existing_sessions = {k['session_id'] for k in existing}
+            missing = [sid for sid in session_ids if sid not in existing_sessions]
+            results, failed, queued = [], [], []
+            if missing:
+                if upstream.is_offline():
+                    queued = [upstream.queue_write('key_create', 'POST', key_url, {
+                        "user_id": server_user_id,
+                        "local_session_id": sid
+                    }) for sid in missing]
+                else:
+                    try:
+                        results, failed, queued = request_keys_from_server(server_user_id, missing, token)
+                    except UpstreamOffline:
+                        queued = [upstream.queue_write('key_create', 'POST', key_url, {
+                            "user_id": server_user_id,
+                            "local_session_id": sid
+                        }) for sid in missing]
+            if results:
+                metadata = json.dumps({
+                    "created_from": "bulk_key_endpoint",
+                    "timestamp": datetime.now().isoformat()
+                })
+                social_db.create_analysis_keys([{
+                    "key_id": r.get('key_id'),
+                    "key": r.get('key'),
+                    "session_id": r.get('local_session_id'),
+                    "user_id": r.get('user_id'),
+                    "metadata": metadata
+                } for r in results])
+            created = social_db.get_analysis_keys_by_sessions(
+                server_user_id, [r.get('local_session_id') for r in results]
+            ) if results else []
+            if queued and not results:
+                status, code = "queued", 202
+            elif failed or queued:
+                status, code = "partial", 200
+            else:
+                status, code = "success", 200
+            return jsonify({
+                "status": status,
+                "existing": existing,
+                "created": created,
+                "server": results,
+                "failed": failed,
+                "pending_write_ids": queued
+            }), code
+        except Exception as e:
+            print(f"[DEBUG]create_analysis_keys_bulk: {e}")
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 500
+
     @social_blueprint.route('/key/<int:user_id>', methods=['GET'])
     def get_user_analysis_keys(user_id):
         """
@@ -251,9 +528,9 @@ def create_blueprint():
             description: Unauthorized
         """
 
-        keys = social_db.get_analysis_keys_by_user(user_id)
         # Fetch server keys as well
         server_keys = None
+        pending = None
 
         user = social_db.get_only_user()
         # print(f"[DEBUG]get_user_analysis_keys user: {user}")
@@ -268,39 +545,58 @@ def create_blueprint():
             }
             # print(f"[DEBUG] Requesting: {url}")
             # print(f"[DEBUG] Headers: {headers}")
+            # Start the server request first so it runs while the local keys are read
+            pending = upstream.submit('GET', url, headers=headers)
+
+        # Version first, so a write during the read gives a newer ETag next time
+        local_version = social_db.table_version('analysis_keys')
+        keys = social_db.get_analysis_keys_by_user(user_id)
 
+        # Raw server body, parsed only when the client does not have this version yet
+        server_body = None
+        if pending is not None:
             try:
-                resp = requests.get(url, headers=headers)
+                resp = pending.result()
                 print(f"[DEBUG] Status: {resp.status_code}")
                 print(f"[DEBUG] Response body: {resp.text}")
 
                 if resp.status_code == 200:
-                    server_keys = resp.json()
+                    server_body = resp.content
                 elif resp.status_code == 404:
                     # No session keys found for this user
                     print("[DEBUG] No session keys found for user")
-                    server_keys = []
+                    server_body = b'[]'
                 elif resp.status_code == 400:
                     # Invalid key format
                     print("[DEBUG] Invalid key format")
-                    server_keys = []
+                    server_body = b'[]'
                 else:
                     # For other errors, raise
                     resp.raise_for_status()
-                    server_keys = []
+                    server_body = b'[]'
             except Exception as e:
                 print(f"[DEBUG] HTTPS request failed: {e}")
+                server_body = b'[]'
+        offline = upstream.is_offline()
+
+        def build():
+            try:
+                server_keys = loads(server_body) if server_body is not None else None
+            except ValueError as e:
+                print(f"[DEBUG] Invalid JSON from server: {e}")
                 server_keys = []
-        #print(f"[DEBUG]get_user_analysis_keys server_keys: {server_keys}")
-        return jsonify({
-            "status": "success",
-            "message": f"Found {len(keys)} keys for user_id server side use_id  {user_id}",
-            "data": {
-                "user_id": user_id,
-                "local": keys,
-                "server": server_keys
-            }
-        })
+            #print(f"[DEBUG]get_user_analysis_keys server_keys: {server_keys}")
+            return jsonify({
+                "status": "success",
+                "offline": offline,
+                "message": f"Found {len(keys)} keys for user_id server side use_id  {user_id}",
+                "data": {
+                    "user_id": user_id,
+                    "local": keys,
+                    "server": server_keys
+                }
+            })
+        return conditional_response(make_etag('keys', user_id, local_version, offline, server_body), build)
 
     @social_blueprint.route('/key/<string:key>', methods=['GET'])
     def get_key_by_string(key):
@@ -326,34 +622,47 @@ def create_blueprint():
           401:
             description: Unauthorized
         """
+        # Start the server request first so it runs while the local key is read
+        server_key = None
+        pending = None
+        user = social_db.get_only_user()
+        token = user.get('token') if user else None
+        if token:
+            url = f"{key_url}/{key}"
+            headers = {
+                "Authorization": f"Bearer {token.strip()}",
+                "Accept": "application/json",
+                "User-Agent": "python-requests/2.25.1"
+            }
+            print(f"[DEBUG] Requesting: {url}")
+            print(f"[DEBUG] Headers: {headers}")
+            pending = upstream.submit('GET', url, headers=headers)
         # Fetch local key
         local_key = social_db.get_analysis_key(key)
         # Fetch server key
-        server_key = None
         try:
-            user = social_db.get_only_user()
-            token = user.get('token') if user else None
-            if token:
-                url = f"{key_url}/{key}"
-                headers = {
-                    "Authorization": f"Bearer {token.strip()}",
-                    "Accept": "application/json",
-                    "User-Agent": "python-requests/2.25.1"
-                }
-                print(f"[DEBUG] Requesting: {url}")
-                print(f"[DEBUG] Headers: {headers}")
-
-                resp = requests.get(url, headers=headers)
+            if pending is not None:
+                resp = pending.result()
                 print(f"[DEBUG] Status: {resp.status_code}")
+                if resp.ok and is_json_response(resp):
+                    # The server body goes into the response as is instead of being parsed and re-encoded
+                    return jsonify_raw({
+                        "status": "success",
+                        "offline": upstream.is_offline(),
+                        "data": {"local": local_key, "server": RAW_JSON}
+                    }, resp.content)
                 print(f"[DEBUG] Response body: {resp.text}")
                 resp.raise_for_status()
                 server_key = resp.json()
                 
+        except UpstreamOffline as e:
+            server_key = {"error": str(e), "offline": True}
         except Exception as e:
             print(f"[DEBUG] Failed to fetch server key: {e}")
             server_key = {"error": str(e)}
         return jsonify({
             "status": "success",
+            "offline": upstream.is_offline(),
             "data": {
                 "local": local_key,
                 "server": server_key
@@ -406,12 +715,8 @@ def create_blueprint():
                 "updated_from": "key_update_endpoint",
                 "timestamp": datetime.now(timezone.utc).isoformat()
             })
-            # Update local key
-            if status:
-                social_db.update_analysis_key_status(key, status)
-            social_db.update_analysis_key_metadata(key, metadata)
-            # Get updated key data
-            key_data = social_db.get_analysis_key(key)
+            # Update local key, one statement returning the updated row
+            key_data = social_db.update_analysis_key(key, status=status or None, metadata=metadata)
             if not key_data:
                 return jsonify({
                     "status": "error",
@@ -431,9 +736,14 @@ def create_blueprint():
                     }
                     now_iso = datetime.now(timezone.utc).isoformat()
                     patch_data = {"used": True, "used_at": now_iso}
-                    resp = requests.patch(url, headers=headers, json=patch_data)
-                    resp.raise_for_status()
-                    server_response = resp.json()
+                    try:
+                        resp = upstream.patch(url, headers=headers, json=patch_data)
+                    except UpstreamOffline:
+                        write_id = upstream.queue_write('key_use', 'PATCH', url, patch_data)
+                        server_response = {"status": "queued", "pending_write_id": write_id}
+                    else:
+                        resp.raise_for_status()
+                        server_response = resp.json()
             except Exception as e:
                 print(f"[DEBUG] Failed to update key on server: {e}")
                 server_response = {"error": str(e)}
@@ -506,8 +816,10 @@ def create_blueprint():
                 type: object
         """
         try:
-            sessions = db.list_all_sessions()  # New method to be implemented in DAO
-            return jsonify({'sessions': [s.__dict__ for s in sessions]})
+            def build():
+                sessions = db.list_all_sessions()  # New method to be implemented in DAO
+                return jsonify({'sessions': [s.__dict__ for s in sessions]})
+            return conditional_response(make_etag('sessions', aetherone_version()), build)
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
         
@@ -516,6 +828,92 @@ def create_blueprint():
         session = db.get_session(session_id)
         return jsonify(session)
     
+    @social_blueprint.route('/bundle/session/<int:session_id>', methods=['GET'])
+    def export_session_bundle(session_id):
+        """
+        Export a session (case, analyses, catalogs, rates, rate_analysis) as a compressed bundle file.
+        The bundle is streamed while it is built.
+        ---
+        parameters:
+          - name: session_id
+            in: path
+            type: integer
+            required: true
+            description: Local session ID
+        responses:
+          200:
+            description: Bundle file (application/octet-stream)
+          404:
+            description: Session or its case not found
+        """
+        session = db.get_session(session_id)
+        if not session:
+            return jsonify({"status": "error", "message": "Invalid session ID"}), 404
+        # Checked before streaming: once the first bytes are sent the status can no longer change
+        if not db.get_case(session.caseID):
+            return jsonify({"status": "error", "message": f"Case of session {session_id} not found"}), 404
+        meta = {
+            "session_id": session_id,
+            "machine_id": str(uuid.getnode()),
+            "exported_at": datetime.now().isoformat()
+        }
+
+        def snapshot_sections():
+            # The read transaction stays open while the bundle is streamed
+            with export_snapshot() as dao:
+                yield from session_sections(dao, session_id)
+
+        return current_app.response_class(
+            iter_bundle(snapshot_sections(), meta=meta),
+            mimetype='application/octet-stream',
+            headers={"Content-Disposition": f"attachment; filename=session-{session_id}.aosb"}
+        )
+
+    @social_blueprint.route('/bundle/import', methods=['POST'])
+    def import_session_bundle():
+        """
+        Import a session bundle into aetherone.db in one transaction.
+        Send the file as multipart field 'bundle', or JSON {"path": "<file name>"} for a bundle in
+        BUNDLE_IMPORT_DIR (path imports are disabled when it is not set).
+        ---
+        responses:
+          200:
+            description: Imported, with row counts and the new session id
+          400:
+            description: No bundle or invalid bundle
+          403:
+            description: Path imports are disabled or the path is outside BUNDLE_IMPORT_DIR
+        """
+        upload = request.files.get('bundle')
+        tmp_path = None
+        try:
+            if upload:
+                fd, tmp_path = tempfile.mkstemp(suffix='.aosb')
+                with os.fdopen(fd, 'wb') as f:
+                    upload.save(f)
+                path = tmp_path
+            else:
+                name = (request.get_json(silent=True) or {}).get('path')
+                if not name:
+                    return jsonify({"status": "error", "message": "Upload a 'bundle' file or pass a 'path' in BUNDLE_IMPORT_DIR"}), 400
+                if not bundle_import_dir:
+                    return jsonify({"status": "error", "message": "Importing bundles by path is disabled (BUNDLE_IMPORT_DIR is not set)"}), 403
+                path = os.path.realpath(os.path.join(bundle_import_dir, name))
+                if os.path.commonpath([path, bundle_import_dir]) != bundle_import_dir:
+                    return jsonify({"status": "error", "message": "Path is outside BUNDLE_IMPORT_DIR"}), 403
+                if not os.path.isfile(path):
+                    return jsonify({"status": "error", "message": f"No bundle '{name}' in BUNDLE_IMPORT_DIR"}), 400
+            result = import_bundle(path, db_path)
+            return jsonify({"status": "success", **result})
+        except BundleError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except Exception as e:
+            print(f"[DEBUG] Bundle import failed: {e}")
+            return jsonify({"status": "error", "message": str(e)}), 500
+        finally:
+            if tmp_path:
+                os.remove(tmp_path)
+
     @social_blueprint.route('/keys/cleanup', methods=['POST'])
     def cleanup_keys():
         try:
@@ -550,9 +948,12 @@ def create_blueprint():
                 key:
                   type: string
                   description: Analysis key
+                force:
+                  type: boolean
+                  description: Upload again even when this content was already shared with this key
         responses:
           200:
-            description: Analysis shared successfully
+            description: Analysis shared successfully (duplicate true when it was shared before and not uploaded again)
             schema:
               type: object
               properties:
@@ -584,113 +985,78 @@ def create_blueprint():
                 "status": "error",
                 "message": "session_id, user_id, key and machine_id are required"
             }), 400
-       
+
+        def progress(stage, **details):
+            events.publish('share.progress', {"key": key, "session_id": session_id, "stage": stage, **details})
+
+        share = {"idempotency_key": None}
+
+        def failed(message, status_code):
+            if share["idempotency_key"]:
+                social_db.update_share_status(share["idempotency_key"], 'failed')
+            progress('failed', message=message)
+            return jsonify({"error": message}), status_code
+
+        def already_shared(previous):
+            """Response for a share recorded in share_log, None when it has to be sent (again)"""
+            if previous is None or data.get('force'):
+                return None
+            if previous['status'] == 'sent':
+                progress('done', external_reference=previous['external_reference'], duplicate=True)
+                return jsonify({
+                    "status": "success",
+                    "status_code": 200,
+                    "message": "Analysis data was already shared, not uploaded again",
+                    "external_reference": previous['external_reference'],
+                    "idempotency_key": previous['idempotency_key'],
+                    "duplicate": True
+                })
+            if previous['status'] == 'queued' and previous['pending_write_id'] \
+                    and social_db.pending_write_exists(previous['pending_write_id']):
+                progress('queued', pending_write_id=previous['pending_write_id'], duplicate=True)
+                return jsonify({
+                    "status": "queued",
+                    "status_code": 202,
+                    "message": "Analysis share is already queued and will be sent on recovery.",
+                    "pending_write_id": previous['pending_write_id'],
+                    "idempotency_key": previous['idempotency_key'],
+                    "duplicate": True
+                }), 202
+            return None
+
+        lock_name = (key, str(session_id))
+        with share_locks_guard:
+            lock = share_locks.setdefault(lock_name, [threading.Lock(), 0])
+            lock[1] += 1
+        lock[0].acquire()
+        progress('started')
         try:
             #p(session_id, "session_id")
             # Get session data
-            session = db.get_session(session_id)
-            if not session:
-                return jsonify({"error": "Invalid session ID"}), 404
-            #p(session, "session")
-            
-            # Get associated analysis
-            analyses = db.list_analysis(session.id)
-            if not analyses:
-                return jsonify({"error": "Associated analyses not found, your session is empty, no rates, you only have session"}), 404
-            #p(analysis, "analysis")
-            # Get case data
-            case = db.get_case(session.caseID)
-            if not case:
-                return jsonify({"error": "Associated case not found"}), 404
-            #p(case, "case")
-
-            # Build complete data structure
-            session_data = {
-                "session": {
-                    "id": session.id,
-                    "intention": session.intention if hasattr(session, 'intention') else None,
-                    "description": session.description if hasattr(session, 'description') else None,
-                    "created": session.created.isoformat() if hasattr(session, 'created') else None,
-                    "case_id": session.caseID if hasattr(session, 'caseID') else None,
-                },
-                "case": {
-                    "id": case.id,
-                    "name": case.name if hasattr(case, 'name') else None,
-                    "email": case.email if hasattr(case, 'email') else None,
-                    "color": case.color if hasattr(case, 'color') else None,
-                    "description": case.description if hasattr(case, 'description') else None,
-                    "created": case.created.isoformat() if hasattr(case, 'created') else None,
-                    "last_change": case.last_change if hasattr(case, 'last_change') else None
-                },
-                "analyses": []
-            }
-            for analysis in analyses:
-                # Get catalog data
-                catalog = db.get_catalog(analysis.catalogId)
-                if not catalog:
-                    return jsonify({"error": "Associated catalog not found"}), 404
-                #p(catalog, "catalog")    
-
-                # Get rates for this catalog
-                rates = db.list_rates_from_catalog(catalog.id)
-                if not rates:
-                    return jsonify({"error": "Rates not found"}), 404
-                #p(rates, "rates")
-                #p(analysis.id, "analysis.id")
-                # Get rate analysis results
-                rate_analysis = db.list_rates_for_analysis(analysis.id)
-                if not rate_analysis:
-                    return jsonify({"error": "Rate analysis results not found"}), 404
-                #p(rate_analysis, "rate_analysis")
-
-                # Debug print for each analysis
-                #p(analysis, f"Analysis {analysis.id}")
-                #p(rates, f"Rates for analysis {analysis.id}")
-                #p(rate_analysis, f"Rate Analysis for analysis {analysis.id}")
-                #p(catalog, f"Catalog for analysis {analysis.id}")
-            
-                analysis_data = {
-                    "analysis": {
-                        "user_id": user_id,
-                        "id": analysis.id,
-                        "name": analysis.name if hasattr(analysis, 'name') else None,
-                        "target_gv": analysis.target_gv if hasattr(analysis, 'target_gv') else None,
-                        "session_id": session_id,
-                        "catalog_id": analysis.catalogId if hasattr(analysis, 'catalogId') else None,
-                        "created": analysis.created.isoformat() if hasattr(analysis, 'created') else None
-                    },
-                    "catalog": {
-                        "id": catalog.id if catalog else None,
-                        "name": catalog.name if catalog else None,
-                        "description": catalog.description if catalog and hasattr(catalog, 'description') else None
-                    } if catalog else None,
-                    "rates": [
-                        {
-                            "id": rate.id,
-                            "signature": rate.signature if hasattr(rate, 'signature') else None,
-                            "description": rate.description if hasattr(rate, 'description') else None,
-                            "catalog_id": catalog.id,
-                        }
-                        for rate in rates
-                    ] if rates else [],
-                    "rate_analysis": [
-                        {
-                            "id": ra.id,
-                            "signature": ra.signature if hasattr(ra, 'signature') else None,
-                            "description": ra.description if hasattr(ra, 'description') else None,
-                            "catalog_id": ra.catalog_id if hasattr(ra, 'catalog_id') else None,
-                            "analysis_id": ra.analysis_id if hasattr(ra, 'analysis_id') else None,
-                            "energetic_value": ra.energetic_value if hasattr(ra, 'energetic_value') else None,
-                            "gv": ra.gv if hasattr(ra, 'gv') else None,
-                            "level": ra.level if hasattr(ra, 'level') else None,
-                            "potencyType": ra.potency_type if hasattr(ra, 'potency_type') else None,
-                            "potency": ra.potency if hasattr(ra, 'potency') else None,
-                            "note": ra.note if hasattr(ra, 'note') else None
-                        }
-                        for ra in rate_analysis
-                    ] if rate_analysis else []
-                }
-                session_data["analyses"].append(analysis_data)
+            # One read-only snapshot for the whole session, consistent even while rates are written
+            with export_snapshot() as dao:
+                session = dao.get_session(session_id)
+                if not session:
+                    return failed("Invalid session ID", 404)
+
+                # Unchanged since the last share with this key: answer from share_log without building
+                fingerprint = session_fingerprint(dao, session.id)
+                previous = social_db.get_latest_share(key, session_id) if fingerprint else None
+                if previous and previous['source_fingerprint'] == fingerprint:
+                    duplicate = already_shared(previous)
+                    if duplicate is not None:
+                        return duplicate
+                #p(session, "session")
+
+                # Built before (pre-warmed or an earlier attempt) from the same data: only the upload is left
+                cache_key = (session_id, user_id)
+                session_data = share_cache.get(cache_key, fingerprint)
+                if session_data is None:
+                    budget = MemoryBudget()
+                    session_data = build_session_data(dao, session, session_id, user_id, budget, progress)
+                    share_cache.set(cache_key, fingerprint, session_data, budget.used)
+                else:
+                    progress('cached', analyses=len(session_data["analyses"]))
 
             
             data_to_send = {
@@ -704,29 +1070,216 @@ def create_blueprint():
                     "analyses": session_data
                 }
             }
-            data_to_send = convert_datetimes(data_to_send)
+            # Same content shared before with this key (the session changed and changed back)
+            payload_hash = content_hash(data_to_send)
+            idempotency = idempotency_key(key, session_id, payload_hash)
+            duplicate = already_shared(social_db.get_share(idempotency))
+            if duplicate is not None:
+                return duplicate
+            social_db.record_share(idempotency, key, session_id, payload_hash, 'sending', source_fingerprint=fingerprint)
+            share["idempotency_key"] = idempotency
+            headers = {**headers, IDEMPOTENCY_HEADER: idempotency}
+
             # Send to external API
-            response = requests.post(
-                analysis_url,
-                json=data_to_send,
-                headers=headers
-            )
+            progress('sending')
+            try:
+                response = post_share_payload(data_to_send, headers)
+            except UpstreamOffline:
+                body, _ = encode_share_payload(data_to_send, 'json')
+                write_id = upstream.queue_write('share', 'POST', analysis_url, body,
+                                                headers={IDEMPOTENCY_HEADER: idempotency})
+                with social_db.transaction():
+                    social_db.update_share_status(idempotency, 'queued', pending_write_id=write_id)
+                    save_share_summaries(key, session_id, session_data)
+                progress('queued', pending_write_id=write_id)
+                return jsonify({
+                    "status": "queued",
+                    "status_code": 202,
+                    "message": "Social server is offline, analysis share queued and will be sent on recovery.",
+                    "pending_write_id": write_id,
+                    "idempotency_key": idempotency
+                }), 202
             response.raise_for_status()
+            try:
+                external_reference = response.json().get("id")
+            except ValueError:
+                # Accepted all the same, the share must not be recorded as failed
+                external_reference = None
             
-            # Update key status
-            social_db.update_analysis_key_status(key, 'used')
+            # Update key status, share log and summaries in one commit
+            with social_db.transaction():
+                social_db.update_analysis_key_status(key, 'used')
+                social_db.update_share_status(idempotency, 'sent', external_reference=external_reference)
+                save_share_summaries(key, session_id, session_data)
+            analysis_results_cache.invalidate(key)
+            progress('done', external_reference=external_reference)
             
             return jsonify({
                 "status": "success",
                 "status_code": 200,
                 "message": "Analysis data shared successfully",
-                "external_reference": response.json().get("id")
+                "external_reference": external_reference,
+                "idempotency_key": idempotency
             })
             
+        except ShareDataMissing as e:
+            return failed(str(e), 404)
+        except PayloadMemoryExceeded as e:
+            return failed(str(e), 413)
+        except UpstreamBusy:
+            # Not sent: no limiter slot within UPSTREAM_QUEUE_TIMEOUT, the same share can be retried
+            if share["idempotency_key"]:
+                social_db.update_share_status(share["idempotency_key"], 'busy')
+            progress('busy')
+            return busy_response()
         except requests.RequestException as e:
-            return jsonify({"error": f"External API error: {str(e)}"}), 500
+            return failed(f"External API error: {str(e)}", 500)
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            return failed(str(e), 500)
+        finally:
+            with share_locks_guard:
+                lock[0].release()
+                lock[1] -= 1
+                if not lock[1]:
+                    share_locks.pop(lock_name, None)
+
+    @social_blueprint.route('/analysis/prewarm', methods=['POST'])
+    def prewarm_share():
+        """
+        Build the share payload of a session in the background (e.g. when it is selected for sharing),
+        so the share itself only uploads. Set SHARE_CACHE_MAX_MB=0 to disable.
+        ---
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              properties:
+                session_id:
+                  type: integer
+        responses:
+          202:
+            description: Pre-warming started (started false when already cached, running or disabled)
+          400:
+            description: Missing session_id
+          401:
+            description: No user logged in
+        """
+        data = request.get_json(silent=True) or {}
+        session_id = data.get('session_id')
+        if not session_id:
+            return jsonify({"status": "error", "message": "session_id is required"}), 400
+        user = social_db.get_only_user()
+        if not user or not user.get('token'):
+            return jsonify({"status": "error", "message": "No user or token found. Please login."}), 401
+        user_id = user.get('server_user_id')
+
+        def build():
+            with export_snapshot() as dao:
+                fingerprint = session_fingerprint(dao, session_id)
+                # Without a fingerprint (host DAO) the entry could not be validated, nothing to cache
+                if fingerprint is None or share_cache.contains((session_id, user_id), fingerprint):
+                    return None
+                budget = MemoryBudget()
+                session = dao.get_session(session_id)
+                session_data = build_session_data(dao, session, session_id, user_id, budget)
+                return fingerprint, session_data, budget.used
+
+        started = share_cache.prewarm((session_id, user_id), build)
+        return jsonify({"status": "accepted", "started": started, "cache": share_cache.status(),
+                        "builder": share_builder.status()}), 202
+
+    @social_blueprint.route('/analysis_summaries/<string:key>', methods=['GET'])
+    def get_analysis_summaries(key):
+        """
+        Summaries (top hits, gv histogram, level/potency counts) of the analyses shared locally with a key.
+        ---
+        parameters:
+          - name: key
+            in: path
+            type: string
+            required: true
+            description: The key string
+        responses:
+          200:
+            description: Summaries per analysis
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                summaries:
+                  type: array
+                  items:
+                    type: object
+        """
+        try:
+            rows = social_db.get_analysis_summaries_by_key(key)
+            for row in rows:
+                row['summary'] = json.loads(row['summary'])
+            return jsonify({"status": "success", "summaries": rows})
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @social_blueprint.route('/search', methods=['GET'])
+    def search():
+        """
+        Full-text search over the analysis keys and locally shared sessions in social.db (works offline).
+        Every word of q must match (as a prefix) the key, intention, description, case name, rate signatures or notes.
+        ---
+        parameters:
+          - name: q
+            in: query
+            type: string
+            required: true
+          - name: kind
+            in: query
+            type: string
+            enum: [key, share]
+            required: false
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            default: 20
+        responses:
+          200:
+            description: Matches, best first
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                results:
+                  type: array
+                  items:
+                    type: object
+                took_ms:
+                  type: number
+          400:
+            description: Missing q or invalid kind
+        """
+        text = request.args.get('q', '').strip()
+        kind = request.args.get('kind') or None
+        if not text:
+            return jsonify({"status": "error", "message": "Missing required 'q' parameter"}), 400
+        if kind not in (None, 'key', 'share'):
+            return jsonify({"status": "error", "message": "kind must be 'key' or 'share'"}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), 200))
+        except ValueError:
+            return jsonify({"status": "error", "message": "limit must be a number"}), 400
+        started = time.perf_counter()
+        try:
+            results = social_db.search(text, limit=limit, kind=kind)
+        except Exception as e:
+            return jsonify({"status": "error", "message": str(e)}), 500
+        return jsonify({
+            "status": "success",
+            "results": results,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
 
     @social_blueprint.route('/debug_routes', methods=['GET'])
     def debug_routes():
@@ -797,6 +1350,126 @@ def create_blueprint():
                 "message": str(e)
             }), 500
 
+    @social_blueprint.route('/upstream/status', methods=['GET'])
+    def upstream_status():
+        """
+        Circuit breaker state of the social server connection, queued writes and token expiry.
+        ---
+        responses:
+          200:
+            description: Upstream status
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                upstream:
+                  type: object
+        """
+        return jsonify({
+            "status": "offline" if upstream.is_offline() else "online",
+            "upstream": upstream.status(),
+            "auth": token_manager.status(),
+            "changes": aetherone_changes.status(),
+            "events": events.status()
+        })
+
+    @social_blueprint.route('/events', methods=['GET'])
+    def event_stream():
+        """
+        Server-Sent Events stream of key changes and share progress, for incremental UI updates.
+        Events: key.created / key.updated (analysis_keys row or changed fields), key.deleted ({key}),
+        keys.changed (bulk change, refetch the keys), share.progress ({key, session_id, stage, ...})
+        and reset (events were missed, refetch everything). Reconnecting with Last-Event-ID replays missed events.
+        ---
+        produces:
+          - text/event-stream
+        responses:
+          200:
+            description: Event stream
+          503:
+            description: Too many open event streams
+        """
+        try:
+            subscriber = events.subscribe(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        except TooManySubscribers as e:
+            return jsonify({"status": "error", "message": str(e)}), 503
+        return current_app.response_class(
+            events.stream(subscriber),
+            mimetype=SSE_MIMETYPE,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    def profiles_forbidden():
+        if not profiler.enabled:
+            return jsonify({"status": "error", "message": "Profiling is disabled (PROFILING_ENABLED)"}), 404
+        if profiler.token and request.headers.get('X-Profile-Token', request.args.get('_profile_token')) != profiler.token:
+            return jsonify({"status": "error", "message": "Invalid profiling token"}), 403
+        return None
+
+    @social_blueprint.route('/profiles', methods=['GET'])
+    def list_profiles():
+        """
+        Profiles captured for requests sent with X-Profile: 1 (or ?_profile=1), newest first.
+        Needs PROFILING_ENABLED=1 and, when configured, the PROFILING_TOKEN.
+        ---
+        responses:
+          200:
+            description: Captured profiles
+          403:
+            description: Invalid profiling token
+          404:
+            description: Profiling disabled
+        """
+        forbidden = profiles_forbidden()
+        if forbidden:
+            return forbidden
+        return jsonify({"status": "success", "profiles": profiler.list()})
+
+    @social_blueprint.route('/profiles/<string:profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        """
+        Download one profile: cProfile stats file (open with pstats or snakeviz), or ?format=text for the top functions.
+        ---
+        parameters:
+          - name: profile_id
+            in: path
+            type: string
+            required: true
+          - name: format
+            in: query
+            type: string
+            description: prof (default) or text
+        responses:
+          200:
+            description: Profile
+          404:
+            description: Profile not found or profiling disabled
+        """
+        forbidden = profiles_forbidden()
+        if forbidden:
+            return forbidden
+        profile = profiler.get(profile_id)
+        if not profile:
+            return jsonify({"status": "error", "message": "Profile not found"}), 404
+        if request.args.get('format') == 'text':
+            return current_app.response_class(profile["text"], mimetype='text/plain')
+        return current_app.response_class(
+            profile["stats"],
+            mimetype='application/octet-stream',
+            headers={"Content-Disposition": f"attachment; filename=profile-{profile_id}.prof"}
+        )
+
+    @social_blueprint.route('/upstream/replay', methods=['POST'])
+    def upstream_replay():
+        """
+        Replay writes queued while offline (normally done automatically when the server comes back).
+        """
+        if upstream.is_offline():
+            return offline_response()
+        upstream.replay_pending()
+        return jsonify({"status": "success", "upstream": upstream.status()})
+
     @social_blueprint.route('/send_key/<string:key>', methods=['GET'])
     def send_key(key):
         """
@@ -847,16 +1520,23 @@ def create_blueprint():
             print(f"[DEBUG] Requesting: {url}")
             print(f"[DEBUG] Headers: {headers}")
 
-            resp = requests.get(url, headers=headers)
+            resp = upstream.fetch('GET', url, headers=headers)
             print(f"[DEBUG] Status: {resp.status_code}")
+            if resp.ok and is_json_response(resp):
+                return jsonify_raw({"status": "success", "offline": resp.from_cache, "result": RAW_JSON}, resp.content)
             print(f"[DEBUG] Response body: {resp.text}")
             resp.raise_for_status()
             result = resp.json()
             print(f"[DEBUG]send_key result: {result}")
             return jsonify({
                 "status": "success",
+                "offline": resp.from_cache,
                 "result": result
             })
+        except UpstreamOffline:
+            return offline_response()
+        except UpstreamBusy:
+            return busy_response()
         except Exception as e:
             return jsonify({
                 "status": "error",
@@ -874,6 +1554,21 @@ def create_blueprint():
             type: string
             required: true
             description: The key string to fetch analysis for
+          - name: page
+            in: query
+            type: integer
+            required: false
+            description: Page number (1-based); enables paging
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: Sessions per page (default 20, max 500)
+          - name: fields
+            in: query
+            type: string
+            required: false
+            description: Comma separated session fields to return (id is always included)
         responses:
           200:
             description: Analysis list
@@ -884,6 +1579,8 @@ def create_blueprint():
                   type: string
                 result:
                   type: object
+                pagination:
+                  type: object
           401:
             description: Unauthorized
           400:
@@ -903,9 +1600,22 @@ def create_blueprint():
             }), 401
 
         token = user.get('token')
+        paging = parse_page_args(request.args)
         try:
+            if paging:
+                page, limit, fields = paging
+                cached = analysis_results_cache.get(key)
+                if cached is not None:
+                    return paged_analysis_response(cached, page, limit, fields, False)
             headers = {"Authorization": f"Bearer {token}"}
-            resp = requests.get(f"{analysis_connected_key_url}/{key}", headers=headers)
+            url = f"{analysis_connected_key_url}/{key}"
+            if paging and limit is not None and upstream.supports('paging', url) is not False:
+                # Ask the server for the page; older servers ignore the parameters and send everything
+                query = {"page": page, "limit": limit}
+                if fields:
+                    query["fields"] = ",".join(fields)
+                url = f"{url}?{urlencode(query)}"
+            resp = upstream.fetch('GET', url, headers=headers)
             try:
                 resp.raise_for_status()
             except requests.HTTPError as http_err:
@@ -925,16 +1635,50 @@ def create_blueprint():
                     }), resp.status_code
 
             result = resp.json()
+            if paging:
+                if isinstance(result, dict) and isinstance(result.get("pagination"), dict):
+                    upstream.record_support('paging', url, True)
+                    return jsonify({
+                        "status": "success",
+                        "offline": resp.from_cache,
+                        "result": result,
+                        "pagination": {**result["pagination"], "source": "upstream"}
+                    })
+                if limit is not None:
+                    upstream.record_support('paging', url, False)
+                analysis_results_cache.set(key, result)
+                return paged_analysis_response(result, page, limit, fields, resp.from_cache)
             print(f"[DEBUG]analysis_for_key result: {result}")
             return jsonify({
                 "status": "success",
+                "offline": resp.from_cache,
                 "result": result
             })
+        except UpstreamOffline:
+            return offline_response()
+        except UpstreamBusy:
+            return busy_response()
         except Exception as e:
             return jsonify({
                 "status": "error",
                 "message": str(e)
             }), 500
+
+    def paged_analysis_response(result, page, limit, fields, offline):
+        """Page through a full, parsed /api/analysis/key result locally"""
+        items = result.get("data") if isinstance(result, dict) else result
+        if not isinstance(items, list):
+            items = []
+        page_items, pagination = paginate_items(items, page, limit, fields)
+        paged_result = {**result, "data": page_items} if isinstance(result, dict) else page_items
+        body = {
+            "status": "success",
+            "offline": offline,
+            "result": paged_result
+        }
+        if pagination is not None:
+            body["pagination"] = {**pagination, "source": "local"}
+        return jsonify(body)
     
     @social_blueprint.route('/check_key_exists/<string:key>', methods=['GET'])
     def check_key_exists(key):
@@ -959,7 +1703,9 @@ def create_blueprint():
         public_key_url = f"{API_BASE_URL}/api/analysis/public/key/{key}"
         try:
             headers = {"Authorization": f"Bearer {token}"}
-            resp = requests.get(public_key_url, headers=headers)
+            resp = upstream.fetch('GET', public_key_url, headers=headers)
+            if resp.ok:
+                return passthrough_response(resp)
             try:
                 resp.raise_for_status()
             except requests.HTTPError as http_err:
@@ -972,8 +1718,10 @@ def create_blueprint():
                         "message": str(http_err),
                         "raw_response": resp.text
                     }), resp.status_code
-            result = resp.json()
-            return jsonify(result)
+        except UpstreamOffline:
+            return offline_response()
+        except UpstreamBusy:
+            return busy_response()
         except Exception as e:
             return jsonify({
                 "status": "error",
@@ -1084,7 +1832,7 @@ def create_blueprint():
                 "password": password,
                 "username": username
             }
-            response = requests.post(register_url, json=payload)
+            response = upstream.post(register_url, json=payload)
             response.raise_for_status()
 
             response.raise_for_status()
@@ -1094,6 +1842,7 @@ def create_blueprint():
                                 email, 
                                 response.json().get("access_token"),
                                 response.json().get("user_id"))
+            token_manager.remember_login(email, password, response.json())
             return jsonify({
                 "status": "success",
                 "external_response": response.json()
@@ -1104,15 +1853,151 @@ def create_blueprint():
                 "message": str(e)
             }), 500
 
-    def convert_datetimes(obj):
-        if isinstance(obj, dict):
-            return {k: convert_datetimes(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_datetimes(i) for i in obj]
-        elif isinstance(obj, datetime):
-            return obj.isoformat()
-        else:
-            return obj
+    def aetherone_version():
+        """Cheap validator of aetherone.db: data_version of a read-only connection, file stats otherwise"""
+        if snapshot_reader is not None:
+            try:
+                return snapshot_reader.data_version()
+            except Exception as e:
+                print(f"[DEBUG] data_version of aetherone.db unavailable: {e}")
+        stats = []
+        for path in (db_path, db_path + '-wal'):
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stats.append(None)
+        return tuple(stats)
+
+    def export_snapshot():
+        """Read-only snapshot of aetherone.db for one export, the shared DAO when that is not possible"""
+        if snapshot_reader is None:
+            return nullcontext(db)
+        return snapshot_reader.snapshot(fallback=db)
+
+    def build_session_data(dao, session, session_id, user_id, budget, progress=None):
+        """
+        The "analyses" part of a share payload: session, case and every analysis with its catalog,
+        rates and rate_analysis as columnar blocks. Raises ShareDataMissing when a part does not exist.
+        """
+        # Get associated analysis
+        analyses = dao.list_analysis(session.id)
+        if not analyses:
+            raise ShareDataMissing("Associated analyses not found, your session is empty, no rates, you only have session")
+        #p(analysis, "analysis")
+        # Get case data
+        case = dao.get_case(session.caseID)
+        if not case:
+            raise ShareDataMissing("Associated case not found")
+        #p(case, "case")
+
+        # Build complete data structure
+        session_data = {
+            "session": {
+                "id": session.id,
+                "intention": session.intention if hasattr(session, 'intention') else None,
+                "description": session.description if hasattr(session, 'description') else None,
+                "created": session.created.isoformat() if hasattr(session, 'created') else None,
+                "case_id": session.caseID if hasattr(session, 'caseID') else None,
+            },
+            "case": {
+                "id": case.id,
+                "name": case.name if hasattr(case, 'name') else None,
+                "email": case.email if hasattr(case, 'email') else None,
+                "color": case.color if hasattr(case, 'color') else None,
+                "description": case.description if hasattr(case, 'description') else None,
+                "created": case.created.isoformat() if hasattr(case, 'created') else None,
+                "last_change": case.last_change if hasattr(case, 'last_change') else None
+            },
+            "analyses": []
+        }
+        catalogs = []
+        for analysis in analyses:
+            # Get catalog data
+            catalog = dao.get_catalog(analysis.catalogId)
+            if not catalog:
+                raise ShareDataMissing("Associated catalog not found")
+            catalogs.append(catalog)
+
+        # Rates are read once per catalog even when several analyses use it. With a snapshot the
+        # rates and rate_analysis parts are read by a worker pool, otherwise one after the other
+        parallel = share_builder.build(dao, session.id, [a.id for a in analyses], [c.id for c in catalogs],
+                                       budget, progress)
+        catalog_rates = parallel[0] if parallel else {}
+        for index, (analysis, catalog) in enumerate(zip(analyses, catalogs)):
+            rates = catalog_rates.get(catalog.id)
+            if rates is None:
+                rates = catalog_rates[catalog.id] = read_catalog_rates(dao, catalog.id, budget)
+            if not rates["count"]:
+                raise ShareDataMissing("Rates not found")
+            # Get rate analysis results
+            if parallel:
+                rate_analysis, summary = parallel[1][index]
+            else:
+                rate_analysis, summary = read_rate_analysis(dao, analysis.id, budget)
+            if not rate_analysis["count"]:
+                raise ShareDataMissing("Rate analysis results not found")
+
+            analysis_data = {
+                "analysis": {
+                    "user_id": user_id,
+                    "id": analysis.id,
+                    "name": analysis.name if hasattr(analysis, 'name') else None,
+                    "target_gv": analysis.target_gv if hasattr(analysis, 'target_gv') else None,
+                    "session_id": session_id,
+                    "catalog_id": analysis.catalogId if hasattr(analysis, 'catalogId') else None,
+                    "created": analysis.created.isoformat() if hasattr(analysis, 'created') else None
+                },
+                "catalog": {
+                    "id": catalog.id if catalog else None,
+                    "name": catalog.name if catalog else None,
+                    "description": catalog.description if catalog and hasattr(catalog, 'description') else None
+                } if catalog else None,
+                "rates": rates,
+                "rate_analysis": rate_analysis
+            }
+            analysis_data["summary"] = summary
+            session_data["analyses"].append(analysis_data)
+            if progress is not None and not parallel:
+                progress('analysis', done=len(session_data["analyses"]), total=len(analyses),
+                         rates=rate_analysis["count"])
+        return session_data
+
+    def save_share_summaries(key, session_id, session_data):
+        social_db.save_analysis_summaries(key, session_id, [
+            (a["analysis"]["id"], json.dumps(a["summary"]))
+            for a in session_data["analyses"]
+        ])
+        # Searchable text of the share (/search): distinct signatures and notes of all analyses
+        signatures, notes = {}, {}
+        for a in session_data["analyses"]:
+            values = a["rate_analysis"]["values"]
+            for signature in values.get("signature") or ():
+                if signature:
+                    signatures[str(signature)] = None
+            for note in [a["analysis"].get("name")] + list(values.get("note") or ()):
+                if note:
+                    notes[str(note)] = None
+        social_db.index_shared_session(
+            key, session_id,
+            intention=session_data["session"].get("intention"),
+            description=session_data["session"].get("description"),
+            case_name=session_data["case"].get("name"),
+            signatures=' '.join(signatures),
+            notes=' '.join(notes)
+        )
+
+    def post_share_payload(data_to_send, headers):
+        """POST the share payload in the best wire format the server accepts (see share_codec)"""
+        response = None
+        for wire_format in share_formats.formats_for(API_BASE_URL):
+            body, format_headers = encode_share_payload(data_to_send, wire_format)
+            print(f"[DEBUG] Sharing analysis as {wire_format}, {len(body)} bytes")
+            response = upstream.post(analysis_url, data=body, headers={**headers, **format_headers})
+            share_formats.observe(API_BASE_URL, response.headers)
+            if not share_formats.rejected(API_BASE_URL, wire_format, response.status_code):
+                break
+        return response
 
     # Swagger config for blueprint
     swagger_template = {
@@ -1180,19 +2065,23 @@ def create_blueprint():
         List all servers from the servers table.
         """
         try:
-            servers = social_db.get_servers()
-            return jsonify({"status": "success", "servers": servers})
+            return conditional_response(
+                make_etag('servers', social_db.table_version('servers')),
+                lambda: jsonify({"status": "success", "servers": social_db.get_servers()})
+            )
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
     
     @social_blueprint.route('/user', methods=['GET'])
     def get_user_info():
         """Return the only user from social.db, including server_user_id."""
-        user = social_db.get_only_user()
-        if user:
-            return jsonify(user)
-        else:
-            return jsonify({'status': 'error', 'message': 'No user found'}), 404
+        def build():
+            user = social_db.get_only_user()
+            if user:
+                return jsonify(user)
+            else:
+                return jsonify({'status': 'error', 'message': 'No user found'}), 404
+        return conditional_response(make_etag('user', social_db.table_version('users')), build)
         
     @social_blueprint.route('/<path:filename>', methods=['GET'])
     def serve_vue_static(filename):
@@ -1213,11 +2102,14 @@ def create_blueprint():
         """
         plugins_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
         try:
-            plugins = [
-                name for name in os.listdir(plugins_dir)
-                if os.path.isdir(os.path.join(plugins_dir, name)) and not name.startswith('__')
-            ]
-            return jsonify({"status": "success", "plugins": plugins})
+            def build():
+                plugins = [
+                    name for name in os.listdir(plugins_dir)
+                    if os.path.isdir(os.path.join(plugins_dir, name)) and not name.startswith('__')
+                ]
+                return jsonify({"status": "success", "plugins": plugins})
+            # Adding or removing a plugin directory changes the mtime of the plugins directory
+            return conditional_response(make_etag('plugins', os.stat(plugins_dir).st_mtime_ns), build)
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
 
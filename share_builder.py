@@ -0,0 +1,175 @@
+"""
+Reads the per-analysis parts of a share payload (catalog rates, rate_analysis rows and their summary),
+serially on the share's DAO or in parallel in a pool of workers with their own connections.
+"""
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .analysis_summary import summarize_rate_analysis
+from .share_codec import (RATE_ANALYSIS_FIELDS, RATE_FIELDS, MemoryBudget, PayloadMemoryExceeded,
+                          add_constant_column, read_columnar)
+from .snapshot import SnapshotDAO, SnapshotReader, iter_dao_batches
+
+POOL_TYPES = ('thread', 'process', 'serial')
+
+
+def read_catalog_rates(dao, catalog_id, budget: MemoryBudget = None) -> dict:
+    """Columnar block of the rates of a catalog, with a catalog_id column"""
+    block = read_columnar(
+        iter_dao_batches(dao, 'rates_from_catalog', catalog_id, [a for _, a in RATE_FIELDS]),
+        [k for k, _ in RATE_FIELDS], budget
+    )
+    return add_constant_column(block, 'catalog_id', catalog_id)
+
+
+def read_rate_analysis(dao, analysis_id, budget: MemoryBudget = None):
+    """Columnar block of the rate_analysis rows of an analysis and its summary"""
+    block = read_columnar(
+        iter_dao_batches(dao, 'rates_for_analysis', analysis_id, [a for _, a in RATE_ANALYSIS_FIELDS]),
+        [k for k, _ in RATE_ANALYSIS_FIELDS], budget
+    )
+    return block, summarize_rate_analysis(block)
+
+
+_worker = threading.local()
+
+
+def _worker_dao(db_path: str, tables: dict) -> SnapshotDAO:
+    """Read-only connection of the current worker thread (or process), opened once and reused"""
+    cached = getattr(_worker, 'dao', None)
+    if cached is None or cached[0] != db_path:
+        reader = SnapshotReader(db_path)
+        cached = (db_path, SnapshotDAO(reader._connect(), tables))
+        _worker.dao = cached
+    return cached[1]
+
+
+def _read_part(db_path: str, tables: dict, kind: str, parent_id, limit_mb: float):
+    """
+    One unit of work in a pool worker; returns the part and the bytes of rows it read.
+    Every batch is checked against limit_mb (0 = unlimited), the worker's share of the budget.
+    """
+    dao = _worker_dao(db_path, tables)
+    budget = MemoryBudget(limit_mb)
+    dao.conn.execute('BEGIN')
+    try:
+        if kind == 'rates':
+            part = read_catalog_rates(dao, parent_id, budget)
+        else:
+            part = read_rate_analysis(dao, parent_id, budget)
+    finally:
+        dao.conn.rollback()
+    return part, budget.used
+
+
+class ParallelShareBuilder:
+    """
+    Reads the rates of every catalog and the rate_analysis rows (with summary) of every analysis of
+    a share in a bounded pool: SHARE_BUILD_POOL is 'serial' (default, no pool), 'thread' or 'process',
+    and SHARE_BUILD_WORKERS (default: the CPU count, at most 8) its size. Process workers run the
+    summaries on other cores but pay for sending the rows back; threads overlap the SQLite reads.
+    Serial is the default because only the serial read stays inside the share's snapshot. Workers
+    read outside it, each part in its own read transaction (SQLite cannot share a read snapshot
+    between connections), so their parts are only used when the session's fingerprint on a fresh
+    connection afterwards matches the snapshot's. That does not pin them to the snapshot: a change
+    reverted in between, or an edit inside a catalog rate (not part of the fingerprint), can go unnoticed.
+    Every worker may hold 1/workers of the share's memory budget, checked batch by batch; a part
+    that needs more makes the share be read serially, against the whole budget.
+    """
+
+    def __init__(self, reader, pool: str = None, workers: int = None):
+        self.reader = reader
+        self.pool = (pool or os.getenv('SHARE_BUILD_POOL', 'serial')).lower()
+        if self.pool not in POOL_TYPES:
+            print(f"[DEBUG] Unknown SHARE_BUILD_POOL '{self.pool}', building shares serially")
+            self.pool = 'serial'
+        self.workers = workers or int(os.getenv('SHARE_BUILD_WORKERS', str(min(8, os.cpu_count() or 1))))
+        self.parallel_builds = 0
+        self.fallbacks = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def usable(self, dao, analysis_count: int) -> bool:
+        return (self.pool != 'serial' and self.workers > 1 and analysis_count > 1
+                and self.reader is not None and isinstance(dao, SnapshotDAO))
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.pool == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='share-build')
+            return self._executor
+
+    def build(self, dao, session_id, analysis_ids: list, catalog_ids: list, budget: MemoryBudget, progress=None):
+        """
+        ({catalog_id: rates}, [(rate_analysis, summary) per analysis in order]), or None when the
+        caller has to read serially (pool not usable, or the session changed during the build).
+        Parts are charged to `budget` as they complete, in whatever order; PayloadMemoryExceeded
+        cancels the parts not started yet (running ones stop at their worker limit).
+        """
+        if not self.usable(dao, len(analysis_ids)):
+            return None
+        executor = self._get_executor()
+        db_path = self.reader.db_path
+        part_limit_mb = budget.limit_mb / self.workers if budget.limit else 0
+        distinct_catalogs = list(dict.fromkeys(catalog_ids))
+        futures = {}
+        for catalog_id in distinct_catalogs:
+            futures[executor.submit(_read_part, db_path, dao.tables, 'rates', catalog_id, part_limit_mb)] = \
+                ('rates', catalog_id)
+        for index, analysis_id in enumerate(analysis_ids):
+            futures[executor.submit(_read_part, db_path, dao.tables, 'rate_analysis', analysis_id, part_limit_mb)] = \
+                ('rate_analysis', index)
+        catalog_rates = {}
+        parts = [None] * len(analysis_ids)
+        done_analyses = 0
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        part, used = future.result()
+                    except PayloadMemoryExceeded:
+                        print(f"[DEBUG] A part of session {session_id} exceeds the worker memory limit "
+                              f"({part_limit_mb:g} MB), reading it serially")
+                        self.fallbacks += 1
+                        for other in pending:
+                            other.cancel()
+                        return None
+                    budget.charge(used)
+                    kind, target = futures[future]
+                    if kind == 'rates':
+                        catalog_rates[target] = part
+                    else:
+                        parts[target] = part
+                        done_analyses += 1
+                        if progress is not None:
+                            progress('analysis', done=done_analyses, total=len(analysis_ids), rates=part[0]["count"])
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+        fresh = SnapshotDAO(self.reader._connect(), dao.tables)
+        try:
+            unchanged = fresh.fingerprint_session(session_id) == dao.fingerprint_session(session_id)
+        finally:
+            fresh.close()
+        if not unchanged:
+            print(f"[DEBUG] Session {session_id} changed during the parallel share build, reading it again serially")
+            self.fallbacks += 1
+            return None
+        self.parallel_builds += 1
+        return catalog_rates, parts
+
+    def status(self) -> dict:
+        return {
+            "pool": self.pool,
+            "workers": self.workers,
+            "parallel_builds": self.parallel_builds,
+            "fallbacks": self.fallbacks
+        }
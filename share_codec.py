@@ -0,0 +1,295 @@
+import hashlib
+import os
+import re
+import sys
+
+from .fastjson import _payload_default, dumps, loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+# Tells the server that rates/rate_analysis are column arrays instead of lists of dicts
+COLUMNAR_LAYOUT_HEADER = 'X-Payload-Layout'
+# Same value for every upload of the same share, so the server can drop repeats
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+COLUMNAR_LISTS = ('rates', 'rate_analysis')
+
+# (payload key, DAO attribute) of the rate lists in a share payload
+RATE_FIELDS = (('id', 'id'), ('signature', 'signature'), ('description', 'description'))
+RATE_ANALYSIS_FIELDS = (
+    ('id', 'id'), ('signature', 'signature'), ('description', 'description'), ('catalog_id', 'catalog_id'),
+    ('analysis_id', 'analysis_id'), ('energetic_value', 'energetic_value'), ('gv', 'gv'), ('level', 'level'),
+    ('potencyType', 'potency_type'), ('potency', 'potency'), ('note', 'note')
+)
+
+# Rows per chunk when a columnar block is written back as JSON rows
+JSON_CHUNK_ROWS = 5000
+_BLOCK_MARKER = '@@aetherone-columnar-block-{}@@'
+_BLOCK_MARKER_RE = re.compile(rb'"@@aetherone-columnar-block-(\d+)@@"')
+
+
+class PayloadMemoryExceeded(Exception):
+    pass
+
+
+class MemoryBudget:
+    """
+    Approximate memory held by the rows of one share payload.
+    SHARE_MAX_MEMORY_MB (default 256, 0 = unlimited) is the ceiling per share.
+    """
+
+    def __init__(self, limit_mb: float = None):
+        self.limit_mb = float(os.getenv('SHARE_MAX_MEMORY_MB', '256')) if limit_mb is None else limit_mb
+        self.limit = int(self.limit_mb * 1024 * 1024)
+        self.used = 0
+
+    def charge(self, nbytes: int):
+        self.used += nbytes
+        if self.limit and self.used > self.limit:
+            raise PayloadMemoryExceeded(
+                f"Share payload is larger than the {self.limit_mb:g} MB allowed per share "
+                f"(SHARE_MAX_MEMORY_MB); share fewer or smaller analyses or raise the limit"
+            )
+
+
+def _batch_size(rows) -> int:
+    return sum(sys.getsizeof(value) + 8 for row in rows for value in row)
+
+
+def read_columnar(batches, fields, budget: MemoryBudget = None) -> dict:
+    """
+    Build a columnar block (see to_columnar) straight from batches of value tuples in `fields` order,
+    without a dict per row. Every batch is charged to `budget` before it is kept.
+    """
+    columns = list(fields)
+    values = {column: [] for column in columns}
+    count = 0
+    for rows in batches:
+        if not rows:
+            continue
+        if budget is not None:
+            budget.charge(_batch_size(rows))
+        for column, column_values in zip(columns, zip(*rows)):
+            values[column].extend(column_values)
+        count += len(rows)
+    return {"columns": columns, "values": values, "count": count}
+
+
+def add_constant_column(block: dict, column: str, value) -> dict:
+    """Add a column holding the same value in every row"""
+    block["columns"].append(column)
+    block["values"][column] = [value] * block["count"]
+    return block
+
+
+def to_columnar(rows: list) -> dict:
+    """
+    Turn a list of dicts into {"columns": [...], "values": {column: [...]}, "count": n}.
+    Every row is expected to carry the same keys, as the share builder produces them.
+    """
+    if not rows:
+        return {"columns": [], "values": {}, "count": 0}
+    columns = list(rows[0].keys())
+    return {
+        "columns": columns,
+        "values": {column: [row.get(column) for row in rows] for column in columns},
+        "count": len(rows)
+    }
+
+
+def from_columnar(block: dict) -> list:
+    """Inverse of to_columnar()"""
+    columns = block.get("columns", [])
+    values = block.get("values", {})
+    return [
+        {column: values[column][i] for column in columns}
+        for i in range(block.get("count", 0))
+    ]
+
+
+def columnarize_payload(payload: dict) -> dict:
+    """Return a copy of a share payload with every analysis' rate lists in columnar layout"""
+    session_data = payload["data"]["analyses"]
+    analyses = []
+    for analysis in session_data.get("analyses", []):
+        analysis = dict(analysis)
+        for name in COLUMNAR_LISTS:
+            if isinstance(analysis.get(name), list):
+                analysis[name] = to_columnar(analysis[name])
+        analyses.append(analysis)
+    return {
+        **payload,
+        "data": {**payload["data"], "analyses": {**session_data, "analyses": analyses}}
+    }
+
+
+def decolumnarize_payload(payload: dict) -> dict:
+    """Inverse of columnarize_payload(), for receivers (server, local stub) of the compact format"""
+    session_data = payload["data"]["analyses"]
+    analyses = []
+    for analysis in session_data.get("analyses", []):
+        analysis = dict(analysis)
+        for name in COLUMNAR_LISTS:
+            if isinstance(analysis.get(name), dict):
+                analysis[name] = from_columnar(analysis[name])
+        analyses.append(analysis)
+    return {
+        **payload,
+        "data": {**payload["data"], "analyses": {**session_data, "analyses": analyses}}
+    }
+
+
+def _rows_json(block: dict, chunk_rows: int = JSON_CHUNK_ROWS) -> bytes:
+    """JSON array of the rows of a columnar block, built chunk_rows dicts at a time"""
+    columns = block["columns"]
+    values = block["values"]
+    parts = []
+    for start in range(0, block["count"], chunk_rows):
+        stop = start + chunk_rows
+        chunk = [dict(zip(columns, row)) for row in zip(*(values[column][start:stop] for column in columns))]
+        parts.append(dumps(chunk)[1:-1])
+    return b'[' + b','.join(parts) + b']'
+
+
+def dumps_row_payload(payload: dict) -> bytes:
+    """
+    JSON of a share payload whose rate lists may be columnar blocks: the blocks are written
+    as the usual lists of row dicts, without building all rows at once.
+    """
+    session_data = payload["data"]["analyses"]
+    blocks = []
+    analyses = []
+    for analysis in session_data.get("analyses", []):
+        analysis = dict(analysis)
+        for name in COLUMNAR_LISTS:
+            if isinstance(analysis.get(name), dict):
+                blocks.append(analysis[name])
+                analysis[name] = _BLOCK_MARKER.format(len(blocks) - 1)
+        analyses.append(analysis)
+    if not blocks:
+        return dumps(payload)
+    skeleton = dumps({
+        **payload,
+        "data": {**payload["data"], "analyses": {**session_data, "analyses": analyses}}
+    })
+    parts = _BLOCK_MARKER_RE.split(skeleton)
+    # parts alternates JSON text and block numbers
+    return b''.join(
+        part if i % 2 == 0 else _rows_json(blocks[int(part)])
+        for i, part in enumerate(parts)
+    )
+
+
+def content_hash(payload: dict) -> str:
+    """
+    SHA-256 of the data of a share payload, independent of the wire format. Columnar blocks are
+    hashed one column at a time, without encoding the whole payload.
+    """
+    digest = hashlib.sha256()
+    session_data = payload["data"]["analyses"]
+    blocks = []
+    analyses = []
+    for analysis in session_data.get("analyses", []):
+        analysis = dict(analysis)
+        for name in COLUMNAR_LISTS:
+            block = analysis.get(name)
+            if isinstance(block, list):
+                block = to_columnar(block)
+            if isinstance(block, dict):
+                blocks.append(block)
+                analysis[name] = _BLOCK_MARKER.format(len(blocks) - 1)
+        analyses.append(analysis)
+    digest.update(dumps({**payload["data"], "analyses": {**session_data, "analyses": analyses}}))
+    for block in blocks:
+        digest.update(b'%d' % block["count"])
+        for column in block["columns"]:
+            digest.update(column.encode('utf-8'))
+            digest.update(dumps(block["values"][column]))
+    return digest.hexdigest()
+
+
+def idempotency_key(key: str, session_id, payload_hash: str) -> str:
+    """Idempotency key of a share: the analysis key, the session and the content hash"""
+    return hashlib.sha256(f"{key}\0{session_id}\0{payload_hash}".encode('utf-8')).hexdigest()[:32]
+
+
+def encode_share_payload(payload: dict, wire_format: str):
+    """
+    Encode a share payload for the wire.
+    Returns (body bytes, headers); wire_format is 'json' or 'msgpack'.
+    """
+    if wire_format == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        body = msgpack.packb(columnarize_payload(payload), use_bin_type=True, default=_payload_default)
+        return body, {"Content-Type": MSGPACK_CONTENT_TYPE, COLUMNAR_LAYOUT_HEADER: "columnar"}
+    return dumps_row_payload(payload), {"Content-Type": JSON_CONTENT_TYPE}
+
+
+def decode_share_payload(body: bytes, content_type: str) -> dict:
+    """Decode a body produced by encode_share_payload() back into the row-based payload"""
+    if content_type and content_type.startswith(MSGPACK_CONTENT_TYPE):
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        return decolumnarize_payload(msgpack.unpackb(body, raw=False))
+    return loads(body)
+
+
+# A msgpack share answered with one of these may simply not have been understood: retry as JSON
+MSGPACK_FALLBACK_STATUS = (400, 415, 422)
+# Response headers a server lists its accepted share content types in
+FORMAT_ADVERTISE_HEADERS = ('Accept-Post', 'X-Share-Formats')
+
+
+class ShareFormatNegotiator:
+    """
+    Picks the share wire format per server.
+    SHARE_WIRE_FORMAT=json|msgpack|auto (default auto). In auto mode shares go out as JSON until the
+    server advertises msgpack in an Accept-Post or X-Share-Formats response header. A msgpack share
+    answered with 400, 415 or 422 is sent again as JSON; a 415, or a JSON retry that goes through,
+    marks the server as json-only for the lifetime of the plugin. When the JSON retry fails as well
+    the error is the share's own and the format is kept.
+    """
+
+    def __init__(self, preference: str = None):
+        self.preference = (preference or os.getenv('SHARE_WIRE_FORMAT', 'auto')).lower()
+        self.msgpack_servers = set()
+        self.json_only = set()
+        self.fallbacks = {}
+
+    def observe(self, server_url: str, headers) -> None:
+        """Record the formats a server advertises in the headers of one of its responses"""
+        advertised = ','.join(headers.get(name) or '' for name in FORMAT_ADVERTISE_HEADERS)
+        if MSGPACK_CONTENT_TYPE in advertised.lower() and server_url not in self.json_only:
+            self.msgpack_servers.add(server_url)
+
+    def formats_for(self, server_url: str) -> list:
+        if self.preference == 'json' or msgpack is None:
+            return ['json']
+        if self.preference == 'msgpack':
+            return ['msgpack']
+        if server_url in self.msgpack_servers:
+            return ['msgpack', 'json']
+        return ['json']
+
+    def rejected(self, server_url: str, wire_format: str, status_code: int) -> bool:
+        """Record a response; returns True when the next format should be tried"""
+        if self.preference != 'auto':
+            return False
+        if wire_format == 'msgpack':
+            if status_code not in MSGPACK_FALLBACK_STATUS:
+                return False
+            print(f"[DEBUG] Server {server_url} rejected msgpack share payload ({status_code}), retrying as JSON")
+            self.fallbacks[server_url] = status_code
+            return True
+        msgpack_status = self.fallbacks.pop(server_url, None)
+        if msgpack_status == 415 or (msgpack_status is not None and status_code < 400):
+            print(f"[DEBUG] Server {server_url} does not read msgpack share payloads, using JSON from now on")
+            self.msgpack_servers.discard(server_url)
+            self.json_only.add(server_url)
+        return False
@@ -0,0 +1,294 @@
+"""
+Read-only access to aetherone.db for exports (share, bundles).
+
+Every export opens its own connection (`mode=ro`, `query_only`, memory mapped) and reads
+inside one read transaction, so it sees a consistent snapshot of the session even while the
+AetherOnePy analysis engine is writing rates. With aetherone.db in WAL mode readers and the
+writer never wait for each other; in rollback-journal mode a writer waits for the read to end.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+
+from .bundle import (ATTRIBUTE_ALIASES, FOREIGN_KEYS, TABLE_CANDIDATES, BundleError, _columns, _normalize,
+                     _resolve_table)
+
+# Columns the host DAO returns as datetime objects
+DATETIME_COLUMNS = ('created',)
+
+# rate_analysis fields the host app edits in place; the session fingerprint aggregates their values
+FINGERPRINT_NUMBERS = ('gv', 'energetic_value', 'level', 'potency')
+FINGERPRINT_TEXTS = ('note', 'potency_type')
+
+# Rows per fetchmany() when rate lists are iterated
+FETCH_BATCH_ROWS = int(os.getenv('SNAPSHOT_FETCH_ROWS', '2000'))
+
+# column name -> DAO attribute name
+COLUMN_ATTRIBUTES = {column: attribute for attribute, column in ATTRIBUTE_ALIASES.items()}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotRow:
+    """A row with attribute access like the host DAO objects (caseID, catalogId, potency_type, created as datetime)"""
+
+    def __init__(self, row: dict):
+        for column, value in row.items():
+            if column in DATETIME_COLUMNS and isinstance(value, str):
+                try:
+                    value = datetime.fromisoformat(value)
+                except ValueError:
+                    pass
+            setattr(self, COLUMN_ATTRIBUTES.get(column, column), value)
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: accept other spellings (caseID / case_id / caseId)
+        wanted = _normalize(name)
+        for attribute, value in vars(self).items():
+            if _normalize(attribute) == wanted:
+                return value
+        raise AttributeError(name)
+
+
+class SnapshotDAO:
+    """The read methods of the host case DAO used by exports, over one snapshot connection"""
+
+    def __init__(self, conn, tables: dict):
+        self.conn = conn
+        self.tables = tables
+
+    def _table(self, section: str):
+        table, _ = self.tables[section]
+        return table
+
+    def fields(self, section: str) -> list:
+        """DAO attribute names of all columns of a section's table, for iter_batches()"""
+        _, columns = self.tables[section]
+        return [COLUMN_ATTRIBUTES.get(column, column) for column in columns.values()]
+
+    def _foreign_column(self, section: str, parent: str):
+        _, columns = self.tables[section]
+        for names, referenced in FOREIGN_KEYS.get(section, []):
+            if referenced != parent:
+                continue
+            for name in names:
+                if name.lower() in columns:
+                    return columns[name.lower()]
+        raise SnapshotError(f"No {parent} column in table '{self._table(section)}'")
+
+    def _get(self, section: str, row_id):
+        row = self.conn.execute(f'SELECT * FROM "{self._table(section)}" WHERE id = ?', (row_id,)).fetchone()
+        return SnapshotRow(dict(row)) if row else None
+
+    def _children(self, section: str, parent: str, parent_id):
+        column = self._foreign_column(section, parent)
+        cursor = self.conn.execute(
+            f'SELECT * FROM "{self._table(section)}" WHERE "{column}" = ? ORDER BY id', (parent_id,)
+        )
+        return [SnapshotRow(dict(row)) for row in cursor]
+
+    def _column_sql(self, section: str, field: str):
+        """Quoted column of a DAO attribute (any spelling), None when the table has no such column"""
+        _, columns = self.tables[section]
+        for column in columns.values():
+            if _normalize(column) == _normalize(field):
+                return f'"{column}"'
+        return None
+
+    def iter_batches(self, section: str, parent: str, parent_id, fields, batch_size: int = None):
+        """
+        Rows of `section` under a parent as fetchmany() batches of rows holding the values of
+        `fields` (DAO attribute names, any spelling; fields without a column give None)
+        """
+        table, columns = self.tables[section]
+        by_name = {_normalize(column): column for column in columns.values()}
+        select = ', '.join(
+            f'"{by_name[_normalize(field)]}"' if _normalize(field) in by_name else 'NULL' for field in fields
+        )
+        column = self._foreign_column(section, parent)
+        cursor = self.conn.execute(f'SELECT {select} FROM "{table}" WHERE "{column}" = ? ORDER BY id', (parent_id,))
+        batch_size = batch_size or FETCH_BATCH_ROWS
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def iter_rates_from_catalog(self, catalog_id, fields, batch_size: int = None):
+        return self.iter_batches('rate', 'catalog', catalog_id, fields, batch_size)
+
+    def iter_rates_for_analysis(self, analysis_id, fields, batch_size: int = None):
+        return self.iter_batches('rate_analysis', 'analysis', analysis_id, fields, batch_size)
+
+    def fingerprint_session(self, session_id):
+        """
+        Cheap fingerprint of what a share of the session contains: the session, case, analysis and
+        catalog rows, count and highest id of the rate / rate_analysis rows under them, and aggregates
+        of the rate_analysis values the host app edits in place (sums of gv, energetic value, level and
+        potency, plain and weighted by id, and the concatenated notes). The catalog rate rows
+        themselves are not read. None when the session does not exist.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        session = self.conn.execute(f'SELECT * FROM "{self._table("session")}" WHERE id = ?', (session_id,)).fetchone()
+        if session is None:
+            return None
+        digest.update(repr(tuple(session)).encode('utf-8'))
+        case = self.conn.execute(
+            f'SELECT * FROM "{self._table("case")}" WHERE id = ?', (session[self._foreign_column("session", "case")],)
+        ).fetchone()
+        digest.update(repr(tuple(case) if case else None).encode('utf-8'))
+
+        analysis_table = self._table('analysis')
+        session_column = self._foreign_column('analysis', 'session')
+        catalog_column = self._foreign_column('analysis', 'catalog')
+        rate_analysis_column = self._foreign_column('rate_analysis', 'analysis')
+        rate_column = self._foreign_column('rate', 'catalog')
+        analysis_ids = f'SELECT id FROM "{analysis_table}" WHERE "{session_column}" = ?'
+        content = []
+        for field in FINGERPRINT_NUMBERS:
+            column = self._column_sql('rate_analysis', field)
+            if column:
+                content += [f'TOTAL({column})', f'TOTAL(id * {column})']
+        for field in FINGERPRINT_TEXTS:
+            column = self._column_sql('rate_analysis', field)
+            if column:
+                content.append(f"group_concat(COALESCE({column}, ''), char(31))")
+        content_sql = ''.join(f', {c}' for c in content)
+        catalog_ids = f'SELECT "{catalog_column}" FROM "{analysis_table}" WHERE "{session_column}" = ?'
+        for query in (
+            f'SELECT * FROM "{analysis_table}" WHERE "{session_column}" = ? ORDER BY id',
+            f'SELECT * FROM "{self._table("catalog")}" WHERE id IN ({catalog_ids}) ORDER BY id',
+            f'SELECT "{rate_analysis_column}", COUNT(*), MAX(id){content_sql} FROM "{self._table("rate_analysis")}" '
+            f'WHERE "{rate_analysis_column}" IN ({analysis_ids}) GROUP BY 1 ORDER BY 1',
+            f'SELECT "{rate_column}", COUNT(*), MAX(id) FROM "{self._table("rate")}" '
+            f'WHERE "{rate_column}" IN ({catalog_ids}) GROUP BY 1 ORDER BY 1',
+        ):
+            for row in self.conn.execute(query, (session_id,)):
+                digest.update(repr(tuple(row)).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get_case(self, case_id):
+        return self._get('case', case_id)
+
+    def get_session(self, session_id):
+        return self._get('session', session_id)
+
+    def get_catalog(self, catalog_id):
+        return self._get('catalog', catalog_id)
+
+    def list_analysis(self, session_id):
+        return self._children('analysis', 'session', session_id)
+
+    def list_rates_from_catalog(self, catalog_id):
+        return self._children('rate', 'catalog', catalog_id)
+
+    def list_rates_for_analysis(self, analysis_id):
+        return self._children('rate_analysis', 'analysis', analysis_id)
+
+    def close(self):
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        self.conn.close()
+
+
+def iter_dao_batches(dao, name: str, parent_id, fields, batch_size: int = None):
+    """
+    Batches of value tuples of `fields` for dao.list_<name>(parent_id): fetchmany() on a SnapshotDAO,
+    the materialized list of the host DAO in slices otherwise
+    """
+    iterate = getattr(dao, f'iter_{name}', None)
+    if iterate is not None:
+        yield from iterate(parent_id, fields, batch_size)
+        return
+    rows = getattr(dao, f'list_{name}')(parent_id) or []
+    batch_size = batch_size or FETCH_BATCH_ROWS
+    for start in range(0, len(rows), batch_size):
+        yield [tuple(getattr(row, field, None) for field in fields) for row in rows[start:start + batch_size]]
+
+
+def session_fingerprint(dao, session_id):
+    """SnapshotDAO.fingerprint_session(), None for a DAO without one (the host DAO)"""
+    fingerprint = getattr(dao, 'fingerprint_session', None)
+    return fingerprint(session_id) if fingerprint is not None else None
+
+
+class SnapshotReader:
+    """Opens read-only snapshot connections to aetherone.db; table names are resolved once"""
+
+    def __init__(self, db_path: str, mmap_size: int = None, timeout: float = None):
+        self.db_path = os.path.abspath(db_path)
+        self.mmap_size = mmap_size or int(os.getenv('SNAPSHOT_MMAP_SIZE', str(256 * 1024 * 1024)))
+        self.timeout = timeout or float(os.getenv('SNAPSHOT_BUSY_TIMEOUT', '5'))
+        self._tables = None
+        self._lock = threading.Lock()
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+
+    def _connect(self):
+        if not os.path.exists(self.db_path):
+            raise SnapshotError(f"{self.db_path} does not exist")
+        conn = sqlite3.connect(f"file:{quote(self.db_path)}?mode=ro", uri=True, timeout=self.timeout,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        return conn
+
+    def _resolve_tables(self, conn) -> dict:
+        with self._lock:
+            if self._tables is None:
+                try:
+                    tables = {}
+                    for section in TABLE_CANDIDATES:
+                        table = _resolve_table(conn, section)
+                        tables[section] = (table, _columns(conn, table))
+                except BundleError as e:
+                    raise SnapshotError(str(e))
+                self._tables = tables
+            return self._tables
+
+    def data_version(self) -> int:
+        """PRAGMA data_version of a long-lived connection: changes whenever the host app commits to aetherone.db"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = self._connect()
+            return self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def open(self) -> SnapshotDAO:
+        """Connection with an open read transaction; close() it when the export is done"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN')
+            # The snapshot starts with the first read
+            tables = self._resolve_tables(conn)
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+        except Exception:
+            conn.close()
+            raise
+        return SnapshotDAO(conn, tables)
+
+    @contextmanager
+    def snapshot(self, fallback=None):
+        """
+        Yields a SnapshotDAO for one export. When the database cannot be opened read-only
+        (or its tables are not recognised) `fallback` (the shared DAO) is yielded instead, if given.
+        """
+        try:
+            dao = self.open()
+        except (sqlite3.Error, SnapshotError) as e:
+            if fallback is None:
+                raise
+            print(f"[DEBUG] Read-only snapshot of {self.db_path} unavailable, using the shared DAO: {e}")
+            yield fallback
+            return
+        try:
+            yield dao
+        finally:
+            dao.close()
@@ -0,0 +1,73 @@
+"""
+Makes the plugin modules importable as `social_plugin.<module>` without the host app.
+The real package __init__ registers the blueprint and needs `services` from AetherOnePy,
+so a bare package pointing at the plugin directory stands in for it.
+The `aetherone_db` fixture is a small aetherone.db of the host app for the export modules.
+"""
+import os
+import sqlite3
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+if 'social_plugin' not in sys.modules:
+    package = types.ModuleType('social_plugin')
+    package.__path__ = [ROOT]
+    sys.modules['social_plugin'] = package
+
+
+# The tables of the host app's aetherone.db that exports read
+AETHERONE_SCHEMA = '''
+    CREATE TABLE cases (id INTEGER PRIMARY KEY, name TEXT, description TEXT, created TEXT);
+    CREATE TABLE sessions (id INTEGER PRIMARY KEY, caseID INTEGER, intention TEXT, description TEXT, created TEXT);
+    CREATE TABLE catalog (id INTEGER PRIMARY KEY, name TEXT, description TEXT);
+    CREATE TABLE rates (id INTEGER PRIMARY KEY, catalogID INTEGER, signature TEXT, description TEXT);
+    CREATE TABLE analysis (id INTEGER PRIMARY KEY, sessionID INTEGER, catalogId INTEGER, target_gv INTEGER,
+                           note TEXT, created TEXT);
+    CREATE TABLE rate_analysis (id INTEGER PRIMARY KEY, analysis_id INTEGER, catalog_id INTEGER, signature TEXT,
+                                description TEXT, energetic_value INTEGER, gv INTEGER, level INTEGER,
+                                potencyType TEXT, potency INTEGER, note TEXT);
+'''
+
+
+def fill_aetherone_db(path, analyses=3, rates=20):
+    """Case 1 with session 1: `analyses` analyses over catalogs 1 and 2, `rates` rates each"""
+    conn = sqlite3.connect(str(path))
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.executescript(AETHERONE_SCHEMA)
+    conn.execute("INSERT INTO cases VALUES (1, 'case', 'a case', '2024-01-01T10:00:00')")
+    conn.execute("INSERT INTO sessions VALUES (1, 1, 'intention', 'first session', '2024-01-01T10:00:00')")
+    for catalog_id in (1, 2):
+        conn.execute('INSERT INTO catalog VALUES (?, ?, ?)', (catalog_id, f'catalog {catalog_id}', None))
+        conn.executemany('INSERT INTO rates (catalogID, signature, description) VALUES (?, ?, ?)',
+                         [(catalog_id, f'rate {catalog_id}.{i}', None) for i in range(rates)])
+    for analysis_id in range(1, analyses + 1):
+        catalog_id = 1 + analysis_id % 2
+        conn.execute("INSERT INTO analysis VALUES (?, 1, ?, 500, ?, '2024-01-01T10:00:00')",
+                     (analysis_id, catalog_id, f'analysis {analysis_id}'))
+        conn.executemany('''
+            INSERT INTO rate_analysis (analysis_id, catalog_id, signature, description, energetic_value, gv,
+                                       level, potencyType, potency, note)
+            VALUES (?, ?, ?, NULL, ?, ?, ?, 'D', 12, '')
+        ''', [(analysis_id, catalog_id, f'rate {catalog_id}.{i}', (i * 37) % 1000, (i * 53) % 2000, i % 10)
+              for i in range(rates)])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def make_aetherone_db(tmp_path):
+    """make(name) -> path of a new filled aetherone.db in tmp_path"""
+    def make(name='aetherone.db', **kwargs):
+        path = tmp_path / name
+        fill_aetherone_db(path, **kwargs)
+        return path
+    return make
+
+
+@pytest.fixture
+def aetherone_db(make_aetherone_db):
+    return make_aetherone_db()
@@ -0,0 +1,60 @@
+"""
+Analysis summaries: the pure-Python fallback gives the same summary as NumPy.
+"""
+import random
+
+import pytest
+
+from social_plugin import analysis_summary
+from social_plugin.share_codec import to_columnar
+
+
+def rows(n, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'id': i,
+        'signature': f'rate {i}',
+        'description': None,
+        'energetic_value': rng.choice([None, rng.randint(0, 1000)]),
+        'gv': rng.choice([None, 'n/a', rng.uniform(0, 2000)]),
+        'level': rng.choice([None, 1, 2, 3]),
+        'potencyType': rng.choice(['D', 'C', None]),
+        'potency': 12,
+    } for i in range(n)]
+
+
+def summarize_without_numpy(monkeypatch, rate_analysis, **kwargs):
+    with monkeypatch.context() as patch:
+        patch.setattr(analysis_summary, 'np', None)
+        return analysis_summary.summarize_rate_analysis(rate_analysis, **kwargs)
+
+
+@pytest.mark.parametrize('n', [0, 1, 7, 500])
+def test_fallback_matches_numpy(monkeypatch, n):
+    if analysis_summary.np is None:
+        pytest.skip('numpy is not installed')
+    data = rows(n)
+    expected = analysis_summary.summarize_rate_analysis(data, top_n=5, gv_bins=4)
+    summary = summarize_without_numpy(monkeypatch, data, top_n=5, gv_bins=4)
+
+    # Sums of floats may differ in the last digit
+    for field in ('energetic_value', 'gv'):
+        assert summary.pop(field) == pytest.approx(expected.pop(field))
+    histogram, expected_histogram = summary.pop('gv_histogram'), expected.pop('gv_histogram')
+    assert histogram['counts'] == expected_histogram['counts']
+    assert histogram['edges'] == pytest.approx(expected_histogram['edges'])
+    # Ties may come in any order
+    top = [row['energetic_value'] for row in summary.pop('top')]
+    assert top == [row['energetic_value'] for row in expected.pop('top')]
+    assert summary == expected
+
+
+def test_fallback_reads_columnar_blocks(monkeypatch):
+    data = [{'energetic_value': v, 'gv': 5, 'level': 1, 'potencyType': 'D'} for v in (3, None, 9, 1)]
+    summary = summarize_without_numpy(monkeypatch, to_columnar(data), top_n=2, gv_bins=3)
+
+    assert [row['energetic_value'] for row in summary['top']] == [9, 3]
+    assert summary['energetic_value'] == {'count': 3, 'min': 1.0, 'max': 9.0, 'mean': pytest.approx(13 / 3)}
+    # One distinct value: numpy widens the range by 0.5 on each side
+    assert summary['gv_histogram'] == {'edges': pytest.approx([4.5, 4.5 + 1 / 3, 4.5 + 2 / 3, 5.5]), 'counts': [0, 4, 0]}
+    assert summary['level_counts'] == {'1': 4}
@@ -0,0 +1,175 @@
+"""
+Session bundles: export/import round trips and damaged or inconsistent bundle files.
+"""
+import sqlite3
+import struct
+import zlib
+
+import pytest
+
+from social_plugin.bundle import (FOOTER, MAGIC, BundleError, BundleReader, import_bundle, iter_bundle,
+                                  session_sections)
+from social_plugin.fastjson import dumps
+from social_plugin.snapshot import SnapshotReader
+
+# The same tables with other column spellings, as older host versions created them
+OTHER_SPELLINGS = '''
+    CREATE TABLE cases (id INTEGER PRIMARY KEY, name TEXT, description TEXT, created TEXT);
+    CREATE TABLE sessions (id INTEGER PRIMARY KEY, case_id INTEGER, intention TEXT, description TEXT, created TEXT);
+    CREATE TABLE catalog (id INTEGER PRIMARY KEY, name TEXT, description TEXT);
+    CREATE TABLE rates (id INTEGER PRIMARY KEY, catalog_id INTEGER, signature TEXT, description TEXT);
+    CREATE TABLE analysis (id INTEGER PRIMARY KEY, session_id INTEGER, catalog_id INTEGER, target_gv INTEGER,
+                           note TEXT, created TEXT);
+    CREATE TABLE rate_analysis (id INTEGER PRIMARY KEY, analysisID INTEGER, catalogID INTEGER, signature TEXT,
+                                description TEXT, energetic_value INTEGER, gv INTEGER, level INTEGER,
+                                potency_type TEXT, potency INTEGER, note TEXT);
+'''
+
+
+def write_bundle(path, sections):
+    with open(path, 'wb') as f:
+        for chunk in iter_bundle(sections, meta={"session_id": 1}, frame_rows=7):
+            f.write(chunk)
+    return path
+
+
+def write_raw_bundle(path, frames_data: bytes, index: dict):
+    """A bundle file with hand-made frames and index"""
+    data = zlib.compress(dumps(index))
+    with open(path, 'wb') as f:
+        f.write(MAGIC + frames_data + data + FOOTER.pack(len(MAGIC) + len(frames_data), len(data), MAGIC))
+    return path
+
+
+@pytest.fixture
+def bundle_file(aetherone_db, tmp_path):
+    dao = SnapshotReader(str(aetherone_db)).open()
+    try:
+        return write_bundle(tmp_path / 'session.aosb', session_sections(dao, 1))
+    finally:
+        dao.close()
+
+
+def query(path, sql, *params):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def test_round_trip_into_a_database_with_other_spellings(bundle_file, tmp_path):
+    target = tmp_path / 'target.db'
+    conn = sqlite3.connect(str(target))
+    conn.executescript(OTHER_SPELLINGS)
+    conn.close()
+
+    result = import_bundle(str(bundle_file), str(target))
+
+    assert result['counts'] == {'case': 1, 'session': 1, 'catalog': 2, 'rate': 40, 'analysis': 3,
+                                'rate_analysis': 60}
+    assert result['source_session_id'] == 1
+    assert query(target, 'SELECT case_id, intention FROM sessions') == [(1, 'intention')]
+    assert query(target, 'SELECT id, session_id, catalog_id FROM analysis ORDER BY id') == [(1, 1, 2), (2, 1, 1), (3, 1, 2)]
+    # Columns spelled differently are still filled
+    assert query(target, 'SELECT COUNT(*) FROM rate_analysis WHERE potency_type = ? AND catalogID IS NOT NULL', 'D') == [(60,)]
+    assert query(target, 'SELECT COUNT(*) FROM rates WHERE catalog_id IS NULL') == [(0,)]
+
+
+def test_round_trip_remaps_ids_and_reuses_catalogs(bundle_file, make_aetherone_db):
+    target = make_aetherone_db('target.db')
+
+    result = import_bundle(str(bundle_file), str(target))
+
+    assert result['session_id'] == 2
+    # Both catalogs exist by name: reused with their rates
+    assert result['counts']['catalog'] == 0 and result['counts']['rate'] == 0
+    analyses = query(target, 'SELECT id, catalogId FROM analysis WHERE sessionID = 2 ORDER BY id')
+    assert analyses == [(4, 2), (5, 1), (6, 2)]
+    assert query(target, '''
+        SELECT analysis_id, COUNT(*), SUM(gv) FROM rate_analysis WHERE analysis_id > 3 GROUP BY 1
+    ''') == [(i, 20, sum((n * 53) % 2000 for n in range(20))) for i in (4, 5, 6)]
+
+
+def test_snapshot_export_reads_rates_in_batches(aetherone_db):
+    dao = SnapshotReader(str(aetherone_db)).open()
+    try:
+        sections = dict()
+        for section, rows in session_sections(dao, 1):
+            assert section in ('case', 'session', 'catalog', 'analysis') or not isinstance(rows, list)
+            sections.setdefault(section, []).extend(rows)
+    finally:
+        dao.close()
+    assert len(sections['rate_analysis']) == 60
+    assert sections['rate_analysis'][0]['potency_type'] == 'D'
+
+
+def test_missing_parent_is_an_error(tmp_path, make_aetherone_db):
+    path = write_bundle(tmp_path / 'orphan.aosb', [('case', [{'id': 1, 'name': 'c'}]),
+                                                  ('session', [{'id': 1, 'caseID': 99}])])
+    target = make_aetherone_db('target.db')
+    with pytest.raises(BundleError, match='case 99'):
+        import_bundle(str(path), str(target))
+    assert query(target, 'SELECT COUNT(*) FROM cases') == [(1,)]
+
+
+def test_missing_catalog_is_dropped(tmp_path, make_aetherone_db):
+    path = write_bundle(tmp_path / 'nocatalog.aosb', [
+        ('case', [{'id': 1}]), ('session', [{'id': 1, 'caseID': 1}]),
+        ('analysis', [{'id': 1, 'sessionID': 1, 'catalogId': 42}]),
+    ])
+    target = make_aetherone_db('target.db')
+    import_bundle(str(path), str(target))
+    assert query(target, 'SELECT catalogId FROM analysis WHERE sessionID = 2') == [(None,)]
+
+
+def corrupt(path, offset, data):
+    raw = bytearray(path.read_bytes())
+    raw[offset:offset + len(data)] = data
+    path.write_bytes(bytes(raw))
+
+
+@pytest.mark.parametrize('damage', ['empty', 'magic', 'truncated', 'footer', 'frame', 'index'])
+def test_damaged_bundles_are_bundle_errors(bundle_file, make_aetherone_db, damage):
+    size = bundle_file.stat().st_size
+    if damage == 'empty':
+        bundle_file.write_bytes(b'')
+    elif damage == 'magic':
+        corrupt(bundle_file, 0, b'XXXX')
+    elif damage == 'truncated':
+        bundle_file.write_bytes(bundle_file.read_bytes()[:size // 2])
+    elif damage == 'footer':
+        corrupt(bundle_file, size - FOOTER.size, struct.pack('<Q', size * 2))
+    elif damage == 'frame':
+        corrupt(bundle_file, len(MAGIC) + 10, b'\xff' * 8)
+    else:
+        index_offset = struct.unpack_from('<Q', bundle_file.read_bytes(), size - FOOTER.size)[0]
+        corrupt(bundle_file, index_offset + 4, b'\x00' * 8)
+    target = make_aetherone_db('target.db')
+
+    with pytest.raises(BundleError):
+        import_bundle(str(bundle_file), str(target))
+    assert query(target, 'SELECT COUNT(*) FROM sessions') == [(1,)]
+
+
+@pytest.mark.parametrize('frame', [
+    {"section": "case", "offset": 10 ** 9, "length": 5, "rows": 1},
+    {"section": "case", "offset": 0, "length": 5, "rows": 1},
+    {"section": "case", "offset": 8, "length": -1, "rows": 1},
+    {"section": "case", "offset": "8", "length": 5, "rows": 1},
+    {"offset": 8, "length": 5},
+])
+def test_index_entries_outside_the_data_are_rejected(tmp_path, frame):
+    path = write_raw_bundle(tmp_path / 'bad.aosb', zlib.compress(b'[{"id": 1}]'),
+                            {"version": 1, "meta": {}, "frames": [frame]})
+    with pytest.raises(BundleError):
+        BundleReader(str(path))
+
+
+def test_frame_without_rows_is_rejected(tmp_path):
+    data = zlib.compress(b'{"id": 1}')
+    path = write_raw_bundle(tmp_path / 'bad.aosb', data, {"version": 1, "meta": {}, "frames": [
+        {"section": "case", "offset": len(MAGIC), "length": len(data), "rows": 1}]})
+    with BundleReader(str(path)) as reader:
+        with pytest.raises(BundleError):
+            list(reader.rows('case'))
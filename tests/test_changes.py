@@ -0,0 +1,95 @@
+"""
+ChangeTracker: which sessions and analyses a commit of the host app changed.
+
+    python -m pytest tests
+"""
+import sqlite3
+
+import pytest
+
+from social_plugin.changes import ChangeTracker
+from social_plugin.snapshot import SnapshotReader
+
+
+@pytest.fixture
+def host(aetherone_db):
+    """Connection of the host app to aetherone.db"""
+    conn = sqlite3.connect(str(aetherone_db))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def tracker(aetherone_db):
+    tracker = ChangeTracker(SnapshotReader(str(aetherone_db)), enabled=False)
+    assert tracker.poll() is None
+    yield tracker
+    tracker._close()
+
+
+def commit(host, *statements):
+    for statement in statements:
+        host.execute(*statement)
+    host.commit()
+
+
+def test_idle_database_is_not_scanned(tracker):
+    assert tracker.poll() is None
+    assert tracker.polls == 2
+    assert tracker.scans == 1
+
+
+def test_new_session_and_analysis(tracker, host):
+    commit(host,
+           ("INSERT INTO sessions VALUES (2, 1, 'second', NULL, '2024-01-02')",),
+           ("INSERT INTO analysis VALUES (10, 2, 1, 500, NULL, '2024-01-02')",))
+    changes = tracker.poll()
+    assert changes.as_dict() == {"sessions": [2], "analyses": [10], "all": False}
+    assert changes.affects_session('2')
+    assert not changes.affects_session(1)
+
+
+def test_new_rate_analysis_rows_name_their_analysis(tracker, host):
+    commit(host, ("INSERT INTO rate_analysis (analysis_id, catalog_id, signature) VALUES (2, 1, 'new')",))
+    assert tracker.poll().as_dict() == {"sessions": [1], "analyses": [2], "all": False}
+
+
+def test_new_rates_name_every_analysis_on_the_catalog(tracker, host):
+    commit(host, ("INSERT INTO rates (catalogID, signature) VALUES (2, 'new')",))
+    # Analyses 1 and 3 are on catalog 2
+    assert tracker.poll().as_dict() == {"sessions": [1], "analyses": [1, 3], "all": False}
+
+
+def test_new_case_alone_changes_no_session(tracker, host):
+    commit(host, ("INSERT INTO cases VALUES (2, 'other', NULL, '2024-01-02')",))
+    assert tracker.poll() is None
+    assert tracker.scans == 2
+
+
+@pytest.mark.parametrize('statement', [
+    'DELETE FROM sessions WHERE id = 1',
+    'DELETE FROM analysis WHERE id = 1',
+    'DELETE FROM rate_analysis WHERE id = (SELECT MAX(id) FROM rate_analysis)',
+])
+def test_deleted_rows_invalidate_everything(tracker, host, statement):
+    commit(host, (statement,))
+    changes = tracker.poll()
+    assert changes.everything
+    assert changes.affects_session(99)
+
+
+def test_delete_hidden_by_an_insert_is_seen(tracker, host):
+    # Same highest id afterwards would hide it, the row count does not
+    commit(host,
+           ("DELETE FROM analysis WHERE id = 1",),
+           ("INSERT INTO analysis VALUES (4, 1, 1, 500, NULL, '2024-01-02')",),
+           ("INSERT INTO analysis VALUES (5, 1, 1, 500, NULL, '2024-01-02')",))
+    assert tracker.poll().everything
+
+
+def test_listeners_get_the_changes(tracker, host):
+    received = []
+    tracker._listeners.append(received.append)
+    commit(host, ("INSERT INTO analysis VALUES (10, 1, 1, 500, NULL, '2024-01-02')",))
+    tracker.poll()
+    assert [changes.as_dict() for changes in received] == [{"sessions": [1], "analyses": [10], "all": False}]
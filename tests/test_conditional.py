@@ -0,0 +1,89 @@
+"""
+ETag / 304 handling of the local JSON endpoints, and the table versions their ETags are built from.
+"""
+import sqlite3
+
+import pytest
+from flask import Flask, jsonify
+
+from social_plugin.conditional import conditional_response, make_etag
+from social_plugin.database import SocialDatabase
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.builds = 0
+    app.state = {"version": 1, "status": 200}
+
+    @app.route('/items')
+    def items():
+        def build():
+            app.builds += 1
+            return jsonify({"version": app.state["version"]}), app.state["status"]
+        return conditional_response(make_etag('items', app.state["version"]), build)
+
+    return app
+
+
+def test_make_etag():
+    assert make_etag('keys', 1, None) == make_etag('keys', 1, None)
+    assert make_etag('keys', 1) != make_etag('keys', 2)
+    # Parts are separated, so shifting a boundary changes the tag
+    assert make_etag('ab', 'c') != make_etag('a', 'bc')
+    assert make_etag(b'body') != make_etag(b'other body')
+
+
+def test_matching_etag_gets_304_without_building(app):
+    client = app.test_client()
+    response = client.get('/items')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert app.builds == 1
+
+    # Weak validators from a proxy match too
+    assert client.get('/items', headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+
+
+def test_changed_state_gets_a_new_body(app):
+    client = app.test_client()
+    etag = client.get('/items').headers['ETag']
+    app.state["version"] = 2
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json() == {"version": 2}
+    assert response.headers['ETag'] != etag
+
+
+def test_errors_are_not_tagged(app):
+    app.state["status"] = 502
+    response = app.test_client().get('/items')
+    assert response.status_code == 502
+    assert 'ETag' not in response.headers
+
+
+def test_table_version_moves_on_writes(tmp_path):
+    path = tmp_path / 'social.db'
+    db = SocialDatabase(str(path))
+    try:
+        servers = db.table_version('servers')
+        users = db.table_version('users')
+        db.upsert_user_token('user', 'user@example.com', 'token', 1)
+        assert db.table_version('servers') == servers
+        assert db.table_version('users') != users
+
+        # A commit through another connection moves data_version
+        users = db.table_version('users')
+        conn = sqlite3.connect(str(path))
+        conn.execute("UPDATE users SET token = 'other'")
+        conn.commit()
+        conn.close()
+        assert db.table_version('users') != users
+    finally:
+        db.close()
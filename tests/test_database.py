@@ -0,0 +1,249 @@
+"""
+SocialDatabase: unit-of-work isolation between threads and schema upgrades.
+
+    python -m pytest tests
+"""
+import importlib.util
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+# Load database.py on its own, importing the plugin package would need the host app
+_spec = importlib.util.spec_from_file_location(
+    'social_database', os.path.join(os.path.dirname(__file__), '..', 'database.py')
+)
+database = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(database)
+
+
+def open_db(path):
+    db = database.SocialDatabase(str(path))
+    if db.migration_thread is not None:
+        db.migration_thread.join(10)
+    return db
+
+
+def key_exists(path, key) -> bool:
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute('SELECT 1 FROM analysis_keys WHERE key = ?', (key,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def schema_objects(path) -> set:
+    conn = sqlite3.connect(str(path))
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    finally:
+        conn.close()
+
+
+def build_schema(path, version: int):
+    """A database as an older plugin left it: migrations up to `version` and one analysis key"""
+    conn = sqlite3.connect(str(path))
+    cursor = conn.cursor()
+    for target, migration, _ in database.MIGRATIONS:
+        if target <= max(version, 1):
+            migration(cursor)
+    cursor.execute('''
+        INSERT INTO analysis_keys (key_id, key, session_id, user_id, metadata) VALUES (1, 'old-key', 7, 1, 'legacy')
+    ''')
+    cursor.execute(f'PRAGMA user_version = {int(version)}')
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = open_db(tmp_path / 'social.db')
+    yield db
+    db.close()
+
+
+def test_rolled_back_transaction_keeps_other_threads_writes(db, tmp_path):
+    other_done = threading.Event()
+
+    def other_thread():
+        db.create_analysis_key(2, 'other', 2, 1)
+        other_done.set()
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.create_analysis_key(1, 'mine', 1, 1)
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+            # The other thread's write waits for this unit of work instead of joining it
+            time.sleep(0.2)
+            assert not other_done.is_set()
+            raise RuntimeError('abort')
+    thread.join(5)
+
+    assert other_done.is_set()
+    assert not key_exists(tmp_path / 'social.db', 'mine')
+    assert key_exists(tmp_path / 'social.db', 'other')
+
+
+def test_rolled_back_transaction_publishes_nothing(db):
+    events = []
+    db.add_listener(lambda event, data: events.append(event))
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.create_analysis_key(1, 'mine', 1, 1)
+            db.update_analysis_key_status('mine', 'used')
+            raise RuntimeError('abort')
+    assert events == []
+
+    db.create_analysis_key(2, 'kept', 1, 1)
+    assert events == ['key.created']
+
+
+def test_direct_status_update_drops_queued_change(db):
+    db.coalesce_delay = 60
+    db.create_analysis_key(1, 'k', 1, 1)
+    db.queue_analysis_key_status('k', 'queued')
+    db.update_analysis_key_status('k', 'used')
+    db.flush_analysis_key_status()
+    assert db.get_analysis_key('k')['status'] == 'used'
+
+
+def test_rollback_restores_queued_status_changes(db):
+    db.coalesce_delay = 60
+    db.create_analysis_key(1, 'flushed', 1, 1)
+    db.create_analysis_key(2, 'overwritten', 1, 1)
+    db.queue_analysis_key_status('flushed', 'queued')
+    db.queue_analysis_key_status('overwritten', 'queued')
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            # Both take the queued changes out of the queue, then the block fails
+            db.flush_analysis_key_status()
+            db.update_analysis_key_status('overwritten', 'used')
+            db.queue_analysis_key_status('new', 'queued')
+            raise RuntimeError('abort')
+
+    assert db._pending_status == {'flushed': 'queued', 'overwritten': 'queued'}
+    assert db.flush_analysis_key_status() == 2
+    assert db.get_analysis_key('flushed')['status'] == 'queued'
+    assert db.get_analysis_key('overwritten')['status'] == 'queued'
+
+
+def test_reads_do_not_see_other_threads_uncommitted_writes(db):
+    written = threading.Event()
+    seen = []
+
+    def reader():
+        written.wait(5)
+        seen.append(db.get_analysis_key('mine'))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.create_analysis_key(1, 'mine', 1, 1)
+            written.set()
+            time.sleep(0.2)
+            # The read waits for this unit of work instead of seeing its row
+            assert seen == []
+            raise RuntimeError('abort')
+    thread.join(5)
+    assert seen == [None]
+
+
+@pytest.mark.parametrize('version', [0, 2])
+def test_upgrade_applies_every_migration(tmp_path, version):
+    path = tmp_path / 'social.db'
+    build_schema(path, version)
+
+    db = open_db(path)
+    try:
+        assert database.schema_version(db.conn) == database.SCHEMA_VERSION
+        objects = schema_objects(path)
+        assert {'share_log', 'search_documents', 'idx_analysis_keys_user_session',
+                'idx_analysis_keys_analysis'} <= objects
+        assert database.deferred_migrations(db.conn) == []
+        # Rows of the old install survive and are indexed for search
+        assert db.get_analysis_key('old-key')['metadata'] == 'legacy'
+        assert [r['key'] for r in db.search('legacy')] == ['old-key']
+    finally:
+        db.close()
+
+
+def test_interrupted_online_migration_runs_on_next_start(tmp_path):
+    path = tmp_path / 'social.db'
+    build_schema(path, database.SCHEMA_VERSION)
+    conn = sqlite3.connect(str(path))
+    conn.execute('DROP INDEX idx_analysis_keys_analysis')
+    conn.execute('CREATE TABLE schema_deferred_migrations (version INTEGER PRIMARY KEY)')
+    conn.execute('INSERT INTO schema_deferred_migrations (version) VALUES (3)')
+    conn.commit()
+    conn.close()
+
+    db = open_db(path)
+    try:
+        assert 'idx_analysis_keys_analysis' in schema_objects(path)
+        assert database.deferred_migrations(db.conn) == []
+    finally:
+        db.close()
+
+
+def test_new_database_runs_online_migrations_inline(tmp_path):
+    path = tmp_path / 'social.db'
+    db = database.SocialDatabase(str(path))
+    try:
+        assert db.migration_thread is None
+        objects = schema_objects(path)
+        assert 'idx_analysis_keys_analysis' in objects
+        assert 'schema_deferred_migrations' not in objects
+    finally:
+        db.close()
+
+
+def test_writes_wait_for_online_index_builds(tmp_path, monkeypatch):
+    path = tmp_path / 'social.db'
+    build_schema(path, 2)
+    building = threading.Event()
+
+    def slow_step(sql):
+        def step(cursor):
+            cursor.execute(sql)
+            building.set()
+            # Holds the write lock of the database like a long index build
+            time.sleep(0.4)
+        return step
+
+    def migration(cursor):
+        for step in migration.steps:
+            step(cursor)
+    migration.steps = tuple(slow_step(sql) for sql in database.ANALYSIS_KEY_INDEXES)
+    monkeypatch.setattr(database, 'MIGRATIONS', [
+        (version, migration if version == 3 else fn, online) for version, fn, online in database.MIGRATIONS
+    ])
+    # Far shorter than one build: without the raised timeout these writes would fail
+    monkeypatch.setattr(database, 'BUSY_TIMEOUT', 0.05)
+
+    db = database.SocialDatabase(str(path))
+    errors = []
+    written = 0
+    try:
+        assert building.wait(5)
+        while db.migration_thread.is_alive():
+            try:
+                db.create_analysis_key(written + 10, f'during-{written}', 1, 1)
+                written += 1
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+        db.migration_thread.join(5)
+
+        assert errors == []
+        assert written > 0
+        assert {'idx_analysis_keys_user_session', 'idx_analysis_keys_analysis'} <= schema_objects(path)
+        assert database.deferred_migrations(db.conn) == []
+        # Back to the normal timeout once the migration is done
+        assert db.conn.execute('PRAGMA busy_timeout').fetchone()[0] == 50
+    finally:
+        db.close()
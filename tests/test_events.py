@@ -0,0 +1,70 @@
+"""
+EventBroker: fan-out, replay after reconnect and the limits on open streams.
+
+    python -m pytest tests
+"""
+import pytest
+
+from social_plugin.events import EventBroker, TooManySubscribers
+
+
+def frames(broker, subscriber):
+    """Everything a stream sends until it ends"""
+    return list(broker.stream(subscriber))
+
+
+def test_stream_ends_after_idle_timeout():
+    broker = EventBroker(heartbeat=0.05, idle_timeout=0.2)
+    subscriber = broker.subscribe()
+    body = frames(broker, subscriber)
+    assert body[0].startswith(b'retry:')
+    # Heartbeats until the idle timeout, then the thread is given back
+    assert body.count(b': keepalive\n\n') >= 2
+    assert broker.status()["subscribers"] == 0
+
+
+def test_events_restart_the_idle_timeout():
+    broker = EventBroker(heartbeat=0.05, idle_timeout=0.15)
+    subscriber = broker.subscribe()
+    stream = broker.stream(subscriber)
+    assert next(stream).startswith(b'retry:')
+    broker.publish('key.created', {"key": "k"})
+    assert b'event: key.created' in next(stream)
+    rest = list(stream)
+    assert rest and all(frame == b': keepalive\n\n' for frame in rest)
+
+
+def test_zero_idle_timeout_keeps_streams_open():
+    broker = EventBroker(heartbeat=0.01, idle_timeout=0)
+    stream = broker.stream(broker.subscribe())
+    next(stream)
+    assert [next(stream) for _ in range(30)] == [b': keepalive\n\n'] * 30
+    stream.close()
+    assert broker.status()["subscribers"] == 0
+
+
+def test_subscriber_limit():
+    broker = EventBroker(max_subscribers=2)
+    first = broker.subscribe()
+    broker.subscribe()
+    with pytest.raises(TooManySubscribers):
+        broker.subscribe()
+    broker.unsubscribe(first)
+    broker.subscribe()
+    assert broker.status()["max_subscribers"] == 2
+
+
+def test_reconnect_replays_missed_events():
+    broker = EventBroker(heartbeat=0.01, idle_timeout=0.05)
+    broker.publish('key.created', {"key": "a"})
+    last_id = f'{broker.epoch}-1'
+    broker.publish('key.updated', {"key": "a"})
+    broker.publish('key.deleted', {"key": "a"})
+
+    body = b''.join(frames(broker, broker.subscribe(last_id)))
+    assert b'key.created' not in body
+    assert b'key.updated' in body and b'key.deleted' in body
+
+    # An id of an earlier process cannot be replayed
+    body = b''.join(frames(broker, broker.subscribe('0000-1')))
+    assert b'event: reset' in body
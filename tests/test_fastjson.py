@@ -0,0 +1,16 @@
+"""
+fastjson: server bodies embedded in response envelopes without parsing them.
+"""
+from social_plugin.fastjson import RAW_JSON, dumps_response_raw, loads
+
+
+def test_raw_body_is_embedded_as_is():
+    raw = b'{"key": "abc", "rates": [1, 2.50, null]}'
+    body = dumps_response_raw({"status": "success", "data": {"local": {"key": "abc"}, "server": RAW_JSON}}, raw)
+    assert raw in body
+    assert loads(body) == {"status": "success", "data": {"local": {"key": "abc"}, "server": loads(raw)}}
+
+
+def test_placeholder_text_in_the_data_falls_back_to_parsing():
+    envelope = {"result": RAW_JSON, "note": [RAW_JSON]}
+    assert loads(dumps_response_raw(envelope, b'[1]')) == {"result": [1], "note": [[1]]}
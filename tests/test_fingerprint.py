@@ -0,0 +1,74 @@
+"""
+Session fingerprint: the cache and idempotency key of a share change exactly when its content does.
+"""
+import sqlite3
+
+import pytest
+
+from social_plugin.snapshot import SnapshotReader, session_fingerprint
+
+
+@pytest.fixture
+def fingerprint(aetherone_db):
+    reader = SnapshotReader(str(aetherone_db))
+
+    def fingerprint(session_id=1):
+        with reader.snapshot() as dao:
+            return dao.fingerprint_session(session_id)
+    return fingerprint
+
+
+@pytest.fixture
+def host(aetherone_db):
+    conn = sqlite3.connect(str(aetherone_db))
+    yield conn
+    conn.close()
+
+
+def test_unchanged_session_keeps_its_fingerprint(fingerprint):
+    assert fingerprint() == fingerprint()
+    assert fingerprint(99) is None
+
+
+def test_host_dao_has_no_fingerprint():
+    assert session_fingerprint(object(), 1) is None
+
+
+@pytest.mark.parametrize('statement', [
+    "UPDATE sessions SET description = 'edited' WHERE id = 1",
+    "UPDATE cases SET name = 'renamed' WHERE id = 1",
+    "UPDATE analysis SET note = 'edited' WHERE id = 2",
+    "UPDATE catalog SET name = 'renamed' WHERE id = 1",
+    "INSERT INTO rates (catalogID, signature) VALUES (1, 'new')",
+    "INSERT INTO rate_analysis (analysis_id, catalog_id, signature) VALUES (2, 1, 'new')",
+    "DELETE FROM rate_analysis WHERE id = 5",
+    # Edited in place by the host app
+    "UPDATE rate_analysis SET gv = gv + 1 WHERE id = 5",
+    "UPDATE rate_analysis SET energetic_value = 0 WHERE id = 5",
+    "UPDATE rate_analysis SET potencyType = 'C' WHERE id = 5",
+    "UPDATE rate_analysis SET note = 'checked' WHERE id = 5",
+])
+def test_content_changes_change_the_fingerprint(fingerprint, host, statement):
+    before = fingerprint()
+    host.execute(statement)
+    host.commit()
+    assert fingerprint() != before
+
+
+def test_swapped_values_change_the_fingerprint(fingerprint, host):
+    # Same sums, but on other rows
+    before = fingerprint()
+    host.execute('UPDATE rate_analysis SET gv = CASE id WHEN 1 THEN (SELECT gv FROM rate_analysis WHERE id = 2) '
+                 'ELSE (SELECT gv FROM rate_analysis WHERE id = 1) END WHERE id IN (1, 2)')
+    host.commit()
+    assert fingerprint() != before
+
+
+def test_other_sessions_do_not_change_it(fingerprint, host):
+    before = fingerprint()
+    host.execute("INSERT INTO sessions VALUES (2, 1, 'other', NULL, '2024-01-02')")
+    host.execute("INSERT INTO analysis VALUES (10, 2, 1, 500, NULL, '2024-01-02')")
+    host.execute("INSERT INTO rate_analysis (analysis_id, catalog_id, signature) VALUES (10, 1, 'other')")
+    host.commit()
+    assert fingerprint() == before
+    assert fingerprint(2) is not None
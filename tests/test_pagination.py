@@ -0,0 +1,67 @@
+"""
+Paging of analysis results: request parameters, local pages and the parsed result cache.
+"""
+import time
+
+from werkzeug.datastructures import MultiDict
+
+from social_plugin.pagination import ParsedResultCache, paginate_items, parse_page_args
+from social_plugin.upstream import UpstreamClient
+
+
+def test_no_parameters_means_no_paging():
+    assert parse_page_args(MultiDict()) is None
+    assert parse_page_args(MultiDict({'fields': ''})) is None
+
+
+def test_fields_alone_only_projects():
+    assert parse_page_args(MultiDict({'fields': 'intention, description,'})) == (None, None, ['intention', 'description'])
+
+
+def test_page_or_limit_turn_paging_on():
+    assert parse_page_args(MultiDict({'page': '3'})) == (3, 20, None)
+    assert parse_page_args(MultiDict({'limit': '5', 'fields': 'id'})) == (1, 5, ['id'])
+    # Clamped to 1..max_limit, bad numbers count as missing
+    assert parse_page_args(MultiDict({'page': '0', 'limit': '100000'})) == (1, 500, None)
+    assert parse_page_args(MultiDict({'page': 'x', 'limit': '-4'})) == (1, 1, None)
+
+
+def test_paginate_items():
+    items = [{'id': i, 'name': f'n{i}', 'big': 'x' * 10} for i in range(1, 46)]
+    page, info = paginate_items(items, 3, 20, ['name'])
+    assert page == [{'id': i, 'name': f'n{i}'} for i in range(41, 46)]
+    assert info == {'page': 3, 'limit': 20, 'total': 45, 'pages': 3}
+
+    assert paginate_items(items, 4, 20) == ([], {'page': 4, 'limit': 20, 'total': 45, 'pages': 3})
+    assert paginate_items([], 1, 20)[1]['pages'] == 0
+
+
+def test_no_limit_returns_every_item_projected():
+    items = [{'id': 1, 'name': 'a', 'big': 'x'}, {'id': 2, 'name': 'b', 'big': 'y'}]
+    assert paginate_items(items, None, None, ['name']) == ([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}], None)
+
+
+def test_parsed_result_cache_expires_and_evicts():
+    cache = ParsedResultCache(ttl=0.05, max_entries=2)
+    cache.set('a', [1])
+    assert cache.get('a') == [1]
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+    cache.set('a', [1])
+    cache.set('b', [2])
+    cache.set('c', [3])
+    assert cache.get('a') is None
+    assert cache.get('c') == [3]
+    cache.invalidate('c')
+    assert cache.get('c') is None
+
+
+def test_server_features_are_remembered_per_server(monkeypatch):
+    monkeypatch.setenv('UPSTREAM_ASYNC', '0')
+    client = UpstreamClient('https://one.example', None, lambda: None)
+    client.record_support('key_batch', 'https://one.example/api/keys/batch', False)
+
+    assert client.supports('key_batch', 'https://one.example/api/keys/batch') is False
+    assert client.supports('key_batch', 'https://two.example/api/keys/batch') is None
+    assert client.supports('paging', 'https://one.example/api/analysis/key/k') is None
@@ -0,0 +1,90 @@
+"""
+SharePayloadCache: entries valid per session fingerprint, the memory limit and pre-warming.
+"""
+import threading
+
+from social_plugin.payload_cache import SharePayloadCache
+
+MB = 1024 * 1024
+
+
+def test_entry_is_valid_only_for_its_fingerprint():
+    cache = SharePayloadCache(max_mb=1)
+    cache.set((1, 'key'), 'fp1', {"payload": 1}, 100)
+    assert cache.get((1, 'key'), 'fp1') == {"payload": 1}
+    assert cache.get((1, 'key'), 'fp2') is None
+    assert cache.get((1, 'key'), None) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_leave_first():
+    cache = SharePayloadCache(max_mb=1)
+    cache.set('a', 'fp', 'A', MB // 2)
+    cache.set('b', 'fp', 'B', MB // 2)
+    cache.get('a', 'fp')
+    cache.set('c', 'fp', 'C', MB // 2)
+    assert cache.get('b', 'fp') is None
+    assert cache.get('a', 'fp') == 'A'
+    assert cache.used == MB
+
+    # Larger than the whole cache: not kept at all
+    cache.set('huge', 'fp', 'H', 2 * MB)
+    assert cache.get('huge', 'fp') is None
+    assert cache.status()["entries"] == 2
+
+
+def test_replacing_an_entry_frees_its_size():
+    cache = SharePayloadCache(max_mb=1)
+    cache.set('a', 'fp1', 'A1', 1000)
+    cache.set('a', 'fp2', 'A2', 300)
+    assert cache.used == 300
+    assert cache.get('a', 'fp2') == 'A2'
+
+
+def test_invalidate_where():
+    cache = SharePayloadCache(max_mb=1)
+    for session_id in (1, 2, 3):
+        cache.set((session_id, 'key'), 'fp', session_id, 10)
+    cache.invalidate_where(lambda key: key[0] in (1, 3))
+    assert cache.status()["entries"] == 1
+    assert cache.used == 10
+    cache.invalidate()
+    assert cache.used == 0
+
+
+def test_disabled_cache_keeps_nothing():
+    cache = SharePayloadCache(max_mb=0)
+    cache.set('a', 'fp', 'A', 10)
+    assert cache.get('a', 'fp') is None
+    assert cache.prewarm('a', lambda: ('fp', 'A', 10)) is False
+
+
+def test_get_waits_for_a_running_prewarm():
+    cache = SharePayloadCache(max_mb=1, wait_timeout=5)
+    release = threading.Event()
+    builds = []
+
+    def build():
+        release.wait(5)
+        builds.append(1)
+        return 'fp', 'built', 10
+
+    assert cache.prewarm('a', build)
+    # Already being built
+    assert not cache.prewarm('a', build)
+    threading.Timer(0.1, release.set).start()
+    assert cache.get('a', 'fp') == 'built'
+    assert builds == [1]
+    assert cache.status()["warming"] == 0
+
+
+def test_failed_prewarm_is_forgotten():
+    cache = SharePayloadCache(max_mb=1, wait_timeout=5)
+
+    def build():
+        raise RuntimeError('aetherone.db is locked')
+
+    assert cache.prewarm('a', build)
+    assert cache.get('a', 'fp') is None
+    assert cache.prewarm('a', lambda: ('fp', 'built', 10))
+    assert cache.get('a', 'fp') == 'built'
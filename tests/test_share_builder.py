@@ -0,0 +1,70 @@
+"""
+Share builds: the default serial read and the consistency check of the worker pools.
+"""
+import sqlite3
+
+import pytest
+
+from social_plugin.share_builder import ParallelShareBuilder, read_catalog_rates, read_rate_analysis
+from social_plugin.share_codec import MemoryBudget
+from social_plugin.snapshot import SnapshotReader
+
+
+def serial_parts(dao, analyses):
+    catalog_rates = {}
+    for analysis in analyses:
+        if analysis.catalogId not in catalog_rates:
+            catalog_rates[analysis.catalogId] = read_catalog_rates(dao, analysis.catalogId, MemoryBudget(0))
+    return catalog_rates, [read_rate_analysis(dao, analysis.id, MemoryBudget(0)) for analysis in analyses]
+
+
+@pytest.fixture
+def reader(aetherone_db):
+    return SnapshotReader(str(aetherone_db))
+
+
+def build(builder, dao):
+    analyses = dao.list_analysis(1)
+    return builder.build(dao, 1, [a.id for a in analyses], [a.catalogId for a in analyses], MemoryBudget(0))
+
+
+def test_default_pool_is_serial(reader, monkeypatch):
+    monkeypatch.delenv('SHARE_BUILD_POOL', raising=False)
+    builder = ParallelShareBuilder(reader, workers=4)
+    dao = reader.open()
+    try:
+        assert builder.pool == 'serial'
+        # None: the caller reads the session in its snapshot
+        assert build(builder, dao) is None
+    finally:
+        dao.close()
+
+
+def test_thread_pool_matches_the_serial_read(reader):
+    builder = ParallelShareBuilder(reader, pool='thread', workers=3)
+    dao = reader.open()
+    try:
+        expected = serial_parts(dao, dao.list_analysis(1))
+        assert build(builder, dao) == expected
+        assert builder.status()['parallel_builds'] == 1
+    finally:
+        dao.close()
+
+
+def test_thread_pool_drops_parts_read_after_a_change(reader, aetherone_db):
+    builder = ParallelShareBuilder(reader, pool='thread', workers=3)
+    dao = reader.open()
+    try:
+        # Committed after the share's snapshot started: the workers would see it
+        conn = sqlite3.connect(str(aetherone_db))
+        conn.execute('UPDATE rate_analysis SET gv = gv + 1 WHERE analysis_id = 2')
+        conn.commit()
+        conn.close()
+
+        assert build(builder, dao) is None
+        assert builder.status()['fallbacks'] == 1
+        # The serial read still sees the snapshot
+        gv = serial_parts(dao, dao.list_analysis(1))[1][1][0]['values']['gv']
+        assert gv == [(i * 53) % 2000 for i in range(20)]
+    finally:
+        dao.close()
@@ -0,0 +1,89 @@
+"""
+Share wire formats: encode/decode round trips and per-server format negotiation.
+"""
+import pytest
+
+from social_plugin import share_codec
+from social_plugin.share_codec import ShareFormatNegotiator
+
+SERVER = 'https://social.example'
+
+ANALYSIS = {
+    'analysis': {'id': 5, 'name': 'first'},
+    'rates': [{'id': 1, 'signature': 'a', 'description': None},
+              {'id': 2, 'signature': 'b', 'description': 'x'}],
+    'rate_analysis': [{'id': 9, 'signature': 'a', 'energetic_value': 120, 'gv': 400, 'note': ''}],
+}
+PAYLOAD = {
+    'key': 'k',
+    'data': {'analyses': {'session': {'id': 3, 'intention': 'test'}, 'analyses': [ANALYSIS]}},
+}
+
+
+@pytest.mark.parametrize('wire_format', ['json', 'msgpack'])
+def test_round_trip(wire_format):
+    if wire_format == 'msgpack' and share_codec.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    body, headers = share_codec.encode_share_payload(PAYLOAD, wire_format)
+    assert share_codec.decode_share_payload(body, headers['Content-Type']) == PAYLOAD
+
+
+def test_columnar_blocks_are_written_as_json_rows():
+    columnar = share_codec.columnarize_payload(PAYLOAD)
+    assert columnar['data']['analyses']['analyses'][0]['rates']['count'] == 2
+    assert share_codec.loads(share_codec.dumps_row_payload(columnar)) == PAYLOAD
+
+    empty = {'key': 'k', 'data': {'analyses': {'analyses': [{**ANALYSIS, 'rates': []}]}}}
+    assert share_codec.decolumnarize_payload(share_codec.columnarize_payload(empty)) == empty
+
+
+def test_auto_sends_json_until_msgpack_is_advertised():
+    negotiator = ShareFormatNegotiator('auto')
+    assert negotiator.formats_for(SERVER) == ['json']
+
+    negotiator.observe(SERVER, {'Content-Type': 'application/json'})
+    assert negotiator.formats_for(SERVER) == ['json']
+
+    if share_codec.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    negotiator.observe(SERVER, {'Accept-Post': 'application/json, application/msgpack'})
+    assert negotiator.formats_for(SERVER) == ['msgpack', 'json']
+    assert negotiator.formats_for('https://other.example') == ['json']
+
+
+@pytest.mark.parametrize('status_code', [400, 415, 422])
+def test_rejected_msgpack_is_retried_as_json(status_code):
+    negotiator = ShareFormatNegotiator('auto')
+    negotiator.observe(SERVER, {'X-Share-Formats': 'application/msgpack'})
+
+    assert negotiator.rejected(SERVER, 'msgpack', status_code)
+    # The JSON retry went through: the server cannot read msgpack
+    assert not negotiator.rejected(SERVER, 'json', 200)
+    assert negotiator.formats_for(SERVER) == ['json']
+
+    # ...and advertising it again does not bring it back
+    negotiator.observe(SERVER, {'X-Share-Formats': 'application/msgpack'})
+    assert negotiator.formats_for(SERVER) == ['json']
+
+
+def test_share_error_keeps_the_format():
+    if share_codec.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    negotiator = ShareFormatNegotiator('auto')
+    negotiator.observe(SERVER, {'Accept-Post': 'application/msgpack'})
+
+    # Invalid share: both formats answer 422, so the error was not about the format
+    assert negotiator.rejected(SERVER, 'msgpack', 422)
+    assert not negotiator.rejected(SERVER, 'json', 422)
+    assert negotiator.formats_for(SERVER) == ['msgpack', 'json']
+
+    assert not negotiator.rejected(SERVER, 'msgpack', 500)
+    assert not negotiator.rejected(SERVER, 'msgpack', 201)
+
+
+def test_forced_formats_never_fall_back():
+    assert ShareFormatNegotiator('json').formats_for(SERVER) == ['json']
+    forced = ShareFormatNegotiator('msgpack')
+    if share_codec.msgpack is not None:
+        assert forced.formats_for(SERVER) == ['msgpack']
+    assert not forced.rejected(SERVER, 'msgpack', 415)
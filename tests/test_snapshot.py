@@ -0,0 +1,89 @@
+"""
+Read-only snapshot connections to aetherone.db used by exports.
+"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from social_plugin.snapshot import SnapshotError, SnapshotReader, iter_dao_batches
+
+
+@pytest.fixture
+def reader(aetherone_db):
+    return SnapshotReader(str(aetherone_db))
+
+
+def test_dao_reads_like_the_host_dao(reader):
+    with reader.snapshot() as dao:
+        session = dao.get_session(1)
+        assert session.caseID == session.case_id == 1
+        assert dao.get_case(1).created == datetime(2024, 1, 1, 10, 0)
+        assert [a.id for a in dao.list_analysis(1)] == [1, 2, 3]
+        assert dao.list_analysis(1)[0].catalogId == 2
+        assert len(dao.list_rates_from_catalog(1)) == 20
+        rate = dao.list_rates_for_analysis(2)[3]
+        assert (rate.potency_type, rate.gv) == ('D', (3 * 53) % 2000)
+        assert dao.get_session(99) is None
+
+
+def test_snapshot_does_not_see_later_commits(reader, aetherone_db):
+    with reader.snapshot() as dao:
+        before = len(dao.list_rates_for_analysis(1))
+        conn = sqlite3.connect(str(aetherone_db))
+        conn.execute("INSERT INTO rate_analysis (analysis_id, catalog_id, signature) VALUES (1, 2, 'new')")
+        conn.commit()
+        conn.close()
+        # WAL: the writer was not blocked, the export still reads its snapshot
+        assert len(dao.list_rates_for_analysis(1)) == before
+    with reader.snapshot() as dao:
+        assert len(dao.list_rates_for_analysis(1)) == before + 1
+
+
+def test_snapshot_is_read_only(reader):
+    with reader.snapshot() as dao:
+        with pytest.raises(sqlite3.OperationalError):
+            dao.conn.execute("DELETE FROM sessions")
+
+
+def test_iter_batches(reader):
+    with reader.snapshot() as dao:
+        batches = list(dao.iter_rates_for_analysis(2, ['signature', 'potencyType', 'missing'], batch_size=8))
+        assert [len(batch) for batch in batches] == [8, 8, 4]
+        assert tuple(batches[0][0]) == ('rate 1.0', 'D', None)
+        # The same through the helper the share builder uses
+        assert [len(b) for b in iter_dao_batches(dao, 'rates_for_analysis', 2, ['gv'], 8)] == [8, 8, 4]
+
+
+def test_iter_dao_batches_slices_a_host_dao(reader):
+    class HostDAO:
+        def __init__(self, dao):
+            self.dao = dao
+
+        def list_rates_from_catalog(self, catalog_id):
+            return self.dao.list_rates_from_catalog(catalog_id)
+
+    with reader.snapshot() as dao:
+        batches = list(iter_dao_batches(HostDAO(dao), 'rates_from_catalog', 1, ['signature', 'catalogID'], 15))
+    assert [len(batch) for batch in batches] == [15, 5]
+    assert batches[1][-1] == ('rate 1.19', 1)
+
+
+def test_missing_database_uses_the_fallback(tmp_path):
+    reader = SnapshotReader(str(tmp_path / 'missing.db'))
+    fallback = object()
+    with reader.snapshot(fallback=fallback) as dao:
+        assert dao is fallback
+    with pytest.raises(SnapshotError):
+        with reader.snapshot():
+            pass
+
+
+def test_data_version_moves_on_commits(reader, aetherone_db):
+    version = reader.data_version()
+    assert reader.data_version() == version
+    conn = sqlite3.connect(str(aetherone_db))
+    conn.execute("UPDATE sessions SET description = 'edited'")
+    conn.commit()
+    conn.close()
+    assert reader.data_version() != version
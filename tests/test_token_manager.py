@@ -0,0 +1,141 @@
+"""
+TokenManager: expiry from the JWT, refresh through the server, coalesced re-login.
+"""
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+from social_plugin.database import SocialDatabase
+from social_plugin.token_manager import TokenManager, jwt_expiry, token_identity
+
+REFRESH_URL = 'http://server/api/auth/refresh'
+LOGIN_URL = 'http://server/api/auth/login'
+
+
+def jwt(**claims) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b'=').decode()
+    return f"header.{payload}.signature"
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Answers POSTs per URL from `answers`; records (url, headers, data) of each"""
+
+    def __init__(self, answers, delay=0):
+        self.answers = answers
+        self.delay = delay
+        self.posts = []
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        self.posts.append((url, headers, data))
+        time.sleep(self.delay)
+        return self.answers[url]()
+
+    def urls(self):
+        return [url for url, _, _ in self.posts]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SocialDatabase(str(tmp_path / 'social.db'))
+    yield db
+    db.close()
+
+
+def manager(db, session, token, **kwargs):
+    db.upsert_user_token('user', 'user@example.com', token, 1)
+    return TokenManager(db, session, REFRESH_URL, LOGIN_URL, timeout=1, **kwargs)
+
+
+def test_jwt_claims():
+    token = jwt(sub=7, exp=1700000000)
+    assert jwt_expiry(token) == 1700000000
+    assert jwt_expiry('not-a-jwt') is None
+    # The subject survives a refresh, plain tokens are told apart by a hash
+    assert token_identity(token) == token_identity(jwt(sub=7, exp=1800000000)) == 'sub:7'
+    assert token_identity('plain').startswith('token:')
+    assert token_identity('plain') != token_identity('other')
+
+
+def test_valid_token_refreshes_only_near_expiry(db):
+    fresh = jwt(sub=1, exp=time.time() + 3600)
+    session = FakeSession({REFRESH_URL: lambda: FakeResponse(200, {"access_token": "new", "expires_in": 3600})})
+    tokens = manager(db, session, fresh, refresh_margin=60)
+    assert tokens.valid_token(fresh) == fresh
+    assert session.posts == []
+
+    stale = jwt(sub=1, exp=time.time() + 30)
+    db.update_user_token('user@example.com', stale)
+    assert tokens.valid_token(stale) == 'new'
+    assert session.posts[0][1]["Authorization"] == f"Bearer {stale}"
+    assert tokens.current_token() == 'new'
+    assert tokens.expires_at('new') == pytest.approx(time.time() + 3600, abs=5)
+
+
+def test_concurrent_refreshes_share_one_call(db):
+    session = FakeSession({REFRESH_URL: lambda: FakeResponse(200, {"access_token": "new"})}, delay=0.1)
+    tokens = manager(db, session, 'stale')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.refresh('stale'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['new'] * 5
+    assert session.urls() == [REFRESH_URL]
+
+
+def test_missing_refresh_endpoint_falls_back_to_relogin(db):
+    session = FakeSession({
+        REFRESH_URL: lambda: FakeResponse(404),
+        LOGIN_URL: lambda: FakeResponse(200, {"access_token": "relogged", "username": "user",
+                                              "email": "user@example.com", "user_id": 1}),
+    })
+    tokens = manager(db, session, 'stale')
+    tokens.remember_login('user@example.com', 'secret', {"access_token": 'stale'})
+
+    assert tokens.refresh('stale') == 'relogged'
+    assert session.urls() == [REFRESH_URL, LOGIN_URL]
+    assert session.posts[1][2] == {"username": "user@example.com", "password": "secret"}
+    assert tokens.refresh_supported is False
+    assert tokens.current_token() == 'relogged'
+
+    # The endpoint is not asked again
+    assert tokens.refresh('relogged') == 'relogged'
+    assert session.urls() == [REFRESH_URL, LOGIN_URL, LOGIN_URL]
+    assert tokens.status()["can_relogin"] is True
+
+
+def test_refresh_without_credentials_gives_up(db):
+    session = FakeSession({REFRESH_URL: lambda: FakeResponse(401)})
+    tokens = manager(db, session, 'stale')
+    assert tokens.refresh('stale') is None
+    assert tokens.current_token() == 'stale'
+
+
+def test_token_is_refreshed_in_the_background_before_expiry(db):
+    session = FakeSession({REFRESH_URL: lambda: FakeResponse(200, {"access_token": "new", "expires_in": 3600})})
+    # Expires within the margin: the timer fires at once
+    tokens = manager(db, session, jwt(sub=1, exp=time.time() + 10), refresh_margin=60)
+    deadline = time.time() + 5
+    while tokens.current_token() != 'new' and time.time() < deadline:
+        time.sleep(0.02)
+    assert tokens.current_token() == 'new'
+    assert session.urls() == [REFRESH_URL]
+    tokens._timer.cancel()
@@ -0,0 +1,186 @@
+"""
+UpstreamClient against a local HTTP server: circuit breaker, offline cache and the replay of queued writes.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from social_plugin.database import SocialDatabase
+from social_plugin.upstream import CircuitBreaker, UpstreamClient, UpstreamOffline
+
+
+class FakeServer:
+    """Answers every request with `status`; records (method, path, headers, body) of each"""
+
+    def __init__(self):
+        self.status = 200
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                server.requests.append((self.command, self.path, dict(self.headers), body))
+                payload = json.dumps({"path": self.path, "user": self.headers.get('Authorization')}).encode()
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def writes(self):
+        return [(method, path) for method, path, _, _ in self.requests if method != 'GET']
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('UPSTREAM_ASYNC', '0')
+    monkeypatch.setenv('UPSTREAM_REPLAY_INTERVAL', '0.05')
+    db = SocialDatabase(str(tmp_path / 'social.db'))
+    client = UpstreamClient(server.url, db, lambda: 'token', timeout=2, failure_threshold=2, reset_timeout=0.1)
+    yield client
+    # The replay thread ends once the queue is empty
+    wait_for(lambda: client._replay_thread is None)
+    db.close()
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_breaker_opens_after_threshold_and_probe_closes_it():
+    probe_ok = threading.Event()
+    closed = threading.Event()
+
+    def probe():
+        if not probe_ok.is_set():
+            raise ConnectionError('down')
+
+    breaker = CircuitBreaker(probe, failure_threshold=2, reset_timeout=0.05, on_close=closed.set)
+    breaker.record_failure('first')
+    assert breaker.allow()
+    breaker.record_failure('second')
+    assert not breaker.allow()
+    assert breaker.status()['last_error'] == 'second'
+
+    time.sleep(0.2)
+    assert not breaker.allow()
+    probe_ok.set()
+    assert closed.wait(2)
+    assert breaker.allow()
+    assert breaker.status()['failures'] == 0
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(lambda: None, failure_threshold=2)
+    breaker.record_failure('one')
+    breaker.record_success()
+    breaker.record_failure('two')
+    assert breaker.allow()
+
+
+def test_offline_reads_come_from_the_cache_of_the_same_user(client, server):
+    url = f"{server.url}/api/keys/abc"
+    assert client.get(url, headers=bearer('alice')).json()['path'] == '/api/keys/abc'
+
+    server.status = 503
+    for _ in range(2):
+        client.get(url, headers=bearer('alice'))
+    assert client.is_offline()
+
+    cached = client.get(url, headers=bearer('alice'))
+    assert cached.from_cache
+    assert cached.json() == {"path": "/api/keys/abc", "user": "Bearer alice"}
+    # Another user's token does not get alice's response
+    with pytest.raises(UpstreamOffline):
+        client.get(url, headers=bearer('bob'))
+    with pytest.raises(UpstreamOffline):
+        client.post(url, json={})
+
+
+def test_large_bodies_are_not_cached(client, server):
+    client.cache_max_bytes = 10
+    client.get(f"{server.url}/api/keys/abc", headers=bearer('alice'))
+    assert client.social_db.get_cached_response(client.cache_key(f"{server.url}/api/keys/abc", bearer('alice'))) is None
+
+
+def test_queued_writes_replay_in_order_once_the_server_answers(client, server):
+    server.status = 503
+    replayed = []
+    client.register_replay_handler('key_create', lambda payload, result: replayed.append(payload['n']))
+
+    client.queue_write('key_create', 'POST', f"{server.url}/api/keys", {"n": 1})
+    client.queue_write('key_create', 'POST', f"{server.url}/api/keys", {"n": 2}, headers={"Idempotency-Key": "k2"})
+    time.sleep(0.3)
+    assert client.social_db.count_pending_writes() == 2
+
+    server.status = 200
+    assert wait_for(lambda: client.social_db.count_pending_writes() == 0)
+    assert replayed == [1, 2]
+    assert server.writes() == [('POST', '/api/keys'), ('POST', '/api/keys')]
+    # Headers of the write are sent again, with the current token
+    _, _, headers, body = server.requests[-1]
+    assert headers['Idempotency-Key'] == 'k2'
+    assert headers['Authorization'] == 'Bearer token'
+    assert json.loads(body) == {"n": 2}
+
+
+def test_writes_queued_before_startup_replay_after_the_health_check(client, server):
+    client.social_db.enqueue_pending_write('key_use', 'PATCH', f"{server.url}/api/keys/abc", '{"used": true}')
+
+    client.schedule_replay()
+    assert wait_for(lambda: client.social_db.count_pending_writes() == 0)
+    # Health check first, then the write
+    assert [(method, path) for method, path, _, _ in server.requests] == [('GET', '/'), ('PATCH', '/api/keys/abc')]
+
+
+def test_overlapping_replays_send_each_write_once(client, server):
+    for n in range(5):
+        client.social_db.enqueue_pending_write('key_create', 'POST', f"{server.url}/api/keys", json.dumps({"n": n}))
+
+    threads = [threading.Thread(target=client.replay_pending) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    client.replay_pending()
+
+    assert client.social_db.count_pending_writes() == 0
+    assert sorted(json.loads(body)['n'] for method, _, _, body in server.requests if method == 'POST') == list(range(5))
+
+
+def test_rejected_write_is_dropped_and_the_rest_replayed(client, server):
+    client.social_db.enqueue_pending_write('key_create', 'POST', f"{server.url}/api/keys", '{"n": 1}')
+    server.status = 422
+    client.replay_pending()
+    assert client.social_db.count_pending_writes() == 0
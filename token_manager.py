@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def _jwt_claims(token: str) -> dict:
+    """Payload of a JWT (not verified), {} when the token is not a readable JWT"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else {}
+    except (IndexError, ValueError, AttributeError, TypeError):
+        return {}
+
+
+def jwt_expiry(token: str):
+    """`exp` claim of a JWT as a unix timestamp, or None when the token is not a readable JWT"""
+    exp = _jwt_claims(token).get('exp')
+    try:
+        return float(exp) if exp is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+def token_identity(token: str) -> str:
+    """
+    Who a bearer token belongs to: the JWT subject (stays the same across refreshes),
+    or a hash of the token itself when it is not a JWT with a `sub` claim
+    """
+    subject = _jwt_claims(token).get('sub')
+    if subject is not None:
+        return f"sub:{subject}"
+    return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+class TokenManager:
+    """
+    Keeps the bearer token in users.token valid:
+    - knows its expiry from the JWT `exp` claim or the server's `expires_in`
+    - refreshes it in the background `refresh_margin` seconds before it expires
+    - coalesces concurrent re-authentication into one call (callers pass the token that failed;
+      if another thread already replaced it, they just get the new one)
+    Refresh uses POST /api/auth/refresh with the current token; servers without that endpoint
+    fall back to a re-login with the credentials of the last login in this process (never stored on disk).
+    """
+
+    def __init__(self, social_db, session, refresh_url: str, login_url: str, timeout: float = 10.0,
+                 refresh_margin: float = None):
+        self.social_db = social_db
+        self.session = session
+        self.refresh_url = refresh_url
+        self.login_url = login_url
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin or float(os.getenv('TOKEN_REFRESH_MARGIN', '120'))
+        self.refresh_supported = None
+        self._credentials = None
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._schedule(self.current_token())
+
+    def current_token(self):
+        user = self.social_db.get_only_user()
+        token = user.get('token') if user else None
+        return token.strip() if token else None
+
+    def expires_at(self, token: str):
+        if not token:
+            return None
+        return self._expires.get(token) or jwt_expiry(token)
+
+    def needs_refresh(self, token: str) -> bool:
+        expires_at = self.expires_at(token)
+        return expires_at is not None and time.time() >= expires_at - self.refresh_margin
+
+    def remember_login(self, email: str, password: str, response: dict):
+        """Called after a successful login/register with the server's JSON response"""
+        self._credentials = (email, password)
+        token = response.get('access_token')
+        if token and response.get('expires_in'):
+            self._expires[token] = time.time() + float(response['expires_in'])
+        self._schedule(token)
+
+    def valid_token(self, token: str) -> str:
+        """Token to send instead of `token`: refreshed first when it is (about to be) expired"""
+        if token and self.needs_refresh(token):
+            return self.refresh(token) or token
+        return token
+
+    def refresh(self, stale_token: str):
+        """Replace stale_token; concurrent callers with the same stale token share one refresh"""
+        with self._lock:
+            current = self.current_token()
+            if current and current != stale_token:
+                return current
+            token = self._refresh_call(stale_token)
+            if token:
+                self._schedule(token)
+            return token
+
+    def _refresh_call(self, stale_token: str):
+        user = self.social_db.get_only_user()
+        if self.refresh_supported is not False and stale_token:
+            try:
+                resp = self.session.post(
+                    self.refresh_url,
+                    headers={"Authorization": f"Bearer {stale_token}", "Accept": "application/json"},
+                    timeout=self.timeout
+                )
+                if resp.status_code in (404, 405):
+                    print("[DEBUG] Server has no token refresh endpoint, will re-login instead")
+                    self.refresh_supported = False
+                elif resp.ok:
+                    self.refresh_supported = True
+                    data = resp.json()
+                    token = data.get('access_token')
+                    if token and user:
+                        if data.get('expires_in'):
+                            self._expires[token] = time.time() + float(data['expires_in'])
+                        self.social_db.update_user_token(user['email'], token)
+                        print("[DEBUG] Token refreshed")
+                        return token
+            except Exception as e:
+                print(f"[DEBUG] Token refresh failed: {e}")
+        if self._credentials:
+            email, password = self._credentials
+            try:
+                resp = self.session.post(self.login_url, data={"username": email, "password": password},
+                                         timeout=self.timeout)
+                resp.raise_for_status()
+                data = resp.json()
+                token = data.get('access_token')
+                self.social_db.upsert_user_token(data.get('username'), data.get('email'), token, data.get('user_id'))
+                if token and data.get('expires_in'):
+                    self._expires[token] = time.time() + float(data['expires_in'])
+                print("[DEBUG] Re-logged in to refresh token")
+                return token
+            except Exception as e:
+                print(f"[DEBUG] Re-login failed: {e}")
+        return None
+
+    def _schedule(self, token: str):
+        """Arm a timer that refreshes `token` shortly before it expires"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        expires_at = self.expires_at(token)
+        if expires_at is None:
+            return
+        delay = max(expires_at - self.refresh_margin - time.time(), 0)
+        self._timer = threading.Timer(delay, self._background_refresh, args=(token,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self, token: str):
+        if self.current_token() == token:
+            print("[DEBUG] Refreshing token ahead of expiry")
+            self.refresh(token)
+
+    def status(self) -> dict:
+        token = self.current_token()
+        return {
+            "has_token": bool(token),
+            "expires_at": self.expires_at(token),
+            "refresh_supported": self.refresh_supported,
+            "can_relogin": self._credentials is not None
+        }
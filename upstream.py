@@ -0,0 +1,848 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import fastjson
+from .token_manager import token_identity
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class UpstreamOffline(requests.ConnectionError):
+    """Raised when the circuit breaker is open and the social server is treated as offline"""
+
+
+class UpstreamBusy(requests.ConnectionError):
+    """Raised when no request slot of the social server's limiter frees up within UPSTREAM_QUEUE_TIMEOUT"""
+
+
+def retry_after_seconds(resp):
+    """Retry-After of a response in seconds (delta-seconds or HTTP date), None when absent or unreadable"""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Outbound limits for one social server: a token bucket of `rate` requests per second
+    (bursts up to `burst`) and at most `limit` requests in flight. The concurrency limit is
+    AIMD: it grows by 1/limit per fast response (about one per round of requests) and halves
+    on a 429/503, a failed call, or when the average latency climbs past `latency_factor` times
+    the fastest recent one. A 429 also halves the rate and pauses every request for its
+    Retry-After. The rate recovers additively up to `max_rate`.
+    """
+
+    def __init__(self, max_rate: float, burst: float, max_concurrency: int, latency_factor: float = 3.0,
+                 max_pause: float = 120.0):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.max_limit = max_concurrency
+        self.limit = float(max_concurrency)
+        self.latency_factor = latency_factor
+        self.max_pause = max_pause
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.min_latency = None
+        self.latency = None
+        self.throttled = 0
+        self.waited = 0
+        self.rejected = 0
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire(self, timeout: float) -> float:
+        """Wait for a token and a free slot; returns the start time to pass to release()"""
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                slot_free = self.in_flight < int(self.limit)
+                if slot_free and now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    if waited:
+                        self.waited += 1
+                    return now
+                if now >= deadline:
+                    self.rejected += 1
+                    raise UpstreamBusy(f"No upstream request slot within {timeout:g}s "
+                                       f"({self.in_flight} in flight, limit {int(self.limit)})")
+                waited = True
+                if slot_free:
+                    # Until the pause ends or the next token is due; a release wakes us earlier
+                    wait = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.001)
+                else:
+                    wait = deadline - now
+                self._cond.wait(min(wait, deadline - now))
+
+    def release(self, started: float, status: int = None, retry_after: float = None, failed: bool = False):
+        """Record the outcome of a request started by acquire() and free its slot"""
+        now = time.monotonic()
+        elapsed = now - started
+        with self._cond:
+            self.in_flight -= 1
+            if status == 429:
+                self.throttled += 1
+                self._decrease(now, rate=True)
+                pause = retry_after if retry_after is not None else 1.0
+                self.paused_until = max(self.paused_until, now + min(pause, self.max_pause))
+            elif failed or status == 503:
+                self._decrease(now)
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, now + min(retry_after, self.max_pause))
+            else:
+                # The fastest latency drifts up slowly, so a server that got slower for good is re-learned
+                if self.min_latency is None:
+                    self.min_latency = elapsed
+                else:
+                    self.min_latency = min(elapsed, self.min_latency + (elapsed - self.min_latency) * 0.01)
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+                if self.latency > max(self.min_latency * self.latency_factor, 0.05):
+                    if self._decrease(now):
+                        # If the latency stays up with half the requests, the server itself got slower:
+                        # take it as the new baseline instead of shrinking to one request at a time
+                        self.min_latency = max(self.min_latency, self.latency / self.latency_factor)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Free a slot that was acquired but not used"""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _decrease(self, now, rate: bool = False):
+        # At most once per round trip: the other requests of the same burst report the same overload
+        if now - self._decreased_at < max(self.latency or 0.0, 0.1):
+            return False
+        self._decreased_at = now
+        self.limit = max(1.0, self.limit / 2)
+        if rate:
+            self.rate = max(self.max_rate / 50, self.rate / 2)
+        return True
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "rate": round(self.rate, 2),
+                "max_rate": self.max_rate,
+                "concurrency_limit": int(self.limit),
+                "max_concurrency": self.max_limit,
+                "in_flight": self.in_flight,
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 1),
+                "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+                "min_latency_ms": round(self.min_latency * 1000) if self.min_latency is not None else None,
+                "throttled": self.throttled,
+                "waited": self.waited,
+                "rejected": self.rejected
+            }
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive upstream failures and opens after `failure_threshold` of them.
+    While open, calls fail fast and a background thread probes the server every
+    `reset_timeout` seconds (half-open) until it answers again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, probe, failure_threshold: int = 3, reset_timeout: float = 15.0, on_close=None):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_close = on_close
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                print(f"[DEBUG] Circuit breaker opened after {self.failures} failures: {error}")
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self._start_probe()
+
+    def _start_probe(self):
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name='social-upstream-probe', daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.reset_timeout)
+            with self._lock:
+                self.state = self.HALF_OPEN
+            try:
+                self.probe()
+            except Exception as e:
+                print(f"[DEBUG] Circuit breaker probe failed: {e}")
+                with self._lock:
+                    self.state = self.OPEN
+                    self.last_error = str(e)
+                continue
+            print("[DEBUG] Circuit breaker probe succeeded, closing circuit")
+            with self._lock:
+                self.state = self.CLOSED
+                self.failures = 0
+                self.opened_at = None
+            if self.on_close:
+                try:
+                    self.on_close()
+                except Exception as e:
+                    print(f"[DEBUG] Circuit breaker on_close failed: {e}")
+            return
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened_at": self.opened_at,
+                "last_error": self.last_error
+            }
+
+
+class AsyncTransport:
+    """
+    One aiohttp session on a dedicated event-loop thread. Any Flask worker can hand
+    requests to it, so hundreds of upstream calls can be in flight at once without
+    a thread each. Responses are converted to requests.Response objects and errors
+    to requests exceptions, so callers cannot tell the two paths apart.
+    """
+
+    def __init__(self, timeout: float, max_connections: int = 200):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.loop = asyncio.new_event_loop()
+        self._session = None
+        self.thread = threading.Thread(target=self._run, name='social-upstream-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, method, url, **kwargs):
+        return asyncio.run_coroutine_threadsafe(self.request(method, url, **kwargs), self.loop)
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        session = await self._get_session()
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        try:
+            async with session.request(method, url, **kwargs) as r:
+                body = await r.read()
+                resp = requests.Response()
+                resp.status_code = r.status
+                resp.reason = r.reason
+                resp.headers.update(r.headers)
+                # aiohttp already decompressed the body, these described the encoded one
+                resp.headers.pop('Content-Encoding', None)
+                resp.headers.pop('Content-Length', None)
+                resp._content = body
+                resp.encoding = r.charset
+                resp.url = str(r.url)
+                return resp
+        except asyncio.TimeoutError as e:
+            raise requests.Timeout(f"Timeout requesting {url}: {e}") from e
+        except aiohttp.ClientError as e:
+            raise requests.ConnectionError(f"Error requesting {url}: {e}") from e
+
+
+def copy_response(resp) -> requests.Response:
+    """Independent copy of a response whose body has been read, for another caller of a coalesced request"""
+    copy = requests.Response()
+    copy.status_code = resp.status_code
+    copy.reason = resp.reason
+    copy.headers = CaseInsensitiveDict(resp.headers)
+    copy._content = resp._content
+    copy._content_consumed = True
+    copy.encoding = resp.encoding
+    copy.url = resp.url
+    copy.request = resp.request
+    copy.elapsed = resp.elapsed
+    for attribute in ('from_cache', 'requested_url', 'cache_key', 'cached_at'):
+        if hasattr(resp, attribute):
+            setattr(copy, attribute, getattr(resp, attribute))
+    return copy
+
+
+class _Flight:
+    """One in-flight GET that identical concurrent GETs wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return copy_response(self.response)
+
+
+class PendingRequest:
+    """Handle for a request started with UpstreamClient.submit()"""
+
+    def __init__(self, client, method, url, future=None, response=None, error=None, kwargs=None, sent_token=None,
+                 cache_key=None):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.cache_key = cache_key or url
+        self.future = future
+        self.response = response
+        self.error = error
+        self.kwargs = kwargs
+        self.sent_token = sent_token
+
+    def result(self):
+        if self.future is not None:
+            future, self.future = self.future, None
+            try:
+                self.response = self.client._on_response(self.method, self.url, future.result(), cache_key=self.cache_key)
+            except requests.RequestException as e:
+                try:
+                    self.response = self.client._on_error(self.method, self.url, e, self.cache_key)
+                except requests.RequestException as e2:
+                    self.error = e2
+            if self.response is not None and self.response.status_code == 429 and not self.response.from_cache \
+                    and self.client.throttle_retries:
+                # The limiter now waits out Retry-After; the blocking path retries further 429s itself
+                try:
+                    self.response = self.client.request(self.method, self.url, **self.kwargs)
+                except requests.RequestException as e:
+                    self.error = e
+            if self.response is not None and self.response.status_code == 401 and not self.response.from_cache:
+                retry = self.client._retry_auth(self.kwargs, self.sent_token)
+                if retry is not None:
+                    try:
+                        self.response = self.client.request(self.method, self.url, **retry)
+                    except requests.RequestException as e:
+                        self.error = e
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class UpstreamClient:
+    """
+    Wraps all HTTP calls to the social server: applies a timeout, runs them through
+    a circuit breaker and a per-server AdaptiveLimiter, caches successful GET bodies in
+    social.db and replays writes that were queued while the server was offline.
+    """
+
+    def __init__(self, base_url: str, social_db, token_provider, timeout: float = None,
+                 failure_threshold: int = None, reset_timeout: float = None):
+        self.base_url = base_url
+        self.social_db = social_db
+        self.token_provider = token_provider
+        self.timeout = timeout or float(os.getenv('UPSTREAM_TIMEOUT', '10'))
+        self.session = requests.Session()
+        self.transport = None
+        self.auth = None
+        if aiohttp is not None and os.getenv('UPSTREAM_ASYNC', '1') != '0':
+            self.transport = AsyncTransport(
+                self.timeout, max_connections=int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '200'))
+            )
+        self.breaker = CircuitBreaker(
+            probe=self._probe,
+            failure_threshold=failure_threshold or int(os.getenv('UPSTREAM_FAILURE_THRESHOLD', '3')),
+            reset_timeout=reset_timeout or float(os.getenv('UPSTREAM_RESET_TIMEOUT', '15')),
+            on_close=self.replay_pending
+        )
+        self.cache_max_bytes = int(os.getenv('UPSTREAM_CACHE_MAX_BYTES', str(1024 * 1024)))
+        # Identical concurrent GETs (same URL, token and accept headers) share one upstream call
+        self.coalesce = os.getenv('UPSTREAM_COALESCE', '1') != '0'
+        self._flights = {}
+        self._futures = {}
+        self._flights_lock = threading.Lock()
+        self.coalesced = 0
+        self.replay_handlers = {}
+        self._replay_lock = threading.Lock()
+        # Queued writes are retried in the background every UPSTREAM_REPLAY_INTERVAL seconds until none are left
+        self.replay_interval = float(os.getenv('UPSTREAM_REPLAY_INTERVAL', '30'))
+        self._replay_thread = None
+        self._replay_thread_lock = threading.Lock()
+        # Outbound rate and concurrency per server (host:port), UPSTREAM_RATE_LIMIT=0 turns them off
+        self.rate_limit = os.getenv('UPSTREAM_RATE_LIMIT', '1') != '0'
+        self.queue_timeout = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '2'))
+        self.throttle_retries = int(os.getenv('UPSTREAM_429_RETRIES', '2'))
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        # (server, feature) -> whether the server has an optional endpoint or parameter
+        self._features = {}
+
+    def limiter(self, url):
+        """The AdaptiveLimiter of the server `url` points to, None when rate limiting is off"""
+        if not self.rate_limit:
+            return None
+        server = urlsplit(url).netloc
+        with self._limiters_lock:
+            limiter = self._limiters.get(server)
+            if limiter is None:
+                rate = float(os.getenv('UPSTREAM_RATE', '20'))
+                limiter = self._limiters[server] = AdaptiveLimiter(
+                    max_rate=rate,
+                    burst=float(os.getenv('UPSTREAM_BURST', str(rate))),
+                    max_concurrency=int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '16')),
+                    latency_factor=float(os.getenv('UPSTREAM_LATENCY_FACTOR', '3')),
+                    max_pause=float(os.getenv('UPSTREAM_MAX_RETRY_AFTER', '120'))
+                )
+            return limiter
+
+    def supports(self, feature: str, url: str):
+        """Whether the server `url` points to has `feature` (True/False), None until it was recorded"""
+        with self._limiters_lock:
+            return self._features.get((urlsplit(url).netloc, feature))
+
+    def record_support(self, feature: str, url: str, supported: bool):
+        with self._limiters_lock:
+            self._features[(urlsplit(url).netloc, feature)] = supported
+
+    # --- plain HTTP verbs ---
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the circuit breaker.
+        When the circuit is open, GETs are answered from the cache (response.from_cache is True)
+        and everything else raises UpstreamOffline.
+        A 401 on a bearer-authenticated request is retried once with a refreshed token.
+        Concurrent identical GETs are coalesced: one goes upstream, the others get a copy of its response.
+        """
+        key = self._flight_key(method, url, kwargs)
+        if key is None:
+            return self._request(method, url, **kwargs)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait()
+        try:
+            resp = self._request(method, url, **kwargs)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        return self._land(key, flight, response=resp)
+
+    def _flight_key(self, method, url, kwargs):
+        if not self.coalesce or method != 'GET' or kwargs.get('data') is not None or kwargs.get('json') is not None:
+            return None
+        headers = CaseInsensitiveDict(kwargs.get('headers') or {})
+        params = kwargs.get('params')
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        return (url, repr(params), headers.get('Authorization'), headers.get('Accept'),
+                headers.get('Accept-Encoding'))
+
+    def _land(self, key, flight, response=None, error=None):
+        """Finish a coalesced request and hand its result to the waiting callers"""
+        with self._flights_lock:
+            self._flights.pop(key, None)
+        flight.response = response
+        flight.error = error
+        flight.done.set()
+        if error is not None:
+            raise error
+        return response
+
+    def _request(self, method, url, **kwargs):
+        cache_key = self.cache_key(url, kwargs.get('headers'))
+        cached = self._before_request(method, url, cache_key)
+        if cached is not None:
+            return cached
+        kwargs.setdefault('timeout', self.timeout)
+        self._encode_json_body(kwargs)
+        sent_token = self._apply_auth(kwargs)
+        resp = self._send(method, url, kwargs, cache_key)
+        if resp.status_code == 401 and not resp.from_cache:
+            retry = self._retry_auth(kwargs, sent_token)
+            if retry is not None:
+                resp.close()
+                resp = self._send(method, url, retry, cache_key)
+        return resp
+
+    def _send(self, method, url, kwargs, cache_key):
+        limiter = self.limiter(url)
+        attempt = 0
+        while True:
+            started = limiter.acquire(self.queue_timeout) if limiter else None
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                if limiter:
+                    limiter.release(started, failed=True)
+                return self._on_error(method, url, e, cache_key)
+            if limiter:
+                limiter.release(started, resp.status_code, retry_after_seconds(resp))
+            if resp.status_code == 429 and attempt < self.throttle_retries:
+                # Rejected before it was processed: the next acquire() waits out Retry-After
+                attempt += 1
+                resp.close()
+                continue
+            return self._on_response(method, url, resp, cache_key=cache_key)
+
+    def submit(self, method, url, **kwargs) -> 'PendingRequest':
+        """
+        Start a request on the async event-loop thread and return immediately.
+        Falls back to a blocking call when aiohttp is not installed or UPSTREAM_ASYNC=0.
+        """
+        cache_key = self.cache_key(url, kwargs.get('headers'))
+        try:
+            cached = self._before_request(method, url, cache_key)
+        except UpstreamOffline as e:
+            return PendingRequest(self, method, url, error=e)
+        if cached is not None:
+            return PendingRequest(self, method, url, response=cached)
+        if self.transport is None:
+            try:
+                return PendingRequest(self, method, url, response=self.request(method, url, **kwargs))
+            except requests.RequestException as e:
+                return PendingRequest(self, method, url, error=e)
+        key = self._flight_key(method, url, kwargs)
+        kwargs.setdefault('timeout', self.timeout)
+        self._encode_json_body(kwargs)
+        sent_token = self._apply_auth(kwargs)
+        try:
+            future = self._submit_transport(key, method, url, kwargs)
+        except UpstreamBusy as e:
+            return PendingRequest(self, method, url, error=e)
+        return PendingRequest(self, method, url, future=future, kwargs=kwargs, sent_token=sent_token, cache_key=cache_key)
+
+    def _limited_submit(self, limiter, started, method, url, kwargs):
+        """Hand a request holding a limiter slot to the transport; the slot is freed when it completes"""
+        future = self.transport.submit(method, url, **kwargs)
+        if limiter:
+            def release(f):
+                if f.exception() is not None:
+                    limiter.release(started, failed=True)
+                else:
+                    limiter.release(started, f.result().status_code, retry_after_seconds(f.result()))
+            future.add_done_callback(release)
+        return future
+
+    def _submit_transport(self, key, method, url, kwargs):
+        """
+        Transport future; identical GETs already in flight get a future of a copy of that response.
+        Waiting for a limiter slot blocks the caller, which is the backpressure on bulk submits.
+        """
+        limiter = self.limiter(url)
+        if key is None:
+            started = limiter.acquire(self.queue_timeout) if limiter else None
+            return self._limited_submit(limiter, started, method, url, kwargs)
+        with self._flights_lock:
+            leader = self._futures.get(key)
+        started = None
+        if leader is None and limiter:
+            started = limiter.acquire(self.queue_timeout)
+        with self._flights_lock:
+            leader = self._futures.get(key)
+            if leader is None:
+                future = self._limited_submit(limiter, started, method, url, kwargs)
+                self._futures[key] = future
+            else:
+                self.coalesced += 1
+                if started is not None:
+                    # Another caller started the same GET while we waited for the slot
+                    limiter.cancel()
+        # Callbacks of an already finished future run right away, so add them outside the lock
+        if leader is None:
+            future.add_done_callback(lambda f: self._forget_future(key, f))
+            return future
+        follower = concurrent.futures.Future()
+
+        def copy_result(f):
+            if f.exception() is not None:
+                follower.set_exception(f.exception())
+            else:
+                follower.set_result(copy_response(f.result()))
+        leader.add_done_callback(copy_result)
+        return follower
+
+    def _forget_future(self, key, future):
+        with self._flights_lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def gather(self, pending: list) -> list:
+        """Wait for several submitted requests; returns responses or exceptions in the same order"""
+        results = []
+        for p in pending:
+            try:
+                results.append(p.result())
+            except requests.RequestException as e:
+                results.append(e)
+        return results
+
+    def fetch(self, method, url, **kwargs):
+        """Same contract as request(), but the I/O runs on the shared event loop"""
+        return self.submit(method, url, **kwargs).result()
+
+    @staticmethod
+    def _encode_json_body(kwargs):
+        """Encode json= bodies with fastjson (orjson, datetimes as ISO 8601) instead of the stdlib"""
+        if kwargs.get('json') is None:
+            kwargs.pop('json', None)
+            return
+        kwargs['data'] = fastjson.dumps(kwargs.pop('json'))
+        headers = dict(kwargs.get('headers') or {})
+        if not any(k.lower() == 'content-type' for k in headers):
+            headers['Content-Type'] = 'application/json'
+        kwargs['headers'] = headers
+
+    @staticmethod
+    def cache_key(url, headers=None) -> str:
+        """
+        Key of a GET in the offline cache: the URL plus who asked for it, so one user's cached
+        response is never replayed to another. Requests without a bearer token are keyed by URL.
+        """
+        value = CaseInsensitiveDict(headers or {}).get('Authorization') or ''
+        if not value.startswith('Bearer ') or not value[len('Bearer '):].strip():
+            return url
+        return f"{url} {token_identity(value[len('Bearer '):].strip())}"
+
+    def _before_request(self, method, url, cache_key):
+        if self.breaker.allow():
+            return None
+        if method == 'GET':
+            cached = self._cached_response(url, cache_key)
+            if cached is not None:
+                return cached
+        raise UpstreamOffline(f"Social server is offline ({self.breaker.last_error})")
+
+    def _on_error(self, method, url, error, cache_key):
+        self.breaker.record_failure(error)
+        if method == 'GET' and not self.breaker.allow():
+            cached = self._cached_response(url, cache_key)
+            if cached is not None:
+                return cached
+        raise error
+
+    def _on_response(self, method, url, resp, cache_key=None):
+        cache_key = cache_key or url
+        if resp.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {resp.status_code} from {url}")
+        else:
+            self.breaker.record_success()
+            if method == 'GET' and resp.status_code == 200 and len(resp.content) <= self.cache_max_bytes:
+                self.social_db.save_cached_response(cache_key, resp.status_code, resp.headers.get('Content-Type'), resp.content)
+        resp.from_cache = False
+        resp.requested_url = url
+        resp.cache_key = cache_key
+        return resp
+
+    # --- bearer token lifecycle (see token_manager.py) ---
+    def set_auth(self, token_manager):
+        self.auth = token_manager
+
+    def _apply_auth(self, kwargs):
+        """Swap an expiring bearer token for a fresh one before sending; returns the token that is sent"""
+        headers = kwargs.get('headers') or {}
+        value = headers.get('Authorization', '')
+        if self.auth is None or not value.startswith('Bearer '):
+            return None
+        token = value[len('Bearer '):].strip()
+        fresh = self.auth.valid_token(token)
+        if fresh != token:
+            kwargs['headers'] = {**headers, 'Authorization': f"Bearer {fresh}"}
+        return fresh
+
+    def _retry_auth(self, kwargs, sent_token):
+        """After a 401: refresh the token once (coalesced across threads) and return kwargs for the retry"""
+        if self.auth is None or not sent_token:
+            return None
+        fresh = self.auth.refresh(sent_token)
+        if not fresh or fresh == sent_token:
+            return None
+        return {**kwargs, 'headers': {**kwargs['headers'], 'Authorization': f"Bearer {fresh}"}}
+
+    def _cached_response(self, url, cache_key):
+        row = self.social_db.get_cached_response(cache_key)
+        if not row:
+            return None
+        resp = requests.Response()
+        resp.status_code = row['status_code']
+        resp._content = row['body']
+        resp.headers['Content-Type'] = row['content_type'] or 'application/json'
+        resp.url = url
+        resp._content_consumed = True
+        resp.from_cache = True
+        resp.cached_at = row['fetched_at']
+        return resp
+
+    def _probe(self):
+        resp = self.session.get(f"{self.base_url}/", timeout=self.timeout)
+        if resp.status_code >= 500:
+            raise requests.HTTPError(f"HTTP {resp.status_code}")
+
+    def is_offline(self) -> bool:
+        return not self.breaker.allow()
+
+    def status(self) -> dict:
+        status = self.breaker.status()
+        status["base_url"] = self.base_url
+        status["pending_writes"] = self.social_db.count_pending_writes()
+        status["coalesced_requests"] = self.coalesced
+        with self._limiters_lock:
+            limiters = dict(self._limiters)
+        status["limits"] = {server: limiter.status() for server, limiter in limiters.items()}
+        features = {}
+        with self._limiters_lock:
+            for (server, feature), supported in self._features.items():
+                features.setdefault(server, {})[feature] = supported
+        status["features"] = features
+        return status
+
+    # --- offline write queue ---
+    def register_replay_handler(self, kind: str, handler):
+        """handler(payload: dict, server_result: dict) is called after a queued write of `kind` is replayed"""
+        self.replay_handlers[kind] = handler
+
+    def queue_write(self, kind: str, method: str, url: str, payload=None, headers: dict = None) -> int:
+        """payload: dict, or its JSON already encoded (bytes/str); headers are sent again on replay (not auth)"""
+        print(f"[DEBUG] Queueing {kind} write for replay: {method} {url}")
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        elif payload is not None and not isinstance(payload, str):
+            payload = fastjson.dumps(payload).decode('utf-8')
+        write_id = self.social_db.enqueue_pending_write(
+            kind, method, url, payload, json.dumps(headers) if headers else None
+        )
+        self.schedule_replay()
+        return write_id
+
+    def schedule_replay(self):
+        """
+        Replay queued writes in the background until none are left: first after a successful
+        health check of the server, then every replay_interval seconds while writes remain.
+        Called at startup and whenever a write is queued; one replay thread at most.
+        """
+        with self._replay_thread_lock:
+            if self._replay_thread is not None:
+                return
+            self._replay_thread = threading.Thread(target=self._replay_loop, name='social-upstream-replay', daemon=True)
+            self._replay_thread.start()
+
+    def _replay_loop(self):
+        healthy = False
+        while True:
+            with self._replay_thread_lock:
+                # Checked under the lock: a write queued after this starts a new thread
+                if not self.social_db.count_pending_writes():
+                    self._replay_thread = None
+                    return
+            if not healthy:
+                try:
+                    self._probe()
+                    healthy = True
+                except Exception as e:
+                    print(f"[DEBUG] Health check before replaying queued writes failed: {e}")
+            if healthy and not self.is_offline():
+                self.replay_pending()
+            time.sleep(self.replay_interval)
+
+    def replay_pending(self):
+        """Replay queued writes in order; stops at the first failure so ordering is kept"""
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            for row in self.social_db.get_pending_writes():
+                token = self.token_provider()
+                if not token:
+                    print("[DEBUG] No token available, postponing replay of queued writes")
+                    return
+                payload = json.loads(row['payload']) if row['payload'] else None
+                headers = json.loads(row['headers']) if row.get('headers') else {}
+                headers.update({"Authorization": f"Bearer {token.strip()}", "Accept": "application/json"})
+                try:
+                    resp = self.request(row['method'], row['url'], json=payload, headers=headers)
+                    if 400 <= resp.status_code < 500 and resp.status_code not in (401, 408, 429):
+                        # The server rejected it for good, retrying will not help
+                        print(f"[DEBUG] Dropping pending write {row['id']}: HTTP {resp.status_code} {resp.text}")
+                        self.social_db.delete_pending_write(row['id'])
+                        continue
+                    resp.raise_for_status()
+                except requests.RequestException as e:
+                    print(f"[DEBUG] Replay of pending write {row['id']} failed: {e}")
+                    self.social_db.mark_pending_write_failed(row['id'], str(e))
+                    return
+                try:
+                    result = resp.json()
+                except ValueError:
+                    result = None
+                handler = self.replay_handlers.get(row['kind'])
+                if handler:
+                    handler(payload, result)
+                self.social_db.delete_pending_write(row['id'])
+                print(f"[DEBUG] Replayed pending {row['kind']} write {row['id']}")
+        finally:
+            self._replay_lock.release()